@@ -0,0 +1,418 @@
+# coding=utf-8
+"""
+Benchmarks of the performance sensitive parts of the speech recognizer.
+
+Each benchmark is a sub-command, for example :
+    $ python benchmark.py lstm --num_layers 3 --checkpoint_dir trained_models/english/acoustic
+
+Heavy dependencies are imported by each benchmark so that a benchmark only needs its own dependencies.
+"""
+import argparse
+import time
+
+
+def benchmark_lstm(args):
+    """
+    Compare the forward speed (in frames per second) of the LSTM implementations of the acoustic model
+    """
+    import numpy as np
+    import tensorflow as tf
+    from models.AcousticModel import AcousticModel, LSTM_IMPLEMENTATIONS
+    from models.SpeechRecognizer import SpeechRecognizer
+
+    num_labels = SpeechRecognizer("english").get_char_map_length()
+    inputs = np.random.rand(args.seq_length, args.batch_size, args.input_dim).astype(np.float32)
+    input_seq_lengths = [args.seq_length] * args.batch_size
+
+    reference_logits = None
+    for lstm_implementation in LSTM_IMPLEMENTATIONS:
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(args.num_layers, args.hidden_size, args.batch_size, args.seq_length, 600,
+                                  args.input_dim, False, num_labels, lstm_implementation)
+            build_start = time.time()
+            logits = model.create_forward_rnn()
+            build_duration = time.time() - build_start
+            model.initialize(sess)
+            if args.checkpoint_dir is not None:
+                model.restore(sess, args.checkpoint_dir)
+
+            input_feed = {model.inputs_ph: inputs, model.input_seq_lengths_ph: input_seq_lengths}
+            # Warm up run
+            result = sess.run(logits, input_feed)
+            start_time = time.time()
+            for _ in range(args.runs):
+                sess.run(logits, input_feed)
+            duration = (time.time() - start_time) / args.runs
+
+        line = "{0:>6} : {1:10.0f} frames/s - {2:.3f} s per batch - graph built in {3:.2f} s".format(
+            lstm_implementation, args.seq_length * args.batch_size / duration, duration, build_duration)
+        # With restored weights every implementation must give the same result
+        if args.checkpoint_dir is not None:
+            if reference_logits is None:
+                reference_logits = result
+            line += " - max logits difference {0:.2e}".format(np.max(np.abs(result - reference_logits)))
+        print(line)
+
+
+def _loop_mel_filterbank(sr, nfft, nfilt):
+    """
+    Mel filterbank built by loops, as it was on each fbank extraction before it was vectorized and cached
+    """
+    import numpy as np
+
+    high_freq_mel = (2595 * np.log10(1 + (float(sr) / 2) / 700))
+    mel_points = np.linspace(0, high_freq_mel, nfilt + 2)
+    hz_points = (700 * (10**(mel_points / 2595) - 1))
+    bins = np.floor((nfft + 1) * hz_points / sr)
+    fbank = np.zeros((nfilt, int(np.floor(nfft / 2 + 1))))
+    for m in range(1, nfilt + 1):
+        for k in range(int(bins[m - 1]), int(bins[m])):
+            fbank[m - 1, k] = (k - bins[m - 1]) / (bins[m] - bins[m - 1])
+        for k in range(int(bins[m]), int(bins[m + 1])):
+            fbank[m - 1, k] = (bins[m + 1] - k) / (bins[m + 1] - bins[m])
+    return fbank
+
+
+def _fancy_index_log_mel_energies(sig, sr):
+    """
+    Framing and log mel energies of the fbank features as computed before the strided framing : an index matrix is
+    built and the frames are copied out of the signal with it
+    """
+    import numpy as np
+    import util.audioprocessor as audioprocessor
+
+    emphasized_signal = np.append(sig[0], sig[1:] - audioprocessor.PRE_EMPHASIS * sig[:-1])
+    frame_length = int(round(audioprocessor.FRAME_SIZE * sr))
+    frame_step = int(round(audioprocessor.FRAME_STRIDE * sr))
+    num_frames = int(np.ceil(float(np.abs(len(emphasized_signal) - frame_length)) / frame_step))
+    pad_signal = np.append(emphasized_signal, np.zeros(num_frames * frame_step + frame_length - len(sig)))
+    indices = np.tile(np.arange(0, frame_length),
+                      (num_frames, 1)) + np.tile(np.arange(0, num_frames * frame_step, frame_step),
+                                                 (frame_length, 1)).T
+    frames = pad_signal[indices.astype(np.int32, copy=False)]
+    frames *= np.hamming(frame_length)
+    nfft = audioprocessor.FBANK_NFFT
+    pow_frames = ((1.0 / nfft) * (np.absolute(np.fft.rfft(frames, nfft)) ** 2))
+    filter_banks = np.dot(pow_frames, audioprocessor._get_mel_filterbank(sr, nfft, audioprocessor.FBANK_NFILT).T)
+    filter_banks = np.where(filter_banks == 0, np.finfo(float).eps, filter_banks)
+    return 10 * np.log10(filter_banks)
+
+
+def _strided_log_mel_energies(sig, sr):
+    """
+    Framing and log mel energies of the fbank features as computed by AudioProcessor
+    """
+    import numpy as np
+    import util.audioprocessor as audioprocessor
+
+    frame_length = int(round(audioprocessor.FRAME_SIZE * sr))
+    frame_step = int(round(audioprocessor.FRAME_STRIDE * sr))
+    num_frames = int(np.ceil(float(np.abs(len(sig) - frame_length)) / frame_step))
+    pad_signal = np.zeros(num_frames * frame_step + frame_length)
+    pad_signal[0] = sig[0]
+    pad_signal[1:len(sig)] = sig[1:] - audioprocessor.PRE_EMPHASIS * sig[:-1]
+    frames = audioprocessor._get_frames(pad_signal, num_frames, frame_length, frame_step)
+    return audioprocessor._get_log_mel_energies(frames, sr)
+
+
+def benchmark_fbank(args):
+    """
+    Compare the time and peak memory of the fbank framing and spectrum computation on long synthetic signals
+    The peak memory is measured on the first call, so it includes the allocation of the reusable work buffers
+    The extraction time of an utterance is then compared with the mel filterbank rebuilt by loops on each call and
+    with the cached filterbank
+    """
+    import tracemalloc
+    from unittest import mock
+    import numpy as np
+    import util.audioprocessor as audioprocessor
+
+    for duration in args.durations:
+        sig = np.random.RandomState(42).uniform(-0.5, 0.5, int(args.sample_rate * duration)).astype(np.float32)
+        results = []
+        for name, function in [("fancy indexing", _fancy_index_log_mel_energies),
+                               ("strided view", _strided_log_mel_energies)]:
+            # Drop the work buffers kept by a previous run
+            audioprocessor._buffers.__dict__.clear()
+            tracemalloc.start()
+            result = function(sig, args.sample_rate)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            durations = []
+            for _ in range(args.runs):
+                start_time = time.time()
+                function(sig, args.sample_rate)
+                durations.append(time.time() - start_time)
+            results.append(result)
+            print("{0:>6.1f} s signal - {1:>14} : {2:8.1f} ms - peak memory {3:7.1f} MB".format(
+                duration, name, min(durations) * 1000, peak_memory / 1024 / 1024))
+        print("{0:>6.1f} s signal - max difference {1:.2e}".format(duration, np.max(np.abs(results[0] - results[1]))))
+
+    audio_processor = audioprocessor.AudioProcessor(None, "fbank")
+    sig = np.random.RandomState(42).uniform(-0.5, 0.5, int(args.sample_rate * args.utterance_duration))
+    sig = sig.astype(np.float32)
+    for name, filterbank in [("loop filterbank", _loop_mel_filterbank),
+                             ("cached filterbank", audioprocessor._get_mel_filterbank)]:
+        with mock.patch.object(audioprocessor, "_get_mel_filterbank", filterbank):
+            audio_processor.process_signal(sig, args.sample_rate)
+            durations = []
+            for _ in range(args.runs):
+                start_time = time.time()
+                audio_processor.process_signal(sig, args.sample_rate)
+                durations.append(time.time() - start_time)
+        print("{0:>6.1f} s utterance - {1:>17} : {2:8.2f} ms".format(args.utterance_duration, name,
+                                                                    min(durations) * 1000))
+
+
+def benchmark_train_step(args):
+    """
+    Compare the duration of the acoustic model train steps according to the decoding of the training error rate
+    """
+    import numpy as np
+    import tensorflow as tf
+    from models.AcousticModel import AcousticModel
+    from models.SpeechRecognizer import SpeechRecognizer
+
+    num_labels = SpeechRecognizer("english").get_char_map_length()
+    rng = np.random.RandomState(42)
+    inputs = rng.rand(args.batch_size, args.seq_length, args.input_dim).astype(np.float32)
+    lengths = np.full(args.batch_size, args.seq_length, dtype=np.int32)
+    labels = rng.randint(1, num_labels - 1, (args.batch_size, args.label_length)).astype(np.int32)
+
+    for decoder, every in [("beam", 1), ("greedy", 1), ("greedy", args.every)]:
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(args.num_layers, args.hidden_size, args.batch_size, args.seq_length,
+                                  args.label_length, args.input_dim, False, num_labels, args.lstm_implementation)
+            # The same batch repeated forever
+            dataset = tf.data.Dataset.from_tensors((inputs, lengths, labels)).repeat()
+            iterator = model.add_dataset_input(dataset)
+            model.create_training_rnn(0.8, 0.5, 1, 0.0003, 0.33, use_iterator=True,
+                                      training_error_rate_decoder=decoder, training_error_rate_every=every)
+            model.initialize(sess)
+            sess.run(iterator.initializer)
+            # Warm up run
+            model.run_train_step(sess, args.mini_batch_size, 1.0)
+            durations = []
+            for _ in range(args.runs):
+                start_time = time.time()
+                model.run_train_step(sess, args.mini_batch_size, 1.0)
+                durations.append(time.time() - start_time)
+        print("{0:>6} error rate every {1:>3} mini-batchs : {2:.3f} s per train step (min {3:.3f} s)".format(
+            decoder, every, np.mean(durations), np.min(durations)))
+
+
+def _evaluate_serial(model, sess, eval_dataset, signal_processing, char_map, sample_rate):
+    """
+    Evaluation as done before the pipelined evaluate_full : each file is extracted, each batch is run and scored one
+    step after the other
+    """
+    import numpy as np
+    import util.audioprocessor as audioprocessor
+    import util.dataprocessor as dataprocessor
+    import util.editdistance as editdistance
+    import util.evaluationresults as evaluationresults
+
+    audio_processor = audioprocessor.AudioProcessor(model.max_input_seq_length, signal_processing, sample_rate)
+    accumulator = evaluationresults.ErrorRateAccumulator()
+    input_feat_vecs = []
+    labels = []
+    for file_number, (audio_file, label, _) in enumerate(eval_dataset, start=1):
+        feat_vec, feat_vec_length = audio_processor.process_audio_file(audio_file)
+        if (len(label) <= model.max_target_seq_length) and (feat_vec_length <= model.max_input_seq_length):
+            input_feat_vecs.append(feat_vec)
+            labels.append(label)
+        if (len(input_feat_vecs) == model.batch_size) or\
+           ((file_number == len(eval_dataset)) and (len(input_feat_vecs) > 0)):
+            input_feat_vec_lengths = [len(feat_vec) for feat_vec in input_feat_vecs]
+            input_feat_vec_lengths += [0] * (model.batch_size - len(input_feat_vecs))
+            predictions = model.process_input(sess, model.build_input_batch(input_feat_vecs), input_feat_vec_lengths)
+            transcribed_texts = [dataprocessor.DataProcessor.get_labels_str(char_map, predictions[index])
+                                 for index in range(len(labels))]
+            word_counts, nb_words = editdistance.word_errors(labels, transcribed_texts)
+            char_counts, nb_chars = editdistance.char_errors(labels, transcribed_texts)
+            for index in range(len(labels)):
+                accumulator.add(list(word_counts[index]) + [nb_words[index]],
+                                list(char_counts[index]) + [nb_chars[index]])
+            input_feat_vecs = []
+            labels = []
+    return accumulator
+
+
+def benchmark_eval(args):
+    """
+    Compare the wall-clock time of the evaluation of a test set, serial (extraction, inference and scoring one after
+    the other) and pipelined (evaluate_full)
+    """
+    import tensorflow as tf
+    import util.audioprocessor as audioprocessor
+    import util.dataprocessor as dataprocessor
+    from models.AcousticModel import AcousticModel
+    from models.SpeechRecognizer import SpeechRecognizer
+
+    speech_recognizer = SpeechRecognizer("english")
+    char_map = speech_recognizer.get_char_map()
+    input_dim = audioprocessor.AudioProcessor(args.max_input_seq_length, args.signal_processing).feature_size
+    eval_dataset = dataprocessor.DataProcessor(args.test_dataset_dirs).get_dataset()
+    if args.max_files is not None:
+        eval_dataset = sorted(eval_dataset, key=lambda item: item[0])[:args.max_files]
+
+    with tf.Session() as sess:
+        model = AcousticModel(args.num_layers, args.hidden_size, args.batch_size, args.max_input_seq_length, 600,
+                              input_dim, False, speech_recognizer.get_char_map_length(), args.lstm_implementation)
+        model.create_forward_rnn()
+        model.initialize(sess)
+        if args.checkpoint_dir is not None:
+            model.restore(sess, args.checkpoint_dir)
+        # Warm up run
+        model.process_input(sess, model.build_input_batch([]), [0] * args.batch_size)
+
+        results = []
+        for name, evaluate in [("serial", lambda: _evaluate_serial(model, sess, eval_dataset, args.signal_processing,
+                                                                   char_map, args.sample_rate)),
+                               ("pipelined", lambda: model.evaluate_full(sess, eval_dataset, args.max_input_seq_length,
+                                                                         args.signal_processing, char_map,
+                                                                         sample_rate=args.sample_rate,
+                                                                         feature_workers=args.feature_workers))]:
+            start_time = time.time()
+            error_rates = evaluate().get_error_rates()
+            duration = time.time() - start_time
+            results.append(error_rates)
+            print("{0:>9} : {1:8.1f} s for {2} files - WER {3:.2f} % - CER {4:.2f} %".format(
+                name, duration, len(eval_dataset), error_rates["corpus_wer"], error_rates["corpus_cer"]))
+        if (results[0]["corpus_wer"], results[0]["corpus_cer"]) != (results[1]["corpus_wer"], results[1]["corpus_cer"]):
+            print("Warning : the serial and pipelined evaluations give different error rates")
+
+
+def _get_peaky_logits(seq_length, batch_size, num_labels, rng):
+    """
+    Synthetic logits looking like a trained acoustic model output : mostly blanks, a few labels, one peak per frame
+    """
+    import numpy as np
+
+    best_path = np.where(rng.uniform(size=(seq_length, batch_size)) < 0.7, num_labels - 1,
+                         rng.randint(0, num_labels - 1, (seq_length, batch_size)))
+    logits = rng.normal(0, 1, (seq_length, batch_size, num_labels))
+    logits[np.arange(seq_length)[:, None], np.arange(batch_size)[None, :], best_path] += 6.0
+    return logits.astype(np.float32)
+
+
+def benchmark_ctc(args):
+    """
+    Compare the time of the CTC decoders on synthetic logits, with the label error rate of each decoder against the
+    widest beam search
+    The tensorflow beam search is included when tensorflow can be imported
+    """
+    from functools import partial
+    import numpy as np
+    import util.ctcdecoder as ctcdecoder
+    import util.editdistance as editdistance
+
+    logits = _get_peaky_logits(args.seq_length, args.batch_size, args.num_labels, np.random.RandomState(42))
+    seq_lengths = [args.seq_length] * args.batch_size
+    decoders = [("greedy", lambda: ctcdecoder.greedy_decode(logits, seq_lengths))]
+    for beam_width in args.beam_widths:
+        for prune_threshold in args.prune_thresholds:
+            decoders.append(("beam {0} prune {1:g}".format(beam_width, prune_threshold),
+                             partial(ctcdecoder.beam_search_decode, logits, seq_lengths, beam_width, prune_threshold)))
+    try:
+        import tensorflow as tf
+        logits_ph = tf.placeholder(tf.float32, shape=[None, None, args.num_labels])
+        decoded, _ = tf.nn.ctc_beam_search_decoder(logits_ph, seq_lengths)
+        dense_decoded = tf.sparse_tensor_to_dense(decoded[0], default_value=-1)
+        sess = tf.Session()
+        decoders.append(("tensorflow", lambda: [[int(label) for label in labels if label >= 0]
+                                                for labels in sess.run(dense_decoded, {logits_ph: logits})]))
+    except ImportError:
+        print("tensorflow is not available, its decoder is not benchmarked")
+
+    reference = ctcdecoder.beam_search_decode(logits, seq_lengths, max(args.beam_widths))
+    for name, decode in decoders:
+        # Warm up run
+        result = decode()
+        start_time = time.time()
+        for _ in range(args.runs):
+            decode()
+        duration = (time.time() - start_time) / args.runs
+        errors = editdistance.batch_edit_distance(reference, result)[:, 0].sum()
+        print("{0:>22} : {1:8.1f} ms per batch - {2:10.0f} frames/s - {3:.2f} % label errors against beam {4}".format(
+            name, duration * 1000, args.seq_length * args.batch_size / duration,
+            100.0 * errors / max(sum(len(labels) for labels in reference), 1), max(args.beam_widths)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a benchmark")
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    lstm_parser = subparsers.add_parser('lstm', help='Compare the LSTM implementations of the acoustic model')
+    lstm_parser.add_argument('--num_layers', type=int, default=5, help='Number of LSTM layers')
+    lstm_parser.add_argument('--hidden_size', type=int, default=1024, help='Number of LSTM cells per layer')
+    lstm_parser.add_argument('--batch_size', type=int, default=10, help='Number of inputs in a batch')
+    lstm_parser.add_argument('--seq_length', type=int, default=1000, help='Length of each input (in frames)')
+    lstm_parser.add_argument('--input_dim', type=int, default=120, help='Dimension of the input vectors')
+    lstm_parser.add_argument('--runs', type=int, default=5, help='Number of timed runs')
+    lstm_parser.add_argument('--checkpoint_dir', type=str, default=None,
+                             help='Restore the weights from this checkpoint dir (random weights if not provided)')
+    lstm_parser.set_defaults(func=benchmark_lstm)
+
+    fbank_parser = subparsers.add_parser('fbank', help='Measure the time and memory of the fbank framing and spectrum')
+    fbank_parser.add_argument('--durations', type=float, nargs='+', default=[5, 35, 120],
+                              help='Durations (in seconds) of the synthetic signals')
+    fbank_parser.add_argument('--sample_rate', type=int, default=22050, help='Sample rate of the synthetic signals')
+    fbank_parser.add_argument('--runs', type=int, default=5, help='Number of timed runs')
+    fbank_parser.add_argument('--utterance_duration', type=float, default=3,
+                              help='Duration of the utterance on which the mel filterbank cache is measured')
+    fbank_parser.set_defaults(func=benchmark_fbank)
+
+    train_parser = subparsers.add_parser('train_step', help='Measure the train step duration according to the '
+                                                            'training error rate decoding')
+    train_parser.add_argument('--num_layers', type=int, default=2, help='Number of LSTM layers')
+    train_parser.add_argument('--hidden_size', type=int, default=256, help='Number of LSTM cells per layer')
+    train_parser.add_argument('--batch_size', type=int, default=10, help='Number of inputs in a batch')
+    train_parser.add_argument('--mini_batch_size', type=int, default=3, help='Number of mini-batchs in a train step')
+    train_parser.add_argument('--seq_length', type=int, default=1000, help='Length of each input (in frames)')
+    train_parser.add_argument('--label_length', type=int, default=150, help='Length of each label (in chars)')
+    train_parser.add_argument('--input_dim', type=int, default=120, help='Dimension of the input vectors')
+    train_parser.add_argument('--lstm_implementation', type=str, default="basic", help='Implementation of the LSTM')
+    train_parser.add_argument('--every', type=int, default=10,
+                              help='Compute the error rate on one mini-batch out of this value for the last run')
+    train_parser.add_argument('--runs', type=int, default=5, help='Number of timed train steps')
+    train_parser.set_defaults(func=benchmark_train_step)
+
+    eval_parser = subparsers.add_parser('eval', help='Compare the serial and pipelined evaluation of a test set')
+    eval_parser.add_argument('--test_dataset_dirs', type=str, default="data/LibriSpeech/test",
+                             help='Test dataset dirs (comma separated), for example LibriSpeech test-clean')
+    eval_parser.add_argument('--max_files', type=int, default=None, help='Only evaluate this number of files')
+    eval_parser.add_argument('--num_layers', type=int, default=5, help='Number of LSTM layers')
+    eval_parser.add_argument('--hidden_size', type=int, default=1024, help='Number of LSTM cells per layer')
+    eval_parser.add_argument('--batch_size', type=int, default=10, help='Number of inputs in a batch')
+    eval_parser.add_argument('--max_input_seq_length', type=int, default=3510, help='Maximum length of an input')
+    eval_parser.add_argument('--signal_processing', type=str, default="fbank", help='Signal processing (mfcc or fbank)')
+    eval_parser.add_argument('--sample_rate', type=int, default=None,
+                             help='Sample rate the files are resampled to (native rate if not provided)')
+    eval_parser.add_argument('--lstm_implementation', type=str, default="basic", help='Implementation of the LSTM')
+    eval_parser.add_argument('--feature_workers', type=int, default=None,
+                             help='Number of feature extraction processes (one per CPU if not provided)')
+    eval_parser.add_argument('--checkpoint_dir', type=str, default=None,
+                             help='Restore the weights from this checkpoint dir (random weights if not provided)')
+    eval_parser.set_defaults(func=benchmark_eval)
+
+    ctc_parser = subparsers.add_parser('ctc', help='Compare the speed of the CTC decoders')
+    ctc_parser.add_argument('--batch_size', type=int, default=10, help='Number of inputs in a batch')
+    ctc_parser.add_argument('--seq_length', type=int, default=1000, help='Length of each input (in frames)')
+    ctc_parser.add_argument('--num_labels', type=int, default=30, help='Number of labels (including the blank)')
+    ctc_parser.add_argument('--beam_widths', type=int, nargs='+', default=[10, 100],
+                            help='Beam widths of the numpy beam search')
+    ctc_parser.add_argument('--prune_thresholds', type=float, nargs='+', default=[0.0, 0.001],
+                            help='Prune thresholds of the numpy beam search')
+    ctc_parser.add_argument('--runs', type=int, default=3, help='Number of timed runs')
+    ctc_parser.set_defaults(func=benchmark_ctc)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    arguments.func(arguments)
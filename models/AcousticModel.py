@@ -20,14 +20,44 @@ import time
 import os
 from datetime import datetime
 import logging
+import re
+import json
+import queue
+import threading
 from random import randint
+from functools import partial
 import util.audioprocessor as audioprocessor
 import util.dataprocessor as dataprocessor
+import util.batchproducer as batchproducer
+import util.editdistance as editdistance
+import util.evaluationresults as evaluationresults
+import util.ctcdecoder as ctcdecoder
+
+
+# Available implementations of the LSTM layers
+#   basic : tf.contrib.rnn.BasicLSTMCell run through tf.nn.dynamic_rnn
+#   block : tf.contrib.rnn.LSTMBlockCell (one fused kernel per timestep) run through tf.nn.dynamic_rnn
+#   fused : tf.contrib.rnn.LSTMBlockFusedCell (one fused kernel for the whole sequence and each layer)
+# All implementations share the same weights layout and are saved under the BasicLSTMCell variable names so that a
+# checkpoint can be restored whatever the implementation used to create it
+LSTM_IMPLEMENTATIONS = ["basic", "block", "fused"]
+
+# Available decoders of the logits outside of training
+#   tensorflow : tf.nn.ctc_beam_search_decoder in the graph (beam width of 100)
+#   beam : numpy prefix beam search on the logits fetched from the session (see util.ctcdecoder)
+#   greedy : numpy best path decoding on the logits fetched from the session
+DECODERS = ["tensorflow", "beam", "greedy"]
+
+# Available decoders for the error rate of the training mini-batchs (the evaluation runs always use the beam search)
+#   beam : tf.nn.ctc_beam_search_decoder, as the evaluation
+#   greedy : tf.nn.ctc_greedy_decoder, much cheaper and accurate enough to follow the training progression
+TRAINING_ERROR_RATE_DECODERS = ["beam", "greedy"]
 
 
 class AcousticModel(object):
     def __init__(self, num_layers, hidden_size, batch_size, max_input_seq_length,
-                 max_target_seq_length, input_dim, normalization, num_labels):
+                 max_target_seq_length, input_dim, normalization, num_labels, lstm_implementation="basic",
+                 decoder="tensorflow", beam_width=100, beam_prune_threshold=0.0):
         """
         Initialize the acoustic rnn model parameters
 
@@ -41,7 +71,17 @@ class AcousticModel(object):
         :param input_dim: dimension of input vector
         :param normalization: boolean indicating whether or not to normalize data in a input batch
         :param num_labels: the numbers of output labels
+        :param lstm_implementation: implementation of the LSTM layers, one of LSTM_IMPLEMENTATIONS
+        :param decoder: decoder of the logits used by process_input and finish_stream, one of DECODERS
+        :param beam_width: beam width of the beam decoder
+        :param beam_prune_threshold: labels below this probability in a frame are not tried by the beam decoder
         """
+        if lstm_implementation not in LSTM_IMPLEMENTATIONS:
+            raise ValueError("{0} is not a valid LSTM implementation, only {1} are accepted."
+                             .format(lstm_implementation, LSTM_IMPLEMENTATIONS))
+        if decoder not in DECODERS:
+            raise ValueError("{0} is not a valid decoder, only {1} are accepted.".format(decoder, DECODERS))
+
         # Store model's parameters
         self.num_layers = num_layers
         self.hidden_size = hidden_size
@@ -51,6 +91,10 @@ class AcousticModel(object):
         self.input_dim = input_dim
         self.normalization = normalization
         self.num_labels = num_labels
+        self.lstm_implementation = lstm_implementation
+        self.decoder = decoder
+        self.beam_width = beam_width
+        self.beam_prune_threshold = beam_prune_threshold
 
         # Create object's variables for tensorflow ops
         self.rnn_state_zero_op = None
@@ -58,7 +102,19 @@ class AcousticModel(object):
         self.saver_op = None
 
         # Create object's variable for result output
+        self.logits = None
         self.prediction = None
+        self.dense_prediction = None
+
+        # Create object's variables for streaming recognition
+        self.stream_logits_ph = None
+        self.stream_dense_prediction = None
+        self._stream_signal_processing = None
+        self._stream_audio_processor = None
+        self._stream_frames_count = 0
+        self._stream_logits = []
+        self._stream_labels = []
+        self._stream_last_label = None
 
         # Create object's variables for placeholders
         self.input_keep_prob_ph = self.output_keep_prob_ph = None
@@ -66,6 +122,8 @@ class AcousticModel(object):
 
         # Create object's variables for dataset's iterator input
         self.iterator_get_next_op = None
+        # The input batch is staged in the graph by its own session run so that the input wait can be timed
+        self.stage_input_op = None
         self.is_training_var = tf.Variable(initial_value=False, trainable=False, name="is_training_var", dtype=tf.bool)
 
         # Create object's variable for hidden state
@@ -79,6 +137,11 @@ class AcousticModel(object):
         self.learning_rate_decay_op = None
         self.accumulated_mean_loss = self.acc_mean_loss_op = self.acc_mean_loss_zero_op = None
         self.accumulated_error_rate = self.acc_error_rate_op = self.acc_error_rate_zero_op = None
+        self.accumulated_training_error_rate = self.training_error_rate_count = None
+        self.acc_training_error_rate_op = self.acc_training_error_rate_zero_op = None
+        # The training error rate is computed on one training mini-batch out of training_error_rate_every
+        self.training_error_rate_every = 1
+        self.training_mini_batch_count = 0
         self.mini_batch = self.increase_mini_batch_op = self.mini_batch_zero_op = None
         self.acc_gradients_zero_op = self.accumulate_gradients_op = None
         self.train_step_op = None
@@ -86,10 +149,16 @@ class AcousticModel(object):
         # Create object's variables for tensorboard
         self.tensorboard_dir = None
         self.timeline_enabled = False
+        self.timeline_per_step = False
         self.train_summaries_op = None
         self.test_summaries_op = None
         self.summary_writer_op = None
 
+        # Create object's variables for the train steps timing, the timing of a step is written when the next step
+        # starts so that the checkpoint saving following a step is accounted to it
+        self.step_timing_file = None
+        self.step_timing = None
+
         # Create object's variables for status checking
         self.rnn_created = False
 
@@ -104,15 +173,30 @@ class AcousticModel(object):
         if self.rnn_created:
             logging.fatal("Trying to create the acoustic RNN but it is already.")
 
-        # Set placeholders for input
-        self.inputs_ph = tf.placeholder(tf.float32, shape=[self.max_input_seq_length, None, self.input_dim],
-                                        name="inputs_ph")
+        # Set placeholders for input, the time dimension can vary from one input batch to another
+        self.inputs_ph = tf.placeholder(tf.float32, shape=[None, None, self.input_dim], name="inputs_ph")
 
         self.input_seq_lengths_ph = tf.placeholder(tf.int32, shape=[None], name="input_seq_lengths_ph")
 
         # Build the RNN
-        self.global_step, logits, self.prediction, self.rnn_keep_state_op, self.rnn_state_zero_op,\
+        self.global_step, self.logits, self.prediction, self.rnn_keep_state_op, self.rnn_state_zero_op,\
             _, _, self.rnn_tuple_state = self._build_base_rnn(self.inputs_ph, self.input_seq_lengths_ph, True)
+        logits = self.logits
+
+        # Build the dense conversion of the prediction once so that process_input fetches it in a single run
+        # without adding new ops to the graph on each call
+        self.dense_prediction = tf.sparse_tensor_to_dense(self.prediction, default_value=self.num_labels,
+                                                          validate_indices=True)
+
+        # Build the final decoding of a stream, run on the logits accumulated during the stream
+        # Only a model with a batch size of 1 can stream (see start_stream) and only the tensorflow decoder needs it
+        if (self.batch_size == 1) and (self.decoder == "tensorflow"):
+            self.stream_logits_ph = tf.placeholder(tf.float32, shape=[None, 1, self.num_labels],
+                                                   name="stream_logits_ph")
+            decoded, _log_prob = tf.nn.ctc_beam_search_decoder(self.stream_logits_ph,
+                                                               tf.shape(self.stream_logits_ph)[:1])
+            self.stream_dense_prediction = tf.sparse_tensor_to_dense(tf.to_int32(decoded[0]),
+                                                                     default_value=self.num_labels)
 
         # Add the saving and restore operation
         self.saver_op = self._add_saving_op()
@@ -120,7 +204,7 @@ class AcousticModel(object):
         return logits
 
     def create_training_rnn(self, input_keep_prob, output_keep_prob, grad_clip, learning_rate, lr_decay_factor,
-                            use_iterator=False):
+                            use_iterator=False, training_error_rate_decoder="beam", training_error_rate_every=1):
         """
         Create the training RNN
 
@@ -133,16 +217,32 @@ class AcousticModel(object):
         :param lr_decay_factor: decay factor of the learning rate
         :param use_iterator: if True then plug an iterator.get_next() operation for the input of the model, if None
                             placeholders are created instead
+        :param training_error_rate_decoder: decoder used for the error rate of the training mini-batchs, one of
+                                            TRAINING_ERROR_RATE_DECODERS
+        :param training_error_rate_every: compute the training error rate on one mini-batch out of this value
         """
         if self.rnn_created:
             logging.fatal("Trying to create the acoustic RNN but it is already.")
+        if training_error_rate_decoder not in TRAINING_ERROR_RATE_DECODERS:
+            raise ValueError("{0} is not a valid training error rate decoder, only {1} are accepted."
+                             .format(training_error_rate_decoder, TRAINING_ERROR_RATE_DECODERS))
+        if training_error_rate_every < 1:
+            raise ValueError("training_error_rate_every should be at least 1 (got {0})"
+                             .format(training_error_rate_every))
 
         # Store model parameters
         self.input_keep_prob = input_keep_prob
         self.output_keep_prob = output_keep_prob
+        self.training_error_rate_every = training_error_rate_every
 
         if use_iterator is True:
-            mfcc_batch, input_lengths, label_batch = self.iterator_get_next_op
+            # Stage the input batch inside the graph : run_step pulls it from the iterator in a first session run
+            # (the input wait) and the model reads it from the staging area in the next one, the batch stays on the
+            # device instead of going back and forth through python
+            staging_area = tf.contrib.staging.StagingArea([tensor.dtype for tensor in self.iterator_get_next_op],
+                                                          [tensor.get_shape() for tensor in self.iterator_get_next_op])
+            self.stage_input_op = staging_area.put(self.iterator_get_next_op)
+            mfcc_batch, input_lengths, label_batch = staging_area.get()
             # Pad if the batch is not complete
             padded_mfcc_batch = tf.pad(mfcc_batch, [[0, self.batch_size - tf.size(input_lengths)], [0, 0], [0, 0]])
             # Transpose padded_mfcc_batch in order to get time serie as first dimension
@@ -158,9 +258,8 @@ class AcousticModel(object):
             # Pad sparse_labels if the batch is not complete
             sparse_labels, _ = tf.sparse_fill_empty_rows(sparse_labels, self.num_labels - 1)
         else:
-            # Set placeholders for input
-            self.inputs_ph = tf.placeholder(tf.float32, shape=[self.max_input_seq_length, None, self.input_dim],
-                                            name="inputs_ph")
+            # Set placeholders for input, the time dimension can vary from one input batch to another
+            self.inputs_ph = tf.placeholder(tf.float32, shape=[None, None, self.input_dim], name="inputs_ph")
 
             self.input_seq_lengths_ph = tf.placeholder(tf.int32, shape=[None], name="input_seq_lengths_ph")
             self.labels_ph = tf.placeholder(tf.int32, shape=[None, self.max_target_seq_length],
@@ -181,7 +280,8 @@ class AcousticModel(object):
 
         # Add the train part to the network
         self.learning_rate_var = self._add_training_on_rnn(logits, grad_clip, learning_rate, lr_decay_factor,
-                                                           sparse_labels, input_seq_lengths, prediction)
+                                                           sparse_labels, input_seq_lengths, prediction,
+                                                           training_error_rate_decoder)
 
         # Add the saving and restore operation
         self.saver_op = self._add_saving_op()
@@ -219,23 +319,6 @@ class AcousticModel(object):
                 input_keep_prob_ph = tf.placeholder(tf.float32)
                 output_keep_prob_ph = tf.placeholder(tf.float32)
 
-        # Define cells of acoustic model
-        with tf.variable_scope('LSTM'):
-            # Create each layer
-            layers_list = []
-            for _ in range(self.num_layers):
-                cell = tf.contrib.rnn.BasicLSTMCell(self.hidden_size, state_is_tuple=True)
-
-                # If building the RNN for training then add a dropoutWrapper to the cells
-                if not forward_only:
-                    with tf.name_scope('dropout'):
-                        cell = tf.contrib.rnn.DropoutWrapper(cell, input_keep_prob=input_keep_prob_ph,
-                                                             output_keep_prob=output_keep_prob_ph)
-                layers_list.append(cell)
-
-            # Store the layers in a multi-layer RNN
-            cell = tf.contrib.rnn.MultiRNNCell(layers_list, state_is_tuple=True)
-
         # Build the input layer between input and the RNN
         with tf.variable_scope('Input_Layer'):
             w_i = tf.get_variable("input_w", [self.input_dim, self.hidden_size], tf.float32,
@@ -244,10 +327,11 @@ class AcousticModel(object):
                                   initializer=tf.constant_initializer(0.0))
 
         # Apply the input layer to the network input to produce the input for the rnn part of the network
-        rnn_inputs = [tf.matmul(tf.squeeze(i, axis=[0]), w_i) + b_i
-                      for i in tf.split(axis=0, num_or_size_splits=self.max_input_seq_length, value=inputs)]
-        # Switch from a list to a tensor
-        rnn_inputs = tf.stack(rnn_inputs)
+        # All timesteps are processed by a single matmul so that the time dimension can vary between batchs :
+        # [time, batch_size, input_dim] ====> [time x batch_size, input_dim] ====> [time, batch_size, hidden_size]
+        inputs_shape = tf.shape(inputs)
+        rnn_inputs = tf.matmul(tf.reshape(inputs, [-1, self.input_dim]), w_i) + b_i
+        rnn_inputs = tf.reshape(rnn_inputs, [inputs_shape[0], inputs_shape[1], self.hidden_size])
 
         # Add a batch normalization layer to the model if needed
         if self.normalization:
@@ -265,17 +349,17 @@ class AcousticModel(object):
         #        this way is much more efficient
         with tf.variable_scope('Hidden_state'):
             state_variables = []
-            for state_c, state_h in cell.zero_state(self.batch_size, tf.float32):
+            for _ in range(self.num_layers):
                 state_variables.append(tf.nn.rnn_cell.LSTMStateTuple(
-                    tf.Variable(state_c, trainable=False),
-                    tf.Variable(state_h, trainable=False)))
+                    tf.Variable(tf.zeros([self.batch_size, self.hidden_size]), trainable=False),
+                    tf.Variable(tf.zeros([self.batch_size, self.hidden_size]), trainable=False)))
             # Return as a tuple, so that it can be fed to dynamic_rnn as an initial state
             rnn_tuple_state = tuple(state_variables)
 
         # Build the RNN
         with tf.name_scope('LSTM'):
-            rnn_output, new_states = tf.nn.dynamic_rnn(cell, rnn_inputs, sequence_length=input_seq_lengths,
-                                                       initial_state=rnn_tuple_state, time_major=True)
+            rnn_output, new_states = self._build_lstm_layers(rnn_inputs, input_seq_lengths, rnn_tuple_state,
+                                                             input_keep_prob_ph, output_keep_prob_ph)
 
         # Define an op to keep the hidden state between batches
         update_ops = []
@@ -305,8 +389,8 @@ class AcousticModel(object):
                                   initializer=tf.constant_initializer(0.0))
 
         # Compute the logits (each char probability for each timestep of the input, for each item of the batch)
-        logits = tf.stack([tf.matmul(tf.squeeze(i, axis=[0]), w_o) + b_o
-                          for i in tf.split(axis=0, num_or_size_splits=self.max_input_seq_length, value=rnn_output)])
+        logits = tf.matmul(tf.reshape(rnn_output, [-1, self.hidden_size]), w_o) + b_o
+        logits = tf.reshape(logits, [inputs_shape[0], inputs_shape[1], self.num_labels])
 
         # Compute the prediction which is the best "path" of probabilities for each item of the batch
         decoded, _log_prob = tf.nn.ctc_beam_search_decoder(logits, input_seq_lengths)
@@ -316,8 +400,66 @@ class AcousticModel(object):
         return global_step, logits, prediction, rnn_keep_state_op, rnn_state_zero_op,\
             input_keep_prob_ph, output_keep_prob_ph, rnn_tuple_state
 
+    def _build_lstm_layers(self, rnn_inputs, input_seq_lengths, initial_state, input_keep_prob_ph=None,
+                           output_keep_prob_ph=None):
+        """
+        Build the LSTM layers of the Acoustic RNN with the chosen implementation
+
+        Parameters
+        ----------
+        :param rnn_inputs: time major inputs of the first layer
+        :param input_seq_lengths: vector containing the length of each input from 'rnn_inputs'
+        :param initial_state: a tuple containing the initial LSTMStateTuple of each layer
+        :param input_keep_prob_ph: a placeholder for input_keep_prob of the dropout layer (None for no dropout)
+        :param output_keep_prob_ph: a placeholder for output_keep_prob of the dropout layer (None for no dropout)
+
+        Returns
+        ----------
+        :returns rnn_output: time major outputs of the last layer
+        :returns new_states: a tuple containing the LSTMStateTuple of each layer at the end of each input
+        """
+        dropout = (input_keep_prob_ph is not None) and (output_keep_prob_ph is not None)
+
+        if self.lstm_implementation == "fused":
+            # A fused cell process the whole sequence at once so it can not be stacked in a MultiRNNCell, build the
+            # layers one by one in the same variable scopes as dynamic_rnn would do
+            new_states = []
+            layer_output = rnn_inputs
+            with tf.variable_scope('rnn'), tf.variable_scope('multi_rnn_cell'):
+                for i in range(self.num_layers):
+                    with tf.variable_scope('cell_{0}'.format(i)):
+                        if dropout:
+                            layer_output = tf.nn.dropout(layer_output, input_keep_prob_ph)
+                        cell = tf.contrib.rnn.LSTMBlockFusedCell(self.hidden_size)
+                        layer_output, (state_c, state_h) = cell(layer_output, initial_state=initial_state[i],
+                                                                dtype=tf.float32, sequence_length=input_seq_lengths)
+                        if dropout:
+                            layer_output = tf.nn.dropout(layer_output, output_keep_prob_ph)
+                        new_states.append(tf.nn.rnn_cell.LSTMStateTuple(state_c, state_h))
+            return layer_output, tuple(new_states)
+
+        # Create each layer
+        layers_list = []
+        for _ in range(self.num_layers):
+            if self.lstm_implementation == "block":
+                cell = tf.contrib.rnn.LSTMBlockCell(self.hidden_size)
+            else:
+                cell = tf.contrib.rnn.BasicLSTMCell(self.hidden_size, state_is_tuple=True)
+
+            # If building the RNN for training then add a dropoutWrapper to the cells
+            if dropout:
+                with tf.name_scope('dropout'):
+                    cell = tf.contrib.rnn.DropoutWrapper(cell, input_keep_prob=input_keep_prob_ph,
+                                                         output_keep_prob=output_keep_prob_ph)
+            layers_list.append(cell)
+
+        # Store the layers in a multi-layer RNN
+        cell = tf.contrib.rnn.MultiRNNCell(layers_list, state_is_tuple=True)
+        return tf.nn.dynamic_rnn(cell, rnn_inputs, sequence_length=input_seq_lengths,
+                                 initial_state=initial_state, time_major=True)
+
     def _add_training_on_rnn(self, logits, grad_clip, learning_rate, lr_decay_factor,
-                             sparse_labels, input_seq_lengths, prediction):
+                             sparse_labels, input_seq_lengths, prediction, training_error_rate_decoder="beam"):
         """
         Build the training add-on of the Acoustic RNN
         
@@ -327,6 +469,8 @@ class AcousticModel(object):
           * self.acc_mean_loss_zero_op : will reset the loss accumulator to 0
           * self.acc_error_rate_op : will compute the error rate and accumulate it over multiple mini-batchs
           * self.acc_error_rate_zero_op : will reset the error_rate accumulator to 0
+          * self.acc_training_error_rate_op : will compute the training error rate and accumulate it
+          * self.acc_training_error_rate_zero_op : will reset the training error rate accumulator to 0
           * self.increase_mini_batch_op : will increase the mini-batchs counter
           * self.mini_batch_zero_op : will reset the mini-batchs counter
           * self.acc_gradients_zero_op : will reset the gradients
@@ -342,6 +486,7 @@ class AcousticModel(object):
         :param sparse_labels: the labels in a sparse tensor
         :param input_seq_lengths: vector containing the length of each input from 'inputs'
         :param prediction: the predicted label given by the RNN
+        :param training_error_rate_decoder: decoder used for the training error rate (beam or greedy)
 
         Returns
         -------
@@ -374,6 +519,23 @@ class AcousticModel(object):
             self.acc_error_rate_op = self.accumulated_error_rate.assign_add(error_rate)
             self.acc_error_rate_zero_op = self.accumulated_error_rate.assign(tf.zeros_like(self.accumulated_error_rate))
 
+            # The error rate of the training mini-batchs can use a cheaper decoder and be computed on part of the
+            # mini-batchs only, it has its own accumulator and counter. The accumulator is only reset by the train
+            # steps computing it so that it keeps the last computed value for the others
+            if training_error_rate_decoder == "greedy":
+                greedy_decoded, _log_prob = tf.nn.ctc_greedy_decoder(logits, input_seq_lengths)
+                training_error_rate = tf.reduce_mean(tf.edit_distance(tf.to_int32(greedy_decoded[0]), sparse_labels,
+                                                                      normalize=True))
+            else:
+                training_error_rate = error_rate
+            self.accumulated_training_error_rate = tf.Variable(0.0, trainable=False)
+            self.training_error_rate_count = tf.Variable(0.0, trainable=False)
+            self.acc_training_error_rate_op = [self.accumulated_training_error_rate.assign_add(training_error_rate),
+                                               self.training_error_rate_count.assign_add(1)]
+            self.acc_training_error_rate_zero_op = [
+                self.accumulated_training_error_rate.assign(tf.zeros_like(self.accumulated_training_error_rate)),
+                self.training_error_rate_count.assign(tf.zeros_like(self.training_error_rate_count))]
+
         # Count mini-batchs
         with tf.name_scope('Mini_batch'):
             # Set an accumulator to count the number of mini-batchs in a batch
@@ -406,7 +568,8 @@ class AcousticModel(object):
                                                      global_step=self.global_step)
         return learning_rate_var
 
-    def add_tensorboard(self, session, tensorboard_dir, tb_run_name=None, timeline_enabled=False):
+    def add_tensorboard(self, session, tensorboard_dir, tb_run_name=None, timeline_enabled=False,
+                        timeline_per_step=False):
         """
         Add the tensorboard operations to the acoustic RNN
         This method will add ops to feed tensorboard
@@ -421,9 +584,11 @@ class AcousticModel(object):
         :param tb_run_name: directory name for the tensorboard files inside tensorboard_dir, if None a default dir
                             will be created
         :param timeline_enabled: enable the output of a trace file for timeline visualization
+        :param timeline_per_step: name the trace files after the train step instead of overwriting them at each step
         """
         self.tensorboard_dir = tensorboard_dir
         self.timeline_enabled = timeline_enabled
+        self.timeline_per_step = timeline_per_step
 
         # Define GraphKeys for TensorBoard
         graphkey_training = tf.GraphKeys()
@@ -440,8 +605,9 @@ class AcousticModel(object):
 
         # Accuracy
         with tf.name_scope('Accuracy_-_Error_Rate'):
+            mean_training_error_rate = tf.divide(self.accumulated_training_error_rate, self.training_error_rate_count)
+            tf.summary.scalar('Training', mean_training_error_rate, collections=[graphkey_training])
             mean_error_rate = tf.divide(self.accumulated_error_rate, self.mini_batch)
-            tf.summary.scalar('Training', mean_error_rate, collections=[graphkey_training])
             tf.summary.scalar('Test', mean_error_rate, collections=[graphkey_test])
 
         # Hidden state
@@ -498,6 +664,20 @@ class AcousticModel(object):
             logging.info("Created model with fresh parameters.")
         return
 
+    @staticmethod
+    def _get_checkpoint_name(var):
+        """
+        Give the name under which a variable is saved in a checkpoint
+        LSTM weights are always saved under the BasicLSTMCell names, whatever the LSTM implementation used
+
+        :param var: a tensorflow variable
+        :return string: the variable name in the checkpoint
+        """
+        name = re.sub(r'/(lstm_cell|lstm_block_cell|lstm_fused_cell|lstm_block_fused_cell)/', '/basic_lstm_cell/',
+                      var.op.name)
+        name = re.sub(r'/basic_lstm_cell/weights$', '/basic_lstm_cell/kernel', name)
+        return re.sub(r'/basic_lstm_cell/biases$', '/basic_lstm_cell/bias', name)
+
     @staticmethod
     def _add_saving_op():
         """
@@ -519,22 +699,19 @@ class AcousticModel(object):
                      if (var.name.find('/input_w:0') != -1) or (var.name.find('/input_b:0') != -1) or
                         (var.name.find('/output_w:0') != -1) or (var.name.find('/output_b:0') != -1) or
                         (var.name.find('global_step:0') != -1) or (var.name.find('learning_rate:0') != -1) or
-                        (var.name.find('/kernel:0') != -1) or (var.name.find('/bias:0') != -1)]
+                        (var.name.find('/kernel:0') != -1) or (var.name.find('/bias:0') != -1) or
+                        (var.name.find('_cell/weights:0') != -1) or (var.name.find('_cell/biases:0') != -1)]
         if len(save_list) == 0:
             raise ValueError("Trying to define the saving operation before the RNN is built")
 
-        saver_op = tf.train.Saver(save_list)
+        # Map the variables to their checkpoint names
+        saver_op = tf.train.Saver({AcousticModel._get_checkpoint_name(var): var for var in save_list})
         return saver_op
 
     @staticmethod
     def calculate_wer(first_string, second_string):
         """
-        Source : https://martin-thoma.com/word-error-rate-calculation/
-
-        Calculation of WER with Levenshtein distance.
-
-        Works only for strings up to 254 characters (uint8).
-        O(nm) time ans space complexity.
+        Calculation of WER with Levenshtein distance (see util.editdistance, no length limit).
 
         Parameters
         ----------
@@ -554,38 +731,12 @@ class AcousticModel(object):
         > calculate_wer("", "who is there")
         3
         """
-        # initialisation
-        r = first_string.split()
-        h = second_string.split()
-
-        d = np.zeros((len(r) + 1) * (len(h) + 1), dtype=np.uint8)
-        d = d.reshape((len(r) + 1, len(h) + 1))
-        for i in range(len(r) + 1):
-            for j in range(len(h) + 1):
-                if i == 0:
-                    d[0][j] = j
-                elif j == 0:
-                    d[i][0] = i
-
-        # computation
-        for i in range(1, len(r) + 1):
-            for j in range(1, len(h) + 1):
-                if r[i - 1] == h[j - 1]:
-                    d[i][j] = d[i - 1][j - 1]
-                else:
-                    substitution = d[i - 1][j - 1] + 1
-                    insertion = d[i][j - 1] + 1
-                    deletion = d[i - 1][j] + 1
-                    d[i][j] = min(substitution, insertion, deletion)
-
-        return d[len(r)][len(h)]
+        return editdistance.edit_distance(first_string.split(), second_string.split())[0]
 
     @staticmethod
     def calculate_cer(first_string, second_string):
         """
-        Calculation of Character Error Rate (CER).
-
-        Works only for strings up to 65635 elements (uint16).
+        Calculation of Character Error Rate (CER), spaces are ignored (see util.editdistance, no length limit).
 
         Parameters
         ----------
@@ -605,73 +756,80 @@ class AcousticModel(object):
         > calculate_cer("", "who is there")
         10
         """
-        # initialisation
-        r = list(first_string.replace(" ", ""))
-        h = list(second_string.replace(" ", ""))
-
-        d = np.zeros((len(r) + 1) * (len(h) + 1), dtype=np.uint16)
-        d = d.reshape((len(r) + 1, len(h) + 1))
-        for i in range(len(r) + 1):
-            for j in range(len(h) + 1):
-                if i == 0:
-                    d[0][j] = j
-                elif j == 0:
-                    d[i][0] = i
-
-        # computation
-        for i in range(1, len(r) + 1):
-            for j in range(1, len(h) + 1):
-                if r[i - 1] == h[j - 1]:
-                    d[i][j] = d[i - 1][j - 1]
-                else:
-                    substitution = d[i - 1][j - 1] + 1
-                    insertion = d[i][j - 1] + 1
-                    deletion = d[i - 1][j] + 1
-                    d[i][j] = min(substitution, insertion, deletion)
-
-        return d[len(r)][len(h)]
+        return editdistance.edit_distance(first_string.replace(" ", ""), second_string.replace(" ", ""))[0]
 
-    def run_step(self, session, compute_gradients=True, run_options=None, run_metadata=None):
+    def run_step(self, session, compute_gradients=True, run_options=None, run_metadata=None, timing=None,
+                 compute_error_rate=True):
         """
-        Returns:
-        mean of ctc_loss
+        Run a mini-batch, the input batch is staged from the dataset iterator in its own session run so that the time
+        spent waiting for the input pipeline can be told apart from the compute time
+
+        Parameters
+        ----------
+        :param session: a tensorflow session
+        :param compute_gradients: if True, accumulate the gradients of the mini-batch
+        :param run_options: options parameter for the sess.run calls
+        :param run_metadata: run_metadata parameter for the sess.run calls
+        :param timing: a dictionary to which the "input_wait" and "compute" durations are added (optional)
+        :param compute_error_rate: if False, skip the error rate of a training mini-batch (the decoding is not run)
+        :return: the number of mini-batchs run since the start of the batch
         """
-        # Base output is to accumulate loss, error_rate, increase the mini-batchs counter and keep the hidden state for
-        # next batch
-        output_feed = [self.acc_mean_loss_op, self.acc_error_rate_op,
-                       self.increase_mini_batch_op, self.rnn_keep_state_op]
+        # Base output is to accumulate loss, increase the mini-batchs counter and keep the hidden state for next batch
+        output_feed = [self.acc_mean_loss_op, self.increase_mini_batch_op, self.rnn_keep_state_op]
 
         if compute_gradients:
+            # Accumulate the training error rate (if requested for this mini-batch)
+            if compute_error_rate:
+                output_feed.append(self.acc_training_error_rate_op)
             # Add the update operation
             output_feed.append(self.accumulate_gradients_op)
             # and feed the dropout layer the keep probability values
             input_feed = {self.input_keep_prob_ph: self.input_keep_prob,
                           self.output_keep_prob_ph: self.output_keep_prob}
         else:
+            # Accumulate the error rate computed with the beam search
+            output_feed.append(self.acc_error_rate_op)
             # No need to apply a dropout, set the keep probability to 1.0
             input_feed = {self.input_keep_prob_ph: 1.0, self.output_keep_prob_ph: 1.0}
 
-        # Actually run the tensorflow session
+        # Wait for the input batch and stage it in the graph
         start_time = time.time()
         logging.debug("Starting a step")
+        if self.stage_input_op is not None:
+            session.run(self.stage_input_op)
+        input_time = time.time()
+
+        # Actually run the tensorflow session
         session.run(output_feed, input_feed, options=run_options, run_metadata=run_metadata)
         mini_batch_num = self.mini_batch.eval()
-        logging.debug("Step duration : %.2f", time.time() - start_time)
+        end_time = time.time()
+        logging.debug("Step duration : %.2f (input wait %.2f)", end_time - start_time, input_time - start_time)
+        if timing is not None:
+            timing["input_wait"] += input_time - start_time
+            timing["compute"] += end_time - input_time
         return mini_batch_num
 
-    def start_batch(self, session, is_training, run_options=None, run_metadata=None):
+    def start_batch(self, session, is_training, run_options=None, run_metadata=None, reset_training_error_rate=True):
         output = [self.acc_error_rate_zero_op, self.acc_mean_loss_zero_op, self.mini_batch_zero_op]
 
         self.set_is_training(session, is_training)
         if is_training:
             output.append(self.acc_gradients_zero_op)
+            if reset_training_error_rate:
+                output.append(self.acc_training_error_rate_zero_op)
 
         session.run(output, options=run_options, run_metadata=run_metadata)
         return
 
-    def end_batch(self, session, is_training, run_options=None, run_metadata=None, rnn_state_reset_ratio=1.0):
+    def end_batch(self, session, is_training, run_options=None, run_metadata=None, rnn_state_reset_ratio=1.0,
+                  timing=None):
         # Get each accumulator's value and compute the mean for the batch
-        output_feed = [self.accumulated_mean_loss, self.accumulated_error_rate, self.mini_batch, self.global_step]
+        start_time = time.time()
+        if is_training:
+            error_rate_feed = [self.accumulated_training_error_rate, self.training_error_rate_count]
+        else:
+            error_rate_feed = [self.accumulated_error_rate, self.mini_batch]
+        output_feed = [self.accumulated_mean_loss, self.mini_batch, self.global_step] + error_rate_feed
 
         # If in training...
         if is_training:
@@ -681,27 +839,42 @@ class AcousticModel(object):
             if randint(1, 1 // rnn_state_reset_ratio) == 1:
                 output_feed.append(self.rnn_state_zero_op)
 
-        # If a tensorboard dir is configured then run the merged_summaries operation
-        if self.tensorboard_dir is not None:
-            if is_training:
-                output_feed.append(self.train_summaries_op)
-            else:
-                output_feed.append(self.test_summaries_op)
-
         outputs = session.run(output_feed, options=run_options, run_metadata=run_metadata)
-        accumulated_loss = outputs[0]
-        accumulated_error_rate = outputs[1]
-        batchs_count = outputs[2]
-        global_step = outputs[3]
+        accumulated_loss, batchs_count, global_step, accumulated_error_rate, error_rate_count = outputs[:5]
+        summary_start_time = time.time()
 
+        # If a tensorboard dir is configured then run the merged_summaries operation, in its own run so that its cost
+        # is not mixed up with the gradients application
         if self.tensorboard_dir is not None:
-            summary = outputs[-1]
+            summaries_op = self.train_summaries_op if is_training else self.test_summaries_op
+            summary = session.run(summaries_op)
             self.summary_writer_op.add_summary(summary, global_step)
 
+        if timing is not None:
+            timing["compute"] += summary_start_time - start_time
+            timing["summary"] += time.time() - summary_start_time
+
         mean_loss = accumulated_loss / batchs_count
-        mean_error_rate = accumulated_error_rate / batchs_count
+        mean_error_rate = accumulated_error_rate / error_rate_count if error_rate_count > 0 else float("nan")
         return mean_loss, mean_error_rate, global_step
 
+    def build_input_batch(self, feat_vecs):
+        """
+        Build an input batch for process_input from a list of feature vectors
+        The batch is zero-padded to the length of its longest feature vector and completed with empty inputs up to
+        batch_size
+
+        Parameters
+        ----------
+        :param feat_vecs: a list of at most batch_size feature vectors of shape [length, input_dim]
+        :return: a float32 array of shape [longest length, batch_size, input_dim]
+        """
+        max_length = max([len(feat_vec) for feat_vec in feat_vecs] + [1])
+        inputs = np.zeros((max_length, self.batch_size, self.input_dim), dtype=np.float32)
+        for i, feat_vec in enumerate(feat_vecs):
+            inputs[:len(feat_vec), i, :] = feat_vec
+        return inputs
+
     def process_input(self, session, inputs, input_seq_lengths, run_options=None, run_metadata=None):
         """
         Returns:
@@ -713,68 +886,248 @@ class AcousticModel(object):
             input_feed[self.input_keep_prob_ph] = 1.0
             input_feed[self.output_keep_prob_ph] = 1.0
 
-        output_feed = [self.prediction]
-        outputs = session.run(output_feed, input_feed, options=run_options, run_metadata=run_metadata)
-        predictions = session.run(tf.sparse_tensor_to_dense(outputs[0], default_value=self.num_labels,
-                                                            validate_indices=True),
-                                  options=run_options, run_metadata=run_metadata)
-        return predictions
+        if self.decoder == "tensorflow":
+            return session.run(self.dense_prediction, input_feed, options=run_options, run_metadata=run_metadata)
+        logits = session.run(self.logits, input_feed, options=run_options, run_metadata=run_metadata)
+        return ctcdecoder.to_dense(self.decode_logits(logits, input_seq_lengths), self.num_labels)
+
+    def decode_logits(self, logits, input_seq_lengths):
+        """
+        Decode logits fetched from the session with the numpy decoder of the model (beam or greedy)
+
+        Parameters
+        ----------
+        :param logits: an array of shape [time, batch, num_labels]
+        :param input_seq_lengths: the number of valid frames of each input
+        :return: a list of labels list, one per input
+        """
+        if self.decoder == "greedy":
+            return ctcdecoder.greedy_decode(logits, input_seq_lengths)
+        return ctcdecoder.beam_search_decode(logits, input_seq_lengths, self.beam_width, self.beam_prune_threshold)
+
+    def start_stream(self, session, signal_processing):
+        """
+        Start a streaming recognition : reset the RNN hidden state and the stream buffers
+        The RNN hidden state is then carried from one chunk of the stream to the next
+
+        Parameters
+        ----------
+        :param session: the tensorflow session
+        :param signal_processing: the signal processing mode (mfcc or fbank) used on the audio chunks
+        """
+        if self.batch_size != 1:
+            raise ValueError("Streaming recognition needs a model with a batch size of 1 (got {0})"
+                             .format(self.batch_size))
+        session.run(self.rnn_state_zero_op)
+        self._stream_signal_processing = signal_processing
+        self._stream_audio_processor = None
+        self._stream_frames_count = 0
+        self._stream_logits = []
+        self._stream_labels = []
+        self._stream_last_label = None
+
+    def process_stream_audio(self, session, chunk, sample_rate):
+        """
+        Add a chunk of audio to the stream and process the feature frames it completes
+        The features are extracted incrementally, so a chunk only costs the processing of its own frames
+
+        Parameters
+        ----------
+        :param session: the tensorflow session
+        :param chunk: a float audio signal chunk
+        :param sample_rate: the sample rate of the chunk
+        :return: the partial hypothesis (a list of labels) for the whole stream so far
+        """
+        if self._stream_audio_processor is None:
+            self._stream_audio_processor = audioprocessor.StreamingAudioProcessor(sample_rate,
+                                                                                 self._stream_signal_processing)
+        elif self._stream_audio_processor.sample_rate != sample_rate:
+            raise ValueError("The sample rate can not change during a stream")
+        return self.process_stream_frames(session, self._stream_audio_processor.process_chunk(chunk))
+
+    def process_stream_frames(self, session, feat_vecs):
+        """
+        Run new feature frames of the stream through the RNN, carrying the hidden state over to the next call
+
+        Parameters
+        ----------
+        :param session: the tensorflow session
+        :param feat_vecs: the new feature frames, of shape [length, input_dim]
+        :return: the partial hypothesis (a list of labels) for the whole stream so far, greedily decoded
+        """
+        if len(feat_vecs) == 0:
+            return self._stream_labels
+        input_feed = {self.inputs_ph: self.build_input_batch([feat_vecs]),
+                      self.input_seq_lengths_ph: np.array([len(feat_vecs)])}
+        logits, _ = session.run([self.logits, self.rnn_keep_state_op], input_feed)
+        self._stream_frames_count += len(feat_vecs)
+        self._stream_logits.append(logits)
+
+        # Greedy (best path) decoding of the new frames : repeated labels are merged and blanks are removed
+        blank_label = self.num_labels - 1
+        for label in np.argmax(logits[:, 0, :], axis=1):
+            if (label != blank_label) and (label != self._stream_last_label):
+                self._stream_labels.append(int(label))
+            self._stream_last_label = label
+        return self._stream_labels
+
+    def finish_stream(self, session):
+        """
+        End the stream : process the held back frames and decode the whole stream with the beam search decoder
+        The RNN hidden state is reset so that the model can be used again
+
+        Parameters
+        ----------
+        :param session: the tensorflow session
+        :return: the final hypothesis (a list of labels)
+        """
+        if self._stream_audio_processor is not None:
+            self.process_stream_frames(session, self._stream_audio_processor.flush())
+        session.run(self.rnn_state_zero_op)
+        if len(self._stream_logits) == 0:
+            return []
+        stream_logits = np.concatenate(self._stream_logits)
+        if self.decoder != "tensorflow":
+            return self.decode_logits(stream_logits, [len(stream_logits)])[0]
+        prediction = session.run(self.stream_dense_prediction, {self.stream_logits_ph: stream_logits})
+        return [int(label) for label in prediction[0]]
 
     def evaluate_full(self, sess, eval_dataset, input_seq_length, signal_processing, char_map,
-                      run_options=None, run_metadata=None):
-        # Create an audio_processor
-        audio_processor = audioprocessor.AudioProcessor(input_seq_length, signal_processing)
-
-        wer_list = []
-        cer_list = []
-        file_number = 0
-        input_feat_vecs = []
-        input_feat_vec_lengths = []
-        labels = []
-        for file, label, _ in eval_dataset:
-            feat_vec, feat_vec_length = audio_processor.process_audio_file(file)
-            file_number += 1
-            label_data_length = len(label)
-            if (label_data_length > self.max_target_seq_length) or\
-               (feat_vec_length > self.max_input_seq_length):
-                logging.warning("Warning - sample too long : %s (input : %d / text : %s)",
-                                file, feat_vec_length, label_data_length)
-            else:
-                logging.debug("Processed file %d / %d", file_number, len(eval_dataset))
-                input_feat_vecs.append(feat_vec)
-                input_feat_vec_lengths.append(feat_vec_length)
-                labels.append(label)
-
-            # If we reached the last file then pad the lists to obtain a full batch
-            if file_number == len(eval_dataset):
-                for i in range(self.batch_size - len(input_feat_vecs)):
-                    input_feat_vecs.append(np.zeros([self.max_input_seq_length,
-                                                     audio_processor.feature_size]))
-                    input_feat_vec_lengths.append(0)
-                    labels.append("")
-
-            if len(input_feat_vecs) == self.batch_size:
-                # Run the batch
-                logging.debug("Running a batch")
-                input_feat_vecs = np.swapaxes(input_feat_vecs, 0, 1)
-                predictions = self.process_input(sess, input_feat_vecs, input_feat_vec_lengths,
-                                                 run_options=run_options, run_metadata=run_metadata)
-                for index, prediction in enumerate(predictions):
-                    transcribed_text = dataprocessor.DataProcessor.get_labels_str(char_map, prediction)
-                    true_label = labels[index]
-                    if len(true_label) > 0:
-                        nb_words = len(true_label.split())
-                        nb_chars = len(true_label.replace(" ", ""))
-                        wer_list.append(self.calculate_wer(transcribed_text, true_label) / float(nb_words))
-                        cer_list.append(self.calculate_cer(transcribed_text, true_label) / float(nb_chars))
-                # Reset the lists
-                input_feat_vecs = []
-                input_feat_vec_lengths = []
-                labels = []
-
-        wer = (sum(wer_list) * 100) / float(len(wer_list))
-        cer = (sum(cer_list) * 100) / float(len(cer_list))
-        return wer, cer
+                      run_options=None, run_metadata=None, sample_rate=None, feature_workers=None, result_file=None):
+        """
+        Compute the WER and CER of the model on a dataset
+
+        The evaluation is a pipeline of three stages connected by bounded queues : the features are extracted by a
+        pool of worker processes, the batches are run through the model in the calling thread and the transcripts are
+        scored in a separate thread. The files are processed in the dataset order so the result is the same as a
+        sequential evaluation.
+
+        Parameters
+        ----------
+        :param sess: a tensorflow session
+        :param eval_dataset: a list of [audio_file, label, audio_length]
+        :param input_seq_length: maximum length of an input vector sequence (longer ones are truncated)
+        :param signal_processing: the signal processing mode (mfcc or fbank)
+        :param char_map: the char_map against which to transcode the predictions
+        :param run_options: options parameter for the sess.run calls
+        :param run_metadata: run_metadata parameter for the sess.run calls
+        :param sample_rate: the rate the audio files are resampled to (None for their native rate)
+        :param feature_workers: number of processes extracting the features (one per CPU, at most 4, if None)
+        :param result_file: path to a file to which a record is appended for each scored utterance (optional, see
+                            util.evaluationresults)
+        :return: an ErrorRateAccumulator (see util.evaluationresults) holding the error counts of the dataset
+        """
+        start_time = time.time()
+        accumulator = evaluationresults.ErrorRateAccumulator()
+        scoring_errors = []
+
+        # Scoring stage
+        score_queue = queue.Queue(maxsize=2)
+
+        def _score_batches():
+            while True:
+                item = score_queue.get()
+                if item is None:
+                    return
+                if len(scoring_errors) > 0:
+                    # Keep emptying the queue so that the inference is not blocked
+                    continue
+                try:
+                    files, labels, durations, predictions, decode_time = item
+                    transcribed_texts = [dataprocessor.DataProcessor.get_labels_str(char_map, predictions[index])
+                                         for index in range(len(labels))]
+                    word_counts, nb_words = editdistance.word_errors(labels, transcribed_texts)
+                    char_counts, nb_chars = editdistance.char_errors(labels, transcribed_texts)
+                    records = []
+                    for index in range(len(labels)):
+                        record = evaluationresults.get_record(files[index], labels[index], transcribed_texts[index],
+                                                              list(word_counts[index]) + [nb_words[index]],
+                                                              list(char_counts[index]) + [nb_chars[index]],
+                                                              decode_time / len(labels), durations[index])
+                        accumulator.add_record(record)
+                        records.append(record)
+                    if result_file is not None:
+                        with open(result_file, "a") as f:
+                            for record in records:
+                                f.write(json.dumps(record) + "\n")
+                except Exception as e:
+                    scoring_errors.append(e)
+
+        scoring_thread = threading.Thread(target=_score_batches, name="evaluate_full_scoring")
+        scoring_thread.start()
+
+        # Feature extraction stage, the semaphore bounds the number of files extracted ahead of the inference
+        pending_files = 4 * self.batch_size
+        pending_semaphore = threading.Semaphore(pending_files)
+
+        def _files():
+            for audio_file, _, _ in eval_dataset:
+                pending_semaphore.acquire()
+                yield audio_file
+
+        pool = audioprocessor.create_worker_pool(feature_workers)
+        inference_time = 0.0
+        try:
+            features = pool.imap(partial(audioprocessor.extract_file_features, max_input_seq_length=input_seq_length,
+                                         signal_processing=signal_processing, sample_rate=sample_rate), _files())
+            # Inference stage
+            input_feat_vecs = []
+            labels = []
+            files = []
+            durations = []
+            for file_number, ((file, label, audio_duration), (_, feat_vec, feat_vec_length)) in \
+                    enumerate(zip(eval_dataset, features), start=1):
+                pending_semaphore.release()
+                label_data_length = len(label)
+                if feat_vec is None:
+                    # The worker logged why the file could not be processed
+                    pass
+                elif (label_data_length > self.max_target_seq_length) or\
+                   (feat_vec_length > self.max_input_seq_length):
+                    logging.warning("Warning - sample too long : %s (input : %d / text : %s)",
+                                    file, feat_vec_length, label_data_length)
+                else:
+                    logging.debug("Processed file %d / %d", file_number, len(eval_dataset))
+                    input_feat_vecs.append(feat_vec)
+                    labels.append(label)
+                    files.append(file)
+                    durations.append(audio_duration)
+
+                # Run the batch when full or when we reached the last file (the batch is then padded with empty inputs)
+                if (len(input_feat_vecs) == self.batch_size) or\
+                   ((file_number == len(eval_dataset)) and (len(input_feat_vecs) > 0)):
+                    logging.debug("Running a batch")
+                    inference_start_time = time.time()
+                    input_feat_vec_lengths = [len(feat_vec) for feat_vec in input_feat_vecs]
+                    input_feat_vec_lengths += [0] * (self.batch_size - len(input_feat_vecs))
+                    predictions = self.process_input(sess, self.build_input_batch(input_feat_vecs),
+                                                     input_feat_vec_lengths,
+                                                     run_options=run_options, run_metadata=run_metadata)
+                    batch_inference_time = time.time() - inference_start_time
+                    inference_time += batch_inference_time
+                    score_queue.put((files, labels, durations, predictions, batch_inference_time))
+                    # Reset the lists
+                    input_feat_vecs = []
+                    labels = []
+                    files = []
+                    durations = []
+        finally:
+            # Unblock the files generator before stopping the pool
+            for _ in range(pending_files):
+                pending_semaphore.release()
+            pool.terminate()
+            pool.join()
+            score_queue.put(None)
+            scoring_thread.join()
+        if len(scoring_errors) > 0:
+            raise scoring_errors[0]
+
+        duration = time.time() - start_time
+        logging.info("Evaluated %d files in %.2f s (inference %.2f s)", len(eval_dataset), duration, inference_time)
+        if accumulator.audio_duration > 0:
+            logging.info("Real time factor : %.3f (inference), %.3f (wall time)",
+                         accumulator.decode_time / accumulator.audio_duration, duration / accumulator.audio_duration)
+        return accumulator
 
     def run_evaluation(self, sess, run_options=None, run_metadata=None):
         start_time = time.time()
@@ -800,31 +1153,42 @@ class AcousticModel(object):
 
     @staticmethod
     def build_dataset(input_set, batch_size, max_input_seq_length, max_target_seq_length,
-                      signal_processing, char_map):
-        # Separate each data from the input list
-        audio_and_label_set = [[item[0], item[1]] for item in input_set]
-        audio_dataset = tf.data.Dataset.from_tensor_slices(audio_and_label_set)
+                      signal_processing, char_map, feature_store=None, bucket_boundaries=None, sample_rate=None,
+                      feature_workers=None):
+        """
+        Build a tensorflow Dataset producing batches of (features, features lengths, labels)
+        Each batch is padded to the length of its longest input
 
-        # Read audio data and convert string labels
-        def _read_audio_and_transcode_label(filename_label):
-            # Need to convert back to string because tf.py_func changed it to a numpy array
-            filename = str(filename_label[0], encoding='UTF-8')
-            label = str(filename_label[1], encoding='UTF-8')
-            audio_processor = audioprocessor.AudioProcessor(max_input_seq_length, signal_processing)
-            audio_decoded, audio_length = audio_processor.process_audio_file(filename)
-            label_transcoded = dataprocessor.DataProcessor.get_str_labels(char_map, label)
-            return np.array(audio_decoded, dtype=np.float32), np.array(audio_length, dtype=np.int32),\
-                np.array(label_transcoded, dtype=np.int32)
-
-        audio_dataset = audio_dataset.map(lambda filename_label: tuple(tf.py_func(_read_audio_and_transcode_label,
-                                                                                  [filename_label],
-                                                                                  [tf.float32, tf.int32, tf.int32])),
-                                          num_parallel_calls=2).prefetch(30)
-
-        # Batch the datasets
-        audio_dataset = audio_dataset.padded_batch(batch_size, padded_shapes=([max_input_seq_length, None],
-                                                                              tf.TensorShape([]),
-                                                                              [None]))
+        Parameters
+        ----------
+        :param input_set: a list of [audio_file, label, audio_length], the items too long for the model should have been
+                          removed by the DataProcessor
+        :param batch_size: number of items in a batch
+        :param max_input_seq_length: maximum length of an input vector sequence (longer ones are truncated)
+        :param max_target_seq_length: maximum length of an ouput vector sequence
+        :param signal_processing: the signal processing mode (mfcc or fbank)
+        :param char_map: the char_map against which to transcode the labels
+        :param feature_store: a FeatureStore from which to read the precomputed features (optional), if None the
+                              features are computed from the audio files
+        :param bucket_boundaries: a list of increasing input lengths (optional), if given the inputs are grouped in
+                                  batchs of similar length, bucket i containing inputs of length in
+                                  [bucket_boundaries[i-1], bucket_boundaries[i])
+        :param sample_rate: the rate the audio files are resampled to (None for their native rate)
+        :param feature_workers: number of processes extracting the features (one per CPU, at most 4, if None), unused
+                                with a feature store
+        :return: a tensorflow Dataset
+        """
+        if feature_store is not None:
+            return AcousticModel._build_dataset_from_store(input_set, batch_size, max_input_seq_length,
+                                                           char_map, feature_store, bucket_boundaries)
+
+        # The features are extracted and batched by worker processes, started again for each run through the dataset
+        producer = batchproducer.BatchProducer(input_set, batch_size, max_input_seq_length, signal_processing, char_map,
+                                               feature_workers, sample_rate, bucket_boundaries)
+        audio_dataset = tf.data.Dataset.from_generator(producer, (tf.float32, tf.int32, tf.int32),
+                                                       (tf.TensorShape([None, None, producer.feature_size]),
+                                                        tf.TensorShape([None]), tf.TensorShape([None, None])))
+        audio_dataset = audio_dataset.prefetch(1)
 
         # Convert the labels' batch to a sparse tensor
         # TODO : support will probably be ok with TF v1.5
@@ -834,11 +1198,76 @@ class AcousticModel(object):
         #    return audio, audio_lengths, sparse_labels
         # audio_dataset = audio_dataset.map(_convert_labels_to_sparse)
 
-        # TODO : add a filter for files which are too long (currently de-structuring with Dataset.filter is not
-        #        supported in python3)
-
         return audio_dataset
 
+    @staticmethod
+    def _get_bucket_id(length, bucket_boundaries):
+        """
+        Compute the bucket of an input from its length
+
+        :param length: a scalar int32 tensor containing the input length
+        :param bucket_boundaries: a list of increasing input lengths
+        :return: a scalar int64 tensor containing the bucket index
+        """
+        boundaries = tf.constant(bucket_boundaries, dtype=tf.int32)
+        return tf.reduce_sum(tf.to_int64(tf.greater_equal(length, boundaries)))
+
+    @staticmethod
+    def _build_dataset_from_store(input_set, batch_size, max_input_seq_length, char_map, feature_store,
+                                  bucket_boundaries=None):
+        """
+        Build a tensorflow Dataset reading the precomputed features from a FeatureStore
+
+        Items are batched before reading the features so that each batch is assembled at once by slicing into the
+        store's memory map, avoiding per-utterance allocations and copies.
+        Parameters and returned value are the same as build_dataset.
+        """
+        missing_files = feature_store.get_missing_files([item[0] for item in input_set])
+        if len(missing_files) > 0:
+            raise ValueError("{0} files of the dataset are missing from the feature store {1}, run stt.py with "
+                             "--extract_features to finish the extraction".format(len(missing_files),
+                                                                                 feature_store.path))
+
+        offsets = np.array([feature_store.index[item[0]][0] for item in input_set], dtype=np.int64)
+        lengths = np.array([feature_store.index[item[0]][1] for item in input_set], dtype=np.int32)
+        labels = [item[1] for item in input_set]
+        dataset = tf.data.Dataset.from_tensor_slices((offsets, lengths, labels))
+        if bucket_boundaries:
+            # Group the inputs by length, the exact length of each input is known from the store
+            dataset = dataset.apply(tf.contrib.data.group_by_window(
+                key_func=lambda _offset, length, _label: AcousticModel._get_bucket_id(length, bucket_boundaries),
+                reduce_func=lambda _key, window: window.batch(batch_size),
+                window_size=batch_size))
+        else:
+            dataset = dataset.batch(batch_size)
+
+        # Read the features batch and convert string labels
+        def _read_batch_and_transcode_labels(batch_offsets, batch_lengths, batch_labels):
+            feat_vecs, feat_vec_lengths = feature_store.read_batch(batch_offsets, batch_lengths, max_input_seq_length)
+            # Need to convert back to string because tf.py_func changed it to a numpy array
+            labels_transcoded = [dataprocessor.DataProcessor.get_str_labels(char_map, str(label, encoding='UTF-8'))
+                                 for label in batch_labels]
+            # Pad the labels with zeros as padded_batch would do
+            label_batch = np.zeros((len(labels_transcoded), max(len(label) for label in labels_transcoded)),
+                                   dtype=np.int32)
+            for i, label in enumerate(labels_transcoded):
+                label_batch[i, :len(label)] = label
+            return feat_vecs, feat_vec_lengths, label_batch
+
+        def _set_shapes(feat_vecs, feat_vec_lengths, label_batch):
+            feat_vecs.set_shape([None, None, feature_store.feature_size])
+            feat_vec_lengths.set_shape([None])
+            label_batch.set_shape([None, None])
+            return feat_vecs, feat_vec_lengths, label_batch
+
+        dataset = dataset.map(lambda batch_offsets, batch_lengths, batch_labels:
+                              tuple(tf.py_func(_read_batch_and_transcode_labels,
+                                               [batch_offsets, batch_lengths, batch_labels],
+                                               [tf.float32, tf.int32, tf.int32])),
+                              num_parallel_calls=2)
+        dataset = dataset.map(_set_shapes).prefetch(3)
+        return dataset
+
     def add_dataset_input(self, dataset):
         """
         Add one dataset as an input to the model
@@ -870,18 +1299,21 @@ class AcousticModel(object):
                                             lambda: v_iterator.get_next())
         return t_iterator, v_iterator
 
-    def _write_timeline(self, run_metadata, inter_time, action=""):
+    def _write_timeline(self, run_metadata, inter_time, action="", timing=None):
         logging.debug("--- Action %s duration : %.4f", action, time.time() - inter_time)
 
         if self.tensorboard_dir is None:
             logging.warning("Could not write timeline, a tensorboard_dir is required in config file")
-            return
+            return time.time()
 
         # Create the Timeline object, and write it to a json
+        start_time = time.time()
         trace = timeline.Timeline(step_stats=run_metadata.step_stats)
         logging.info('Writing to timeline-' + action + '.ctf.json')
         with open(self.tensorboard_dir + '/' + 'timeline-' + action + '.ctf.json', 'w') as trace_file:
             trace_file.write(trace.generate_chrome_trace_format())
+        if timing is not None:
+            timing["summary"] += time.time() - start_time
         return time.time()
 
     def run_train_step(self, sess, mini_batch_size, rnn_state_reset_ratio, run_options=None, run_metadata=None):
@@ -898,26 +1330,44 @@ class AcousticModel(object):
         :param run_options: options parameter for the sess.run calls
         :param run_metadata: run_metadata parameter for the sess.run calls
         :returns float mean_loss: mean loss for the train batch run
-        :returns float mean_error_rate: mean error rate for the train batch run
+        :returns float mean_error_rate: mean error rate of the last train batch on which it was computed (see
+                                        training_error_rate_every)
         :returns int current_step: new value of the step counter at the end of this batch
         :returns bool dataset_empty: `True` if the dataset was emptied during the batch
         """
+        # Write the timing of the previous step
+        self.write_step_timing()
+        timing = {"input_wait": 0.0, "compute": 0.0, "summary": 0.0, "checkpoint": 0.0}
+
         start_time = inter_time = time.time()
         dataset_empty = False
+        timeline_prefix = ""
+        if self.timeline_enabled and self.timeline_per_step:
+            timeline_prefix = "step-{0}-".format(self.global_step.eval() + 1)
+
+        # Choose the mini-batchs on which the training error rate is computed, the previous value is kept if there is
+        # none in this batch
+        compute_error_rates = [(self.training_mini_batch_count + i) % self.training_error_rate_every == 0
+                               for i in range(mini_batch_size)]
 
         # Start a new batch
-        self.start_batch(sess, True, run_options=run_options, run_metadata=run_metadata)
+        self.start_batch(sess, True, run_options=run_options, run_metadata=run_metadata,
+                         reset_training_error_rate=any(compute_error_rates))
+        timing["compute"] += time.time() - start_time
         if self.timeline_enabled:
-            inter_time = self._write_timeline(run_metadata, inter_time, "start_batch")
+            inter_time = self._write_timeline(run_metadata, inter_time, timeline_prefix + "start_batch", timing)
 
         # Run multiple mini-batchs inside the train step
         mini_batch_num = 0
         try:
             for i in range(mini_batch_size):
                 # Run a step on a batch and keep the loss
-                mini_batch_num = self.run_step(sess, True, run_options=run_options, run_metadata=run_metadata)
+                mini_batch_num = self.run_step(sess, True, run_options=run_options, run_metadata=run_metadata,
+                                               timing=timing, compute_error_rate=compute_error_rates[i])
+                self.training_mini_batch_count += 1
                 if self.timeline_enabled:
-                    inter_time = self._write_timeline(run_metadata, inter_time, "step-" + str(i))
+                    inter_time = self._write_timeline(run_metadata, inter_time,
+                                                      timeline_prefix + "step-" + str(i), timing)
         except tf.errors.OutOfRangeError:
             logging.debug("Dataset empty, exiting train step")
             dataset_empty = True
@@ -926,14 +1376,54 @@ class AcousticModel(object):
         if mini_batch_num > 0:
             mean_loss, mean_error_rate, current_step = self.end_batch(sess, True, run_options=run_options,
                                                                       run_metadata=run_metadata,
-                                                                      rnn_state_reset_ratio=rnn_state_reset_ratio)
+                                                                      rnn_state_reset_ratio=rnn_state_reset_ratio,
+                                                                      timing=timing)
             if self.timeline_enabled:
-                _ = self._write_timeline(run_metadata, inter_time, "end_batch")
+                _ = self._write_timeline(run_metadata, inter_time, timeline_prefix + "end_batch", timing)
 
             # Step result
-            logging.info("Batch %d : loss %.5f - error_rate %.5f - duration %.2f",
-                         current_step, mean_loss, mean_error_rate, time.time() - start_time)
+            logging.info("Batch %d : loss %.5f - error_rate %.5f - duration %.2f (input wait %.2f - compute %.2f - "
+                         "summary %.2f)", current_step, mean_loss, mean_error_rate, time.time() - start_time,
+                         timing["input_wait"], timing["compute"], timing["summary"])
+            self.step_timing = dict(timing, step=current_step)
 
             return mean_loss, mean_error_rate, current_step, dataset_empty
         else:
             return 0.0, 0.0, self.global_step.eval(), dataset_empty
+
+    def add_step_timing_file(self, step_timing_file):
+        """
+        Write the timing of each train step to a CSV file
+
+        :param step_timing_file: path to the CSV file, rows are appended if it already exists
+        """
+        self.step_timing_file = step_timing_file
+
+    def add_step_overhead(self, duration):
+        """
+        Account a duration (checkpoint saving, evaluation...) to the overhead of the last train step
+
+        :param duration: the duration in seconds
+        """
+        if self.step_timing is not None:
+            self.step_timing["checkpoint"] += duration
+
+    def write_step_timing(self):
+        """
+        Write the timing of the last train step as tensorboard scalars and to the CSV file (if set)
+        """
+        if self.step_timing is None:
+            return
+        timing = self.step_timing
+        self.step_timing = None
+        names = ["input_wait", "compute", "summary", "checkpoint"]
+        if self.summary_writer_op is not None:
+            summary = tf.Summary(value=[tf.Summary.Value(tag="Step_timing/" + name, simple_value=timing[name])
+                                        for name in names])
+            self.summary_writer_op.add_summary(summary, timing["step"])
+        if self.step_timing_file is not None:
+            write_header = not os.path.exists(self.step_timing_file)
+            with open(self.step_timing_file, "a") as f:
+                if write_header:
+                    f.write(",".join(["step"] + names) + "\n")
+                f.write(",".join([str(timing["step"])] + ["{0:.4f}".format(timing[name]) for name in names]) + "\n")
@@ -56,6 +56,7 @@ class LanguageModel(object):
 
         # Create object's variable for result output
         self.prediction = None
+        self.dense_prediction = None
 
         # Create object's variables for placeholders
         self.input_keep_prob_ph = self.output_keep_prob_ph = None
@@ -111,6 +112,11 @@ class LanguageModel(object):
         self.global_step, logits, self.prediction, self.rnn_keep_state_op, self.rnn_state_zero_op, \
             _, _, self.rnn_tuple_state = self._build_base_rnn(self.inputs_ph, self.input_seq_lengths_ph, True)
 
+        # Build the dense conversion of the prediction once so that process_input fetches it in a single run
+        # without adding new ops to the graph on each call
+        self.dense_prediction = tf.sparse_tensor_to_dense(self.prediction, default_value=self.num_labels,
+                                                          validate_indices=True)
+
         # Add the saving and restore operation
         self.saver_op = self._add_saving_op()
 
@@ -594,11 +600,7 @@ class LanguageModel(object):
             input_feed[self.input_keep_prob_ph] = 1.0
             input_feed[self.output_keep_prob_ph] = 1.0
 
-        output_feed = [self.prediction]
-        outputs = session.run(output_feed, input_feed, options=run_options, run_metadata=run_metadata)
-        predictions = session.run(tf.sparse_tensor_to_dense(outputs[0], default_value=self.num_labels,
-                                                            validate_indices=True),
-                                  options=run_options, run_metadata=run_metadata)
+        predictions = session.run(self.dense_prediction, input_feed, options=run_options, run_metadata=run_metadata)
         return predictions
 
     @staticmethod
@@ -638,9 +640,6 @@ class LanguageModel(object):
         # And zip them together
         dataset = tf.data.Dataset.zip((input_dataset, input_length_dataset, label_dataset))
 
-        # TODO : add a filter for files which are too long (currently de-structuring with Dataset.filter is not
-        #        supported in python3)
-
         return dataset
 
     def add_dataset_input(self, dataset):
@@ -55,9 +55,8 @@ class SpeechRecognizer(object):
     def get_char_map_length(self):
         return len(self.char_map)
 
-    @staticmethod
-    def load_acoustic_dataset(training_dataset_dirs, test_dataset_dirs=None, training_filelist_cache=None,
-                              ordered=False, train_frac=None):
+    def load_acoustic_dataset(self, training_dataset_dirs, test_dataset_dirs=None, training_filelist_cache=None,
+                              ordered=False, train_frac=None, max_input_seq_length=None, max_target_seq_length=None):
         """
         Load the datatsets for the acoustic model training
         Return a train set and an optional test set, each containing a list of [audio_file, label, audio_length]
@@ -70,12 +69,17 @@ class SpeechRecognizer(object):
         :param ordered: boolean indicating whether or not to order the dataset by audio files length (ascending)
         :param train_frac: the fraction of the training data to be used as test data
                            (only used if test_dataset_dirs is None)
+        :param max_input_seq_length: remove the audio files whose features would be longer than this (optional)
+        :param max_target_seq_length: remove the labels longer than this once transcoded (optional)
         :return train_set, test_set: two lists of [audio_file, label, audio_length] where
                                          audio_file is the path to an audio file
                                          label is the true label for the audio file (relative to the char_map)
                                          audio_length if the length of the audio file
         """
-        data_processor = dataprocessor.DataProcessor(training_dataset_dirs, file_cache=training_filelist_cache)
+        data_processor = dataprocessor.DataProcessor(training_dataset_dirs, file_cache=training_filelist_cache,
+                                                     max_input_seq_length=max_input_seq_length,
+                                                     max_target_seq_length=max_target_seq_length,
+                                                     char_map=self.char_map)
         train_set = data_processor.get_dataset()
         if ordered:
             train_set = sorted(train_set, key=lambda x: x[2])
@@ -83,7 +87,9 @@ class SpeechRecognizer(object):
             shuffle(train_set)
         if test_dataset_dirs is not None:
             # Load the test set data
-            data_processor = dataprocessor.DataProcessor(test_dataset_dirs)
+            data_processor = dataprocessor.DataProcessor(test_dataset_dirs, max_input_seq_length=max_input_seq_length,
+                                                         max_target_seq_length=max_target_seq_length,
+                                                         char_map=self.char_map)
             test_set = data_processor.get_dataset()
         elif train_frac is not None:
             # Or use a fraction of the train set for the test set
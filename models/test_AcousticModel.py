@@ -1,8 +1,15 @@
 # coding=utf-8
 import unittest
-from models.AcousticModel import AcousticModel
+import tempfile
+import shutil
+import os
+import wave
+import librosa
+from models.AcousticModel import AcousticModel, LSTM_IMPLEMENTATIONS, DECODERS
 import tensorflow as tf
+import numpy as np
 from models.SpeechRecognizer import ENGLISH_CHAR_MAP
+import util.audioprocessor as audioprocessor
 
 
 class TestAcousticModel(unittest.TestCase):
@@ -30,6 +37,142 @@ class TestAcousticModel(unittest.TestCase):
                                   self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
             model.create_forward_rnn()
 
+    def test_graph_size_does_not_depend_on_max_input_seq_length(self):
+        graph_sizes = []
+        for max_input_seq_length in [100, self.max_input_seq_length]:
+            tf.reset_default_graph()
+            with tf.Session() as sess:
+                model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, max_input_seq_length,
+                                      self.max_target_seq_length, self.input_dim, self.normalization,
+                                      self.num_labels)
+                model.create_forward_rnn()
+                graph_sizes.append(len(sess.graph.as_graph_def().node))
+        self.assertEqual(graph_sizes[0], graph_sizes[1])
+
+    def test_process_input_with_variable_length(self):
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+            model.create_forward_rnn()
+            model.initialize(sess)
+            for length in [30, 75]:
+                feat_vec = np.random.rand(length, self.input_dim)
+                predictions = model.process_input(sess, model.build_input_batch([feat_vec]), [length])
+                self.assertEqual(len(predictions), self.batch_size)
+
+    def test_process_input_does_not_grow_the_graph(self):
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+            model.create_forward_rnn()
+            model.initialize(sess)
+            graph_size = len(sess.graph.as_graph_def().node)
+            feat_vec = np.random.rand(10, self.input_dim)
+            for _ in range(1000):
+                model.process_input(sess, model.build_input_batch([feat_vec]), [10])
+            self.assertEqual(len(sess.graph.as_graph_def().node), graph_size)
+
+    def test_decoders(self):
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(self.num_layers, self.hidden_size, 2, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+            model.create_forward_rnn()
+            model.initialize(sess)
+            # A model which can not stream has no stream decoding ops
+            self.assertIsNone(model.stream_dense_prediction)
+            feat_vecs = [np.random.rand(40, self.input_dim), np.random.rand(25, self.input_dim)]
+            predictions = {}
+            for decoder in DECODERS:
+                model.decoder = decoder
+                predictions[decoder] = model.process_input(sess, model.build_input_batch(feat_vecs), [40, 25])
+                self.assertEqual(len(predictions[decoder]), 2)
+                # Padded with num_labels as the tensorflow decoder output, the blank is never emitted
+                self.assertTrue(np.all((predictions[decoder] < self.num_labels - 1) |
+                                       (predictions[decoder] == self.num_labels)))
+        with self.assertRaises(ValueError):
+            AcousticModel(self.num_layers, self.hidden_size, 2, self.max_input_seq_length, self.max_target_seq_length,
+                          self.input_dim, self.normalization, self.num_labels, decoder="unknown")
+
+    def test_stream_carries_the_rnn_state(self):
+        tf.reset_default_graph()
+        with tf.Session() as sess:
+            model = AcousticModel(self.num_layers, self.hidden_size, 1, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+            model.create_forward_rnn()
+            model.initialize(sess)
+            feat_vec = np.random.rand(60, self.input_dim)
+            expected_logits = sess.run(model.logits, {model.inputs_ph: model.build_input_batch([feat_vec]),
+                                                      model.input_seq_lengths_ph: [60]})
+
+            # Processing the frames by chunks must give the same result as processing them at once
+            model.start_stream(sess, self.signal_processing)
+            for i in range(0, 60, 7):
+                model.process_stream_frames(sess, feat_vec[i:i + 7])
+            np.testing.assert_allclose(np.concatenate(model._stream_logits), expected_logits, rtol=1e-4, atol=1e-5)
+            model.finish_stream(sess)
+
+    def test_stream_wav_file_by_chunks(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # Write a wav file with some noise and read it back as a recording would
+            audio_file = os.path.join(directory, "stream.wav")
+            signal = (np.random.uniform(-0.5, 0.5, 16000) * 32767).astype(np.int16)
+            with wave.open(audio_file, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(16000)
+                f.writeframes(signal.tobytes())
+            sig, sr = librosa.load(audio_file, mono=True)
+
+            tf.reset_default_graph()
+            with tf.Session() as sess:
+                model = AcousticModel(self.num_layers, self.hidden_size, 1, self.max_input_seq_length,
+                                      self.max_target_seq_length, self.input_dim, self.normalization,
+                                      self.num_labels)
+                model.create_forward_rnn()
+                model.initialize(sess)
+                model.start_stream(sess, self.signal_processing)
+                chunk_size = int(sr * 0.1)
+                for i in range(0, len(sig), chunk_size):
+                    partial = model.process_stream_audio(sess, sig[i:i + chunk_size], sr)
+                    self.assertTrue(all(0 <= label < self.num_labels - 1 for label in partial))
+                # Every frame of the file has been processed once the stream is finished
+                final = model.finish_stream(sess)
+                audio_processor = audioprocessor.AudioProcessor(None, self.signal_processing)
+                _, expected_length = audio_processor.process_signal(sig, sr)
+                self.assertEqual(model._stream_frames_count, expected_length)
+                self.assertTrue(all(0 <= label < self.num_labels for label in final))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lstm_implementations_share_checkpoints(self):
+        checkpoint_dir = tempfile.mkdtemp()
+        inputs = np.random.rand(40, self.batch_size, self.input_dim)
+        try:
+            results = []
+            for lstm_implementation in LSTM_IMPLEMENTATIONS:
+                tf.reset_default_graph()
+                with tf.Session() as sess:
+                    model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size,
+                                          self.max_input_seq_length, self.max_target_seq_length, self.input_dim,
+                                          self.normalization, self.num_labels, lstm_implementation)
+                    logits = model.create_forward_rnn()
+                    model.initialize(sess)
+                    # Save the weights of the first implementation and restore them in the others
+                    if len(results) == 0:
+                        model.save(sess, checkpoint_dir)
+                    else:
+                        model.restore(sess, checkpoint_dir)
+                    results.append(sess.run(logits, {model.inputs_ph: inputs,
+                                                     model.input_seq_lengths_ph: [40] * self.batch_size}))
+            for result in results[1:]:
+                np.testing.assert_allclose(result, results[0], rtol=1e-4, atol=1e-4)
+        finally:
+            shutil.rmtree(checkpoint_dir)
+
     def test_create_training_rnn(self):
         tf.reset_default_graph()
         with tf.Session():
@@ -53,6 +196,86 @@ class TestAcousticModel(unittest.TestCase):
             model.create_training_rnn(self.input_keep_prob, self.output_keep_prob, self.grad_clip,
                                       self.learning_rate, self.lr_decay_factor, use_iterator=True)
 
+    def test_create_training_rnn_with_bucketed_iterators(self):
+        tf.reset_default_graph()
+
+        with tf.Session():
+            model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+
+            # Create a Dataset grouping the inputs by length
+            train_dataset = model.build_dataset([["/file/path", "Test", 10], ["/file/path2", "Test", 2]],
+                                                self.batch_size, self.max_input_seq_length,
+                                                self.max_target_seq_length, self.signal_processing, ENGLISH_CHAR_MAP,
+                                                bucket_boundaries=[200, 500])
+            model.add_dataset_input(train_dataset)
+            model.create_training_rnn(self.input_keep_prob, self.output_keep_prob, self.grad_clip,
+                                      self.learning_rate, self.lr_decay_factor, use_iterator=True)
+
+    def test_train_step_timing(self):
+        tf.reset_default_graph()
+        directory = tempfile.mkdtemp()
+        try:
+            with tf.Session() as sess:
+                model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                      self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+                # A dataset of 3 random batches
+                inputs = np.random.rand(3, self.batch_size, 100, self.input_dim).astype(np.float32)
+                lengths = np.full((3, self.batch_size), 100, dtype=np.int32)
+                labels = np.random.randint(1, self.num_labels - 1, (3, self.batch_size, 10)).astype(np.int32)
+                iterator = model.add_dataset_input(tf.data.Dataset.from_tensor_slices((inputs, lengths, labels)))
+                model.create_training_rnn(self.input_keep_prob, self.output_keep_prob, self.grad_clip,
+                                          self.learning_rate, self.lr_decay_factor, use_iterator=True)
+                model.initialize(sess)
+                sess.run(iterator.initializer)
+                timing_file = os.path.join(directory, "step_timing.csv")
+                model.add_step_timing_file(timing_file)
+
+                for _ in range(3):
+                    model.run_train_step(sess, 1, 1.0)
+                model.add_step_overhead(0.5)
+                model.write_step_timing()
+
+            with open(timing_file) as f:
+                rows = [line.strip().split(",") for line in f]
+            self.assertEqual(rows[0], ["step", "input_wait", "compute", "summary", "checkpoint"])
+            self.assertEqual([int(row[0]) for row in rows[1:]], [1, 2, 3])
+            for row in rows[1:]:
+                self.assertTrue(all(float(value) >= 0.0 for value in row[1:]))
+            # The overhead is accounted to the last step
+            self.assertEqual(float(rows[-1][4]), 0.5)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_training_error_rate_decoding(self):
+        inputs = np.random.rand(4, self.batch_size, 100, self.input_dim).astype(np.float32)
+        lengths = np.full((4, self.batch_size), 100, dtype=np.int32)
+        labels = np.random.randint(1, self.num_labels - 1, (4, self.batch_size, 10)).astype(np.int32)
+        for decoder, every in [("beam", 1), ("greedy", 1), ("greedy", 3)]:
+            tf.reset_default_graph()
+            with tf.Session() as sess:
+                model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                      self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+                iterator = model.add_dataset_input(tf.data.Dataset.from_tensor_slices((inputs, lengths, labels)))
+                model.create_training_rnn(self.input_keep_prob, self.output_keep_prob, self.grad_clip,
+                                          self.learning_rate, self.lr_decay_factor, use_iterator=True,
+                                          training_error_rate_decoder=decoder, training_error_rate_every=every)
+                model.initialize(sess)
+                sess.run(iterator.initializer)
+                error_rates = [model.run_train_step(sess, 1, 1.0)[1] for _ in range(4)]
+                self.assertEqual(model.training_mini_batch_count, 4)
+                self.assertTrue(all(error_rate >= 0.0 for error_rate in error_rates))
+                if every == 3:
+                    # The steps without decoding report the last computed error rate
+                    self.assertEqual(error_rates[1], error_rates[0])
+                    self.assertEqual(error_rates[2], error_rates[0])
+        with self.assertRaises(ValueError):
+            tf.reset_default_graph()
+            model = AcousticModel(self.num_layers, self.hidden_size, self.batch_size, self.max_input_seq_length,
+                                  self.max_target_seq_length, self.input_dim, self.normalization, self.num_labels)
+            model.create_training_rnn(self.input_keep_prob, self.output_keep_prob, self.grad_clip,
+                                      self.learning_rate, self.lr_decay_factor, training_error_rate_decoder="unknown")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,17 +3,19 @@
 Main program to use the speech recognizer.
 """
 
-from models.AcousticModel import AcousticModel
-from models.LanguageModel import LanguageModel
 from models.SpeechRecognizer import SpeechRecognizer
-import tensorflow as tf
 import numpy as np
 import util.hyperparams as hyperparams
 import util.audioprocessor as audioprocessor
 import util.dataprocessor as dataprocessor
+import util.featurestore as featurestore
+import util.transcriptionserver as transcriptionserver
+import util.evaluationresults as evaluationresults
 import argparse
 import logging
+import time
 from random import shuffle
+from functools import partial
 import sys
 
 
@@ -22,7 +24,7 @@ def main():
     serializer = hyperparams.HyperParameterHandler(prog_params['config_file'])
     hyper_params = serializer.get_hyper_params()
     audio_processor = audioprocessor.AudioProcessor(hyper_params["max_input_seq_length"],
-                                                    hyper_params["signal_processing"])
+                                                    hyper_params["signal_processing"], hyper_params["sample_rate"])
     # Get the input dimension for the RNN, depend on the chosen signal processing mode
     hyper_params["input_dim"] = audio_processor.feature_size
 
@@ -39,19 +41,34 @@ def main():
                                                                 hyper_params["test_dataset_dirs"],
                                                                 hyper_params["training_filelist_cache"],
                                                                 ordered,
-                                                                hyper_params["train_frac"])
+                                                                hyper_params["train_frac"],
+                                                                hyper_params["max_input_seq_length"],
+                                                                hyper_params["max_target_seq_length"])
         train_acoustic_rnn(train_set, test_set, hyper_params, prog_params)
     elif prog_params['train_language'] is True:
         train_set, test_set = load_language_dataset(hyper_params)
         train_language_rnn(train_set, test_set, hyper_params, prog_params)
     elif prog_params['file'] is not None:
         process_file(audio_processor, hyper_params, prog_params['file'])
+    elif (prog_params['files'] is not None) or (prog_params['filelist'] is not None):
+        files = prog_params['files']
+        if files is None:
+            with open(prog_params['filelist'], "r") as f:
+                files = [line.strip() for line in f if line.strip() != ""]
+        process_files(hyper_params, files, prog_params['output'])
     elif prog_params['record'] is True:
-        record_and_write(audio_processor, hyper_params)
+        record_and_write(hyper_params)
     elif prog_params['evaluate'] is True:
-        evaluate(hyper_params)
+        evaluate(hyper_params, prog_params['shard'], prog_params['results'])
+    elif prog_params['merge_results'] is not None:
+        merge_results(prog_params['merge_results'])
     elif prog_params['generate_text'] is True:
         generate_text(hyper_params)
+    elif prog_params['extract_features'] is True:
+        extract_features(speech_reco, hyper_params)
+    elif prog_params['server'] is True:
+        run_server(audio_processor, hyper_params, prog_params['host'], prog_params['port'], prog_params['max_wait'],
+                   prog_params['request_timeout'])
 
 
 def build_language_training_rnn(sess, hyper_params, prog_params, train_set, test_set):
@@ -91,16 +108,18 @@ def build_language_training_rnn(sess, hyper_params, prog_params, train_set, test
     return model, t_iterator, v_iterator
 
 
-def build_acoustic_training_rnn(sess, hyper_params, prog_params, train_set, test_set):
+def build_acoustic_training_rnn(sess, hyper_params, prog_params, train_set, test_set, feature_store=None):
     model = AcousticModel(hyper_params["num_layers"], hyper_params["hidden_size"], hyper_params["batch_size"],
                           hyper_params["max_input_seq_length"], hyper_params["max_target_seq_length"],
                           hyper_params["input_dim"], hyper_params["batch_normalization"],
-                          hyper_params["char_map_length"])
+                          hyper_params["char_map_length"], hyper_params["lstm_implementation"])
 
     # Create a Dataset from the train_set and the test_set
     train_dataset = model.build_dataset(train_set, hyper_params["batch_size"], hyper_params["max_input_seq_length"],
                                         hyper_params["max_target_seq_length"], hyper_params["signal_processing"],
-                                        hyper_params["char_map"])
+                                        hyper_params["char_map"], feature_store,
+                                        hyper_params["bucket_boundaries"], hyper_params["sample_rate"],
+                                        hyper_params["feature_workers"])
 
     v_iterator = None
     if test_set is []:
@@ -109,7 +128,9 @@ def build_acoustic_training_rnn(sess, hyper_params, prog_params, train_set, test
     else:
         test_dataset = model.build_dataset(test_set, hyper_params["batch_size"], hyper_params["max_input_seq_length"],
                                            hyper_params["max_target_seq_length"], hyper_params["signal_processing"],
-                                           hyper_params["char_map"])
+                                           hyper_params["char_map"], feature_store,
+                                           hyper_params["bucket_boundaries"], hyper_params["sample_rate"],
+                                           hyper_params["feature_workers"])
 
         # Build the input stream from the different datasets
         t_iterator, v_iterator = model.add_datasets_input(train_dataset, test_dataset)
@@ -119,8 +140,12 @@ def build_acoustic_training_rnn(sess, hyper_params, prog_params, train_set, test
     # Create the model
     model.create_training_rnn(hyper_params["dropout_input_keep_prob"], hyper_params["dropout_output_keep_prob"],
                               hyper_params["grad_clip"], hyper_params["learning_rate"],
-                              hyper_params["lr_decay_factor"], use_iterator=True)
-    model.add_tensorboard(sess, hyper_params["tensorboard_dir"], prog_params["tb_name"], prog_params["timeline"])
+                              hyper_params["lr_decay_factor"], use_iterator=True,
+                              training_error_rate_decoder=hyper_params["training_error_rate_decoder"],
+                              training_error_rate_every=hyper_params["training_error_rate_every"])
+    model.add_tensorboard(sess, hyper_params["tensorboard_dir"], prog_params["tb_name"],
+                          prog_params["timeline"] or (prog_params["profile_steps"] is not None),
+                          timeline_per_step=prog_params["profile_steps"] is not None)
     model.initialize(sess)
     model.restore(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
 
@@ -131,11 +156,16 @@ def build_acoustic_training_rnn(sess, hyper_params, prog_params, train_set, test
     return model, t_iterator, v_iterator
 
 
-def load_language_dataset(_hyper_params):
+def load_language_dataset(hyper_params):
     # TODO : write the code...
     train_set = ["the brown lazy fox", "the red quick fox"]
     test_set = ["the white big horse", "the yellow small cat"]
-    return train_set, test_set
+
+    # Remove the sentences too long for the model before building the datasets
+    def _filter(dataset):
+        return [sentence for sentence in dataset if len(dataprocessor.DataProcessor.get_str_labels(
+            hyper_params["char_map"], sentence)) <= hyper_params["max_input_seq_length"]]
+    return _filter(train_set), _filter(test_set)
 
 
 def configure_tf_session(xla, timeline):
@@ -168,13 +198,59 @@ def train_language_rnn(train_set, test_set, hyper_params, prog_params):
     return
 
 
+def get_feature_store(hyper_params, files):
+    """
+    Open the feature store set in the config file
+    A store which does not hold all the files (an interrupted extraction for example) is refused rather than training
+    on part of the dataset
+
+    :param hyper_params: the hyper parameters
+    :param files: the audio files which will be read from the store
+    :return: a FeatureStore or None if no store is configured or if it is empty
+    """
+    if hyper_params["feature_store_dir"] is None:
+        return None
+    feature_store = featurestore.FeatureStore(hyper_params["feature_store_dir"], hyper_params["signal_processing"],
+                                              hyper_params["sample_rate"])
+    if len(feature_store) == 0:
+        logging.warning("Feature store %s is empty, audio files will be processed on the fly", feature_store.path)
+        return None
+    missing_files = feature_store.get_missing_files(files)
+    if len(missing_files) > 0:
+        raise ValueError("{0} of the {1} files of the training and test sets are missing from the feature store {2} "
+                         "(first one : {3}), run stt.py with --extract_features to finish the extraction"
+                         .format(len(missing_files), len(set(files)), feature_store.path, missing_files[0]))
+    logging.info("Using %d files from feature store %s", len(feature_store), feature_store.path)
+    return feature_store
+
+
+def extract_features(speech_reco, hyper_params):
+    if hyper_params["feature_store_dir"] is None:
+        logging.fatal("Setting feature_store_dir in config file is mandatory for features extraction")
+        return
+
+    train_set, test_set = speech_reco.load_acoustic_dataset(hyper_params["training_dataset_dirs"],
+                                                            hyper_params["test_dataset_dirs"],
+                                                            hyper_params["training_filelist_cache"],
+                                                            max_input_seq_length=hyper_params["max_input_seq_length"],
+                                                            max_target_seq_length=hyper_params["max_target_seq_length"])
+    feature_store = featurestore.FeatureStore(hyper_params["feature_store_dir"], hyper_params["signal_processing"],
+                                              hyper_params["sample_rate"])
+    added = feature_store.extract([item[0] for item in train_set + test_set])
+    print("Added {0} files to the feature store, {1} files available".format(added, len(feature_store)))
+
+
 def train_acoustic_rnn(train_set, test_set, hyper_params, prog_params):
-    config, run_metadata, run_options = configure_tf_session(prog_params["XLA"], prog_params["timeline"])
+    profile_steps = prog_params["profile_steps"]
+    config, run_metadata, run_options = configure_tf_session(prog_params["XLA"],
+                                                             prog_params["timeline"] or (profile_steps is not None))
+    feature_store = get_feature_store(hyper_params, [item[0] for item in train_set + test_set])
 
     with tf.Session(config=config) as sess:
         # Initialize the model
-        model, t_iterator, v_iterator = build_acoustic_training_rnn(sess, hyper_params,
-                                                                    prog_params, train_set, test_set)
+        model, t_iterator, v_iterator = build_acoustic_training_rnn(sess, hyper_params, prog_params,
+                                                                    train_set, test_set, feature_store)
+        model.add_step_timing_file(hyper_params["checkpoint_dir"] + "/acoustic/step_timing.csv")
 
         previous_mean_error_rates = []
         current_step = epoch = 0
@@ -187,6 +263,15 @@ def train_acoustic_rnn(train_set, test_set, hyper_params, prog_params):
                                          run_options=run_options, run_metadata=run_metadata)
                 mean_error_rate += step_mean_error_rate / hyper_params["steps_per_checkpoint"]
 
+                # Stop tracing once the requested number of steps is profiled
+                if profile_steps is not None:
+                    profile_steps -= 1
+                    if profile_steps <= 0:
+                        logging.info("Profiled steps written to the timeline files, tracing is now disabled")
+                        profile_steps = None
+                        run_options = None
+                        model.timeline_enabled = False
+
                 if dataset_empty is True:
                     epoch += 1
                     logging.info("End of epoch number : %d", epoch)
@@ -202,19 +287,24 @@ def train_acoustic_rnn(train_set, test_set, hyper_params, prog_params):
                                                                 hyper_params["max_input_seq_length"],
                                                                 hyper_params["max_target_seq_length"],
                                                                 hyper_params["signal_processing"],
-                                                                hyper_params["char_map"])
+                                                                hyper_params["char_map"], feature_store,
+                                                                hyper_params["bucket_boundaries"],
+                                                                hyper_params["sample_rate"],
+                                                                hyper_params["feature_workers"])
                             sess.run(t_iterator.make_initializer(train_dataset))
                         else:
                             logging.info("Reuse the same training dataset")
                             sess.run(t_iterator.initializer)
 
             # Save the model
+            checkpoint_start_time = time.time()
             model.save(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
 
             # Run an evaluation session
             if (current_step % hyper_params["steps_per_evaluation"] == 0) and (v_iterator is not None):
                 model.run_evaluation(sess, run_options=run_options, run_metadata=run_metadata)
                 sess.run(v_iterator.initializer)
+            model.add_step_overhead(time.time() - checkpoint_start_time)
 
             # Decay the learning rate if the model is not improving
             if mean_error_rate <= min(previous_mean_error_rates, default=sys.maxsize):
@@ -233,38 +323,132 @@ def train_acoustic_rnn(train_set, test_set, hyper_params, prog_params):
             if (prog_params["max_epoch"] is not None) and (epoch > prog_params["max_epoch"]):
                 logging.info("Max number of epochs reached, exiting training session")
                 break
+        model.write_step_timing()
     return
 
 
+def build_acoustic_forward_rnn(sess, hyper_params, batch_size):
+    """
+    Create the forward-only acoustic RNN and restore its weights from the checkpoint
+
+    :param sess: a tensorflow session
+    :param hyper_params: the hyper parameters
+    :param batch_size: number of inputs processed at once
+    :return: the AcousticModel
+    """
+    model = AcousticModel(hyper_params["num_layers"], hyper_params["hidden_size"], batch_size,
+                          hyper_params["max_input_seq_length"], hyper_params["max_target_seq_length"],
+                          hyper_params["input_dim"], hyper_params["batch_normalization"],
+                          hyper_params["char_map_length"], hyper_params["lstm_implementation"],
+                          hyper_params["decoder"], hyper_params["beam_width"], hyper_params["beam_prune_threshold"])
+    model.create_forward_rnn()
+    model.initialize(sess)
+    model.restore(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
+    return model
+
+
 def process_file(audio_processor, hyper_params, file):
     feat_vec, original_feat_vec_length = audio_processor.process_audio_file(file)
     if original_feat_vec_length > hyper_params["max_input_seq_length"]:
         logging.warning("File too long")
         return
-    elif original_feat_vec_length < hyper_params["max_input_seq_length"]:
-        # Pad the feat_vec with zeros
-        pad_length = hyper_params["max_input_seq_length"] - original_feat_vec_length
-        padding = np.zeros((pad_length, hyper_params["input_dim"]), dtype=np.float)
-        feat_vec = np.concatenate((feat_vec, padding), 0)
 
     with tf.Session() as sess:
         # create model
-        model = AcousticModel(hyper_params["num_layers"], hyper_params["hidden_size"], 1,
-                              hyper_params["max_input_seq_length"], hyper_params["max_target_seq_length"],
-                              hyper_params["input_dim"], hyper_params["batch_normalization"],
-                              hyper_params["char_map_length"])
-        model.create_forward_rnn()
-        model.initialize(sess)
-        model.restore(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
+        model = build_acoustic_forward_rnn(sess, hyper_params, 1)
 
-        (a, b) = feat_vec.shape
-        feat_vec = feat_vec.reshape((a, 1, b))
-        predictions = model.process_input(sess, feat_vec, [original_feat_vec_length])
+        predictions = model.process_input(sess, model.build_input_batch([feat_vec]), [original_feat_vec_length])
         transcribed_text = [dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"], prediction)
                             for prediction in predictions]
         print(transcribed_text[0])
 
 
+def process_files(hyper_params, files, output_file=None):
+    """
+    Transcribe a list of audio files, loading the model once and processing the files by batchs
+    The features are extracted by a pool of worker processes while the model runs
+    Each result is written as a "path<TAB>transcript" line as soon as its batch is processed
+
+    :param hyper_params: the hyper parameters
+    :param files: a list of audio file paths
+    :param output_file: path to the result file (results are written on standard output if None)
+    """
+    output = sys.stdout if output_file is None else open(output_file, "w")
+    extract_function = partial(audioprocessor.extract_file_features,
+                               max_input_seq_length=hyper_params["max_input_seq_length"],
+                               signal_processing=hyper_params["signal_processing"],
+                               sample_rate=hyper_params["sample_rate"])
+
+    try:
+        with audioprocessor.create_worker_pool() as pool, tf.Session() as sess:
+            model = build_acoustic_forward_rnn(sess, hyper_params, hyper_params["batch_size"])
+
+            batch_files = []
+            batch_feat_vecs = []
+            processed_count = 0
+            for file, feat_vec, feat_vec_length in pool.imap(extract_function, files, chunksize=4):
+                processed_count += 1
+                if feat_vec is None:
+                    pass
+                elif feat_vec_length > hyper_params["max_input_seq_length"]:
+                    logging.warning("File too long : %s", file)
+                else:
+                    batch_files.append(file)
+                    batch_feat_vecs.append(feat_vec)
+
+                # Run the batch when full or when we reached the last file
+                if (len(batch_files) == model.batch_size) or\
+                   ((processed_count == len(files)) and (len(batch_files) > 0)):
+                    input_feat_vec_lengths = [len(feat_vec) for feat_vec in batch_feat_vecs]
+                    input_feat_vec_lengths += [0] * (model.batch_size - len(batch_feat_vecs))
+                    predictions = model.process_input(sess, model.build_input_batch(batch_feat_vecs),
+                                                      input_feat_vec_lengths)
+                    for batch_file, prediction in zip(batch_files, predictions):
+                        transcribed_text = dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"],
+                                                                                      prediction)
+                        output.write("{0}\t{1}\n".format(batch_file, transcribed_text))
+                    output.flush()
+                    batch_files = []
+                    batch_feat_vecs = []
+    finally:
+        if output_file is not None:
+            output.close()
+
+
+def run_server(audio_processor, hyper_params, host, port, max_wait, request_timeout):
+    """
+    Serve transcriptions over HTTP with a warm model, concurrent requests are processed by batches
+
+    :param audio_processor: the AudioProcessor used to extract the features of the uploaded audio
+    :param hyper_params: the hyper parameters
+    :param host: the host name or address to listen on
+    :param port: the port to listen on
+    :param max_wait: maximum time (in seconds) a request waits for other requests to fill its batch
+    :param request_timeout: maximum time (in seconds) a request waits for its transcript before a 503 answer
+    """
+    with tf.Session() as sess:
+        model = build_acoustic_forward_rnn(sess, hyper_params, hyper_params["batch_size"])
+
+        def transcribe_batch(feat_vecs):
+            input_feat_vec_lengths = [len(feat_vec) for feat_vec in feat_vecs]
+            input_feat_vec_lengths += [0] * (model.batch_size - len(feat_vecs))
+            predictions = model.process_input(sess, model.build_input_batch(feat_vecs), input_feat_vec_lengths)
+            return [dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"], prediction)
+                    for prediction in predictions[:len(feat_vecs)]]
+
+        batcher = transcriptionserver.MicroBatcher(transcribe_batch, model.batch_size, max_wait, request_timeout)
+        server = transcriptionserver.TranscriptionServer((host, port), audio_processor, batcher,
+                                                         hyper_params["max_input_seq_length"])
+        logging.info("Transcription server listening on %s:%d", host, port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.stop()
+
+
 def generate_text(hyper_params):
     with tf.Session() as sess:
         # Create model
@@ -291,7 +475,7 @@ def generate_text(hyper_params):
         return
 
 
-def evaluate(hyper_params):
+def evaluate(hyper_params, shard=None, result_file=None):
     if hyper_params["test_dataset_dirs"] is None:
         logging.fatal("Setting test_dataset_dirs in config file is mandatory for evaluation mode")
         return
@@ -299,62 +483,96 @@ def evaluate(hyper_params):
     # Load the test set data
     data_processor = dataprocessor.DataProcessor(hyper_params["test_dataset_dirs"])
     test_set = data_processor.get_dataset()
+    if shard is not None:
+        shard_index, shard_count = evaluationresults.parse_shard(shard)
+        test_set = evaluationresults.get_shard(test_set, shard_index, shard_count)
+        if result_file is None:
+            result_file = "evaluation-{0}-of-{1}.jsonl".format(shard_index, shard_count)
+
+    # Resume an interrupted evaluation
+    if result_file is not None:
+        scored_files = evaluationresults.read_results([result_file])
+        if len(scored_files) > 0:
+            logging.info("Resuming the evaluation, %d files already scored in %s", len(scored_files), result_file)
+        test_set = [item for item in test_set if item[0] not in scored_files]
 
     logging.info("Using %d size of test set", len(test_set))
 
-    if len(test_set) == 0:
+    if (len(test_set) == 0) and (result_file is None):
         logging.fatal("No files in test set during an evaluation mode")
         return
 
-    with tf.Session() as sess:
-        # create model
-        model = AcousticModel(hyper_params["num_layers"], hyper_params["hidden_size"], hyper_params["batch_size"],
-                              hyper_params["max_input_seq_length"], hyper_params["max_target_seq_length"],
-                              hyper_params["input_dim"], hyper_params["batch_normalization"],
-                              hyper_params["char_map_length"])
+    start_time = time.time()
+    if len(test_set) > 0:
+        with tf.Session() as sess:
+            # create model
+            model = build_acoustic_forward_rnn(sess, hyper_params, hyper_params["batch_size"])
+
+            accumulator = model.evaluate_full(sess, test_set, hyper_params["max_input_seq_length"],
+                                              hyper_params["signal_processing"], hyper_params["char_map"],
+                                              sample_rate=hyper_params["sample_rate"],
+                                              feature_workers=hyper_params["feature_workers"],
+                                              result_file=result_file)
+    if result_file is not None:
+        # Report on every file of the result file, including those scored before a resume
+        merge_results([result_file])
+    else:
+        print_error_rates(accumulator)
+    print("Evaluated {0} files in {1:.1f} s".format(len(test_set), time.time() - start_time))
+    return
 
-        model.create_forward_rnn()
-        model.initialize(sess)
-        model.restore(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
 
-        wer, cer = model.evaluate_full(sess, test_set, hyper_params["max_input_seq_length"],
-                                       hyper_params["signal_processing"], hyper_params["char_map"])
-        print("Resulting WER : {0:.3g} %".format(wer))
-        print("Resulting CER : {0:.3g} %".format(cer))
-        return
+def merge_results(result_files):
+    accumulator = evaluationresults.ErrorRateAccumulator()
+    for record in evaluationresults.read_results(result_files).values():
+        accumulator.add_record(record)
+    print_error_rates(accumulator)
 
 
-def record_and_write(audio_processor, hyper_params):
+def print_error_rates(accumulator):
+    error_rates = accumulator.get_error_rates()
+    print("Scored utterances : {0}".format(error_rates["utterances"]))
+    for unit, name in [("word", "WER"), ("char", "CER")]:
+        print("Resulting {0} : {1:.3g} % (mean of the utterances {0} : {2:.3g} %)"
+              .format(name, error_rates["corpus_" + name.lower()], error_rates["mean_" + name.lower()]))
+        print("    substitutions : {0}, insertions : {1}, deletions : {2}"
+              .format(error_rates[unit + "_substitutions"], error_rates[unit + "_insertions"],
+                      error_rates[unit + "_deletions"]))
+    if error_rates["real_time_factor"] is not None:
+        print("Real time factor : {0:.3f}".format(error_rates["real_time_factor"]))
+
+
+def record_and_write(hyper_params):
     import pyaudio
-    _CHUNK = hyper_params["max_input_seq_length"]
-    _SR = 22050
+    # Record by chunks of 100 ms, at the sample rate of the training files if they were resampled
+    _SR = hyper_params["sample_rate"] or 16000
+    _CHUNK = int(_SR * 0.1)
     p = pyaudio.PyAudio()
 
     with tf.Session() as sess:
         # create model
-        model = AcousticModel(hyper_params["num_layers"], hyper_params["hidden_size"], 1,
-                              hyper_params["max_input_seq_length"], hyper_params["max_target_seq_length"],
-                              hyper_params["input_dim"], hyper_params["batch_normalization"],
-                              hyper_params["char_map_length"])
-
-        model.create_forward_rnn()
-        model.initialize(sess)
-        model.restore(sess, hyper_params["checkpoint_dir"] + "/acoustic/")
+        model = build_acoustic_forward_rnn(sess, hyper_params, 1)
+        model.start_stream(sess, hyper_params["signal_processing"])
 
         # Create stream of listening
         stream = p.open(format=pyaudio.paInt16, channels=1, rate=_SR, input=True, frames_per_buffer=_CHUNK)
-        print("NOW RECORDING...")
-
-        while True:
-            data = stream.read(_CHUNK)
-            data = np.fromstring(data)
-            feat_vec, original_feat_vec_length = audio_processor.process_signal(data, _SR)
-            (a, b) = feat_vec.shape
-            feat_vec = feat_vec.reshape((a, 1, b))
-            predictions = model.process_input(sess, feat_vec, [original_feat_vec_length])
-            result = [dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"], prediction)
-                      for prediction in predictions]
-            print(result, end="")
+        print("NOW RECORDING... (Ctrl-C to stop)")
+
+        try:
+            while True:
+                data = stream.read(_CHUNK)
+                # Convert the 16 bits PCM samples to floats in [-1, 1] as librosa would
+                chunk = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+                labels = model.process_stream_audio(sess, chunk, _SR)
+                print("\r" + dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"], labels), end="")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+        labels = model.finish_stream(sess)
+        print("\r" + dataprocessor.DataProcessor.get_labels_str(hyper_params["char_map"], labels))
 
 
 def parse_args():
@@ -377,32 +595,72 @@ def parse_args():
     parser.add_argument('--timeline', dest='timeline', action='store_true',
                         help='Generate a json file with the timeline (a tensorboard directory'
                              'must be provided in config file)')
+    parser.add_argument('--profile_steps', type=int, default=None,
+                        help='Generate the timeline json files for this number of train steps only (a tensorboard '
+                             'directory must be provided in config file)')
     parser.set_defaults(XLA=False)
     parser.add_argument('--XLA', dest='XLA', action='store_true', help='Activate XLA mode in tensorflow')
+    parser.add_argument('--host', type=str, default="localhost", help='Host name the --server mode listens on')
+    parser.add_argument('--port', type=int, default=8000, help='Port the --server mode listens on')
+    parser.add_argument('--max_wait', type=float, default=0.05,
+                        help='Maximum time (in seconds) a --server request waits for other requests to fill its batch')
+    parser.add_argument('--request_timeout', type=float, default=60.0,
+                        help='Maximum time (in seconds) a --server request waits for its transcript (503 answer after)')
+    parser.add_argument('--shard', type=str, default=None,
+                        help='Only evaluate the shard i/N of the test set (i from 0 to N-1)')
+    parser.add_argument('--results', type=str, default=None,
+                        help='Path to the per utterance result file of --evaluate, a previous run is resumed if it '
+                             'exists (default to evaluation-i-of-N.jsonl with --shard)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Path to the result file for --files and --filelist (default to standard output)')
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.set_defaults(train_acoustic=False)
     group.set_defaults(train_language=False)
     group.set_defaults(file=None)
+    group.set_defaults(files=None)
+    group.set_defaults(filelist=None)
     group.set_defaults(record=False)
     group.set_defaults(evaluate=False)
+    group.set_defaults(merge_results=None)
+    group.set_defaults(extract_features=False)
+    group.set_defaults(server=False)
     group.add_argument('--train_acoustic', dest='train_acoustic', action='store_true',
                        help='Train the acoustic network')
     group.add_argument('--train_language', dest='train_language', action='store_true',
                        help='Train the language network')
     group.add_argument('--file', type=str, help='Path to a wav file to process')
+    group.add_argument('--files', type=str, nargs='+', help='Paths to multiple audio files to process by batchs')
+    group.add_argument('--filelist', type=str, help='Path to a text file listing the audio files to process by '
+                                                    'batchs (one path per line)')
     group.add_argument('--record', dest='record', action='store_true', help='Record and write result on the fly')
     group.add_argument('--evaluate', dest='evaluate', action='store_true', help='Evaluate WER against the test_set')
+    group.add_argument('--merge_results', type=str, nargs='+',
+                       help='Compute the WER and CER of the test set from the result files of an evaluation')
     group.add_argument('--generate_text', dest='generate_text', action='store_true', help='Generate text from the '
                                                                                           'language model')
+    group.add_argument('--extract_features', dest='extract_features', action='store_true',
+                       help='Extract the features of the training and test sets into the feature store')
+    group.add_argument('--server', dest='server', action='store_true',
+                       help='Run an HTTP transcription server keeping the model loaded')
 
     args = parser.parse_args()
     prog_params = {'config_file': args.config, 'tb_name': args.tb_name, 'max_epoch': args.max_epoch,
                    'learn_rate': args.learn_rate, 'timeline': args.timeline, 'train_acoustic': args.train_acoustic,
-                   'train_language': args.train_language, 'file': args.file, 'record': args.record,
-                   'evaluate': args.evaluate, 'generate_text': args.generate_text, 'XLA': args.XLA}
+                   'train_language': args.train_language, 'file': args.file, 'files': args.files,
+                   'filelist': args.filelist, 'output': args.output, 'record': args.record,
+                   'evaluate': args.evaluate, 'generate_text': args.generate_text, 'XLA': args.XLA,
+                   'extract_features': args.extract_features, 'server': args.server, 'host': args.host,
+                   'port': args.port, 'max_wait': args.max_wait, 'request_timeout': args.request_timeout,
+                   'profile_steps': args.profile_steps,
+                   'shard': args.shard, 'results': args.results, 'merge_results': args.merge_results}
     return prog_params
 
 
 if __name__ == "__main__":
+    # tensorflow and the models are only imported when stt.py is run : the feature extraction workers are spawned
+    # processes which import this module again (as __mp_main__) and only need the util modules
+    import tensorflow as tf
+    from models.AcousticModel import AcousticModel
+    from models.LanguageModel import LanguageModel
     main()
@@ -1,21 +1,326 @@
 # coding=utf-8
+import functools
+import inspect
+import logging
+import multiprocessing
+import os
+import re
+import threading
 import numpy as np
 import librosa
+import scipy.fft
 
 # GLOBALS
 FRAME_STRIDE = 0.01
 FRAME_SIZE = 0.025
+# Default maximum number of feature extraction processes (see get_worker_count), each one takes about 60 MB at start
+# up plus the signal and features of the files it processes
+MAX_DEFAULT_WORKERS = 4
+# Pre-emphasis filter coefficient of the fbank features
+PRE_EMPHASIS = 0.97
+# Number of points of the FFT and number of mel filters of the fbank features
+FBANK_NFFT = 512
+FBANK_NFILT = 40
+# Number of feature frames on each side used to compute a delta (librosa's default width of 9)
+DELTA_HALF_WIDTH = 4
+# Number of frames following a fbank frame needed to compute its deltas and double deltas
+FBANK_LOOKAHEAD_FRAMES = 2 * DELTA_HALF_WIDTH
+# Number of mfcc coefficients, mel bands used to compute them and dynamic range (in dB) of the mel spectrogram
+MFCC_COUNT = 20
+MFCC_MELS = 128
+MFCC_TOP_DB = 80.0
+
+# Sample rate of the audio when no rate is configured : librosa's default, used by the models trained before the
+# sample rate could be configured
+LEGACY_SAMPLE_RATE = 22050
+
+# Resampling algorithm : soxr is much faster than librosa's other algorithms, fall back on a fast one if missing
+try:
+    import soxr  # noqa: F401
+    _RESAMPLING_TYPE = "soxr_hq"
+except ImportError:
+    _RESAMPLING_TYPE = "kaiser_fast"
+
+# Work buffers of the fbank computation, kept per thread and reused from one utterance to the next
+_buffers = threading.local()
+# numpy >= 2.0 can write the result of the FFT into a preallocated array
+_RFFT_HAS_OUT = "out" in inspect.signature(np.fft.rfft).parameters
+
+
+def _get_buffer(name, rows, columns, dtype):
+    """
+    Get a work buffer of the current thread, grown when needed (its content is undefined)
+
+    :param name: the name of the buffer
+    :param rows: number of rows needed
+    :param columns: number of columns
+    :param dtype: data type of the buffer
+    :return: an array of shape [rows, columns]
+    """
+    buffer = getattr(_buffers, name, None)
+    if (buffer is None) or (buffer.shape[0] < rows) or (buffer.shape[1] != columns) or (buffer.dtype != dtype):
+        buffer = np.empty((rows, columns), dtype=dtype)
+        setattr(_buffers, name, buffer)
+    return buffer[:rows]
+
+
+def _get_frames(signal, num_frames, frame_length, frame_step):
+    """
+    Cut a signal into overlapping frames, as a read-only strided view on the signal (no copy is made)
+
+    :param signal: a 1-D signal long enough for the frames
+    :param num_frames: number of frames
+    :param frame_length: length of a frame (in samples)
+    :param frame_step: distance between the start of two frames (in samples)
+    :return: a view of shape [num_frames, frame_length]
+    """
+    return np.lib.stride_tricks.as_strided(signal, shape=(num_frames, frame_length),
+                                           strides=(frame_step * signal.strides[0], signal.strides[0]),
+                                           writeable=False)
+
+
+@functools.lru_cache(maxsize=16)
+def _get_mel_filterbank(sr, nfft, nfilt):
+    """
+    Build the triangular mel filters of the fbank features
+    The result is cached (and read-only) as it only depends on the parameters
+
+    :param sr: the sample rate
+    :param nfft: number of points of the FFT
+    :param nfilt: number of filters
+    :return: a filterbank matrix of shape [nfilt, nfft / 2 + 1]
+    """
+    low_freq_mel = 0
+
+    ### AI:
+    # the following line works correcty as-is in python3
+    # *** high_freq_mel = (2595 * np.log10(1 + (sr / 2) / 700)) ***
+    # however, in python it results in a smaller value of 'high_freq_mel'
+    # as the 'sr' variable is interpreted as integer
+    # it has minor impact on the performance of the natively trained and tested models
+    # however, if one uses python to test the models that were created in python3
+    # the models show the CER drop as much as 1% absolute
+    # the line below fixes that issue completely
+    high_freq_mel = (2595 * np.log10(1 + (float(sr) / 2) / 700))
+
+    mel_points = np.linspace(low_freq_mel, high_freq_mel, nfilt + 2)
+    hz_points = (700 * (10**(mel_points / 2595) - 1))
+    bin = np.floor((nfft + 1) * hz_points / sr)
+
+    # Each filter m rises from its left bin to its center bin then falls to its right bin
+    k = np.arange(int(np.floor(nfft / 2 + 1)))[None, :]
+    f_m_minus = bin[:-2, None]   # left
+    f_m = bin[1:-1, None]        # center
+    f_m_plus = bin[2:, None]     # right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rising = (k - f_m_minus) / (f_m - f_m_minus)
+        falling = (f_m_plus - k) / (f_m_plus - f_m)
+    fbank = np.where((k >= f_m_minus) & (k < f_m), rising, np.where((k >= f_m) & (k < f_m_plus), falling, 0.0))
+    fbank.setflags(write=False)
+    return fbank
+
+
+@functools.lru_cache(maxsize=16)
+def _get_hamming_window(frame_length):
+    """
+    Build the hamming window applied to the frames (cached and read-only)
+
+    :param frame_length: the frame length (in samples)
+    :return: the window of shape [frame_length]
+    """
+    window = np.hamming(frame_length)
+    window.setflags(write=False)
+    return window
+
+
+def _get_log_mel_energies(frames, sr):
+    """
+    Compute the log mel filterbank energies of signal frames
+
+    :param frames: pre-emphasized signal frames of shape [number of frames, frame length]
+    :param sr: the sample rate
+    :return: the log mel energies of shape [number of frames, FBANK_NFILT]
+    """
+    num_frames, frame_length = frames.shape
+    # Apply the hamming window function, writing into a buffer of the FFT size
+    # Note : the FFT is computed on the first FBANK_NFFT samples of a frame, or on the frame padded with zeros
+    length = min(frame_length, FBANK_NFFT)
+    windowed_frames = _get_buffer("windowed_frames", num_frames, FBANK_NFFT, np.float64)
+    np.multiply(frames[:, :length], _get_hamming_window(frame_length)[:length], out=windowed_frames[:, :length])
+    windowed_frames[:, length:] = 0
+
+    spectrum_size = FBANK_NFFT // 2 + 1
+    if _RFFT_HAS_OUT:
+        spectrum = np.fft.rfft(windowed_frames, axis=1,
+                               out=_get_buffer("spectrum", num_frames, spectrum_size, np.complex128))
+    else:
+        spectrum = np.fft.rfft(windowed_frames, axis=1)
+    pow_frames = _get_buffer("pow_frames", num_frames, spectrum_size, np.float64)
+    np.absolute(spectrum, out=pow_frames)
+    np.square(pow_frames, out=pow_frames)
+    pow_frames *= (1.0 / FBANK_NFFT)
+    filter_banks = np.dot(pow_frames, _get_mel_filterbank(sr, FBANK_NFFT, FBANK_NFILT).T)
+    filter_banks[filter_banks == 0] = np.finfo(float).eps
+
+    # AI:
+    # *** filter_banks = 20 * np.log10(filter_banks) ***
+    # 'pow_frames' contains the power spectrum (i.e. squared magnitude)
+    # the proper formula to convert to the logarithm scale in decibels is
+    # 10*log10(POW), while 20*log10(MAG) is used for the un-squared magnitude
+    # this way both formuli result in the same outcome
+    np.log10(filter_banks, out=filter_banks)
+    filter_banks *= 10
+    return filter_banks
+
+
+def _get_deltas(values, centers, first_index):
+    """
+    Compute the deltas of a sequence of frames, as librosa.feature.delta does with its default width of 9
+    A delta is the slope of the least square line fit on the 9 frames around its center frame
+    (librosa's edge frames use the slope of the first or last 9 frames, hence the given centers)
+
+    :param values: frames of shape [number of frames, size]
+    :param centers: absolute indexes of the frames on which each delta is centered
+    :param first_index: absolute index of the first frame in values
+    :return: the deltas of shape [len(centers), size]
+    """
+    offsets = np.arange(-DELTA_HALF_WIDTH, DELTA_HALF_WIDTH + 1)
+    windows = values[np.asarray(centers)[:, None] + offsets[None, :] - first_index]
+    return np.tensordot(windows, offsets / float(np.sum(offsets ** 2)), axes=([1], [0]))
+
+
+# A segment of an audio file is referenced as "path#start-end" (start and end in seconds)
+_SEGMENT_REFERENCE_REGEX = re.compile(r"^(.+)#(\d+(?:\.\d*)?)-(\d+(?:\.\d*)?)$")
+
+
+def get_segment_reference(file_name, start, end):
+    """
+    Build the reference to a segment of an audio file, it can be used as a file name by load_audio
+
+    :param file_name: the audio file path
+    :param start: start of the segment (in seconds)
+    :param end: end of the segment (in seconds)
+    :return string: the segment reference
+    """
+    return "{0}#{1}-{2}".format(file_name, start, end)
+
+
+def parse_segment_reference(file_name):
+    """
+    Split a segment reference into its parts
+
+    :param file_name: an audio file path or a segment reference
+    :return: a tuple (audio file path, offset in seconds, duration in seconds or None for a whole file)
+    """
+    match = _SEGMENT_REFERENCE_REGEX.match(file_name)
+    if match is None:
+        return file_name, 0.0, None
+    start, end = float(match.group(2)), float(match.group(3))
+    return match.group(1), start, end - start
+
+
+@functools.lru_cache(maxsize=1024)
+def read_sphere_header(file_name):
+    """
+    Parse the header of a NIST SPHERE (.sph) file, the result is cached so that each file is parsed once
+
+    :param file_name: a .sph file path
+    :return: a dictionary of the header fields (values converted to int or float according to their type)
+    """
+    with open(file_name, 'rb') as f:
+        if f.readline().strip() != b"NIST_1A":
+            raise ValueError("{0} is not a NIST SPHERE file".format(file_name))
+        header_size = int(f.readline().strip())
+        lines = f.read(header_size - f.tell()).decode("ascii", errors="replace").split("\n")
+    header = {"header_size": header_size}
+    for line in lines:
+        fields = line.strip().split(None, 2)
+        if (len(fields) == 0) or (fields[0] == "end_head"):
+            break
+        if len(fields) < 3:
+            continue
+        key, field_type, value = fields
+        if field_type == "-i":
+            header[key] = int(value)
+        elif field_type == "-r":
+            header[key] = float(value)
+        else:
+            header[key] = value
+    return header
+
+
+def load_sphere(file_name, offset=0.0, duration=None):
+    """
+    Read a segment of an uncompressed (16 bits PCM) NIST SPHERE file, only the segment's bytes are read
+
+    :param file_name: a .sph file path
+    :param offset: start reading after this time (in seconds)
+    :param duration: only read this much audio (in seconds), read up to the end of the file if None
+    :returns sig: the float mono signal
+    :returns sr: the native sample rate of the file
+    """
+    header = read_sphere_header(file_name)
+    if (header.get("sample_coding", "pcm") != "pcm") or (header.get("sample_n_bytes", 2) != 2):
+        raise ValueError("Only 16 bits PCM SPHERE files are supported : {0} is {1} on {2} bytes".format(
+            file_name, header.get("sample_coding"), header.get("sample_n_bytes")))
+    sr = header["sample_rate"]
+    channels = header.get("channel_count", 1)
+    dtype = np.dtype(">i2" if header.get("sample_byte_format", "01") == "10" else "<i2")
+
+    start = int(round(offset * sr))
+    count = -1 if duration is None else int(round(duration * sr))
+    if "sample_count" in header:
+        available = max(0, header["sample_count"] - start)
+        count = available if count < 0 else min(count, available)
+    with open(file_name, 'rb') as f:
+        f.seek(header["header_size"] + start * channels * dtype.itemsize)
+        data = np.fromfile(f, dtype=dtype, count=-1 if count < 0 else count * channels)
+    sig = data.reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+    return sig, sr
+
+
+def load_audio(file_name, sample_rate=None, offset=0.0, duration=None):
+    """
+    Load an audio file (or a segment reference, see get_segment_reference) as a mono signal
+
+    Parameters
+    ----------
+    :param file_name: an audio file path or a segment reference
+    :param sample_rate: the rate to resample the signal to (None to keep the native rate of the file)
+    :param offset: start reading after this time (in seconds, relative to the segment start for a reference)
+    :param duration: only read this much audio (in seconds), read up to the end of the file or segment if None
+    :returns sig: the float signal
+    :returns sr: the sample rate of the signal
+    """
+    file_name, segment_offset, segment_duration = parse_segment_reference(file_name)
+    if segment_duration is not None:
+        segment_duration = max(0.0, segment_duration - offset)
+        duration = segment_duration if duration is None else min(duration, segment_duration)
+    offset += segment_offset
+
+    if file_name.endswith(".sph"):
+        sig, sr = load_sphere(file_name, offset, duration)
+        if (sample_rate is not None) and (sample_rate != sr):
+            sig = librosa.resample(sig, orig_sr=sr, target_sr=sample_rate, res_type=_RESAMPLING_TYPE)
+            sr = sample_rate
+        return sig, sr
+    # librosa seeks to the offset (for the formats read through soundfile) instead of decoding the whole file
+    return librosa.load(file_name, sr=sample_rate, mono=True, offset=offset, duration=duration,
+                        res_type=_RESAMPLING_TYPE)
 
 
 class AudioProcessor(object):
-    def __init__(self, max_input_seq_length, feature_type="mfcc"):
+    def __init__(self, max_input_seq_length, feature_type="mfcc", sample_rate=None):
         """
+        max_input_seq_length - features are truncated to this length (no truncation if None)
         feature_type - string options are: mfcc, fbank
         mfcc is a 20-dim input 
         fbank is 120-dim input (mel filterbank with delta and double delta)
+        sample_rate - audio files are resampled to this rate (None to process them at their native rate)
         """
         self.max_input_seq_length = max_input_seq_length
         self.feature_type = feature_type
+        self.sample_rate = sample_rate
         if self.feature_type == "mfcc":
             self._extract_function = self._extract_mfcc
             self.feature_size = 20
@@ -38,15 +343,17 @@ class AudioProcessor(object):
         length = int(duration // FRAME_STRIDE) - 1
         return length
 
-    def process_audio_file(self, file_name):
+    def process_audio_file(self, file_name, offset=0.0, duration=None):
         """
         Reads in audio file, processes it
 
         :param file_name: an audio file path
+        :param offset: start reading after this time (in seconds)
+        :param duration: only process this much audio (in seconds), up to the end of the file if None
         :returns: mfcc: padded feature tensor
         :returns: mfcc_length: original length of the mfcc before padding
         """
-        sig, sr = librosa.load(file_name, mono=True)
+        sig, sr = load_audio(file_name, self.sample_rate, offset, duration)
         return self._extract_function(sig, sr)
 
     def process_signal(self, sig, sr):
@@ -62,14 +369,14 @@ class AudioProcessor(object):
 
     def _extract_mfcc(self, sig, sr):
         # mfcc
-        mfcc = librosa.feature.mfcc(sig, sr, hop_length=int(round(sr * FRAME_STRIDE)),
+        mfcc = librosa.feature.mfcc(y=sig, sr=sr, hop_length=int(round(sr * FRAME_STRIDE)),
                                     n_fft=int(round(sr * FRAME_SIZE)))
         # mfcc is of shape (20 mfcc, time_serie)
         transposed_mfcc = mfcc.transpose()
         mfcc_length = len(transposed_mfcc)
 
         # Truncate if audio sequence is too long
-        if mfcc_length > self.max_input_seq_length:
+        if (self.max_input_seq_length is not None) and (mfcc_length > self.max_input_seq_length):
             transposed_mfcc = transposed_mfcc[:self.max_input_seq_length]
 
         return transposed_mfcc, mfcc_length
@@ -84,64 +391,22 @@ class AudioProcessor(object):
         TODO energy is not yet obtained.
         """
 
-        emphasized_signal = np.append(sig[0], sig[1:] - 0.97 * sig[:-1])
         frame_length, frame_step = FRAME_SIZE * sr, FRAME_STRIDE * sr
-        signal_length = len(emphasized_signal)
+        signal_length = len(sig)
         frame_length = int(round(frame_length))
         frame_step = int(round(frame_step))
         num_frames = int(np.ceil(float(np.abs(signal_length - frame_length)) / frame_step))
 
+        # Write the pre-emphasized signal directly into the zero padded signal
         pad_signal_length = num_frames * frame_step + frame_length
-        z = np.zeros((pad_signal_length - signal_length))
-        pad_signal = np.append(emphasized_signal, z)
-
-        indices = np.tile(np.arange(0, frame_length),
-                          (num_frames, 1)) + np.tile(np.arange(0, num_frames * frame_step, frame_step),
-                                                     (frame_length, 1)).T
-        frames = pad_signal[indices.astype(np.int32, copy=False)]
-        # Apply the hamming window function
-        frames *= np.hamming(frame_length)
-        nfft, nfilt = 512, 40
-        mag_frames = np.absolute(np.fft.rfft(frames, nfft))
-        pow_frames = ((1.0 / nfft) * (mag_frames ** 2))
-        low_freq_mel = 0
-        
-        ### AI:
-        # the following line works correcty as-is in python3
-        # *** high_freq_mel = (2595 * np.log10(1 + (sr / 2) / 700)) ***
-        # however, in python it results in a smaller value of 'high_freq_mel'
-        # as the 'sr' variable is interpreted as integer
-        # it has minor impact on the performance of the natively trained and tested models
-        # however, if one uses python to test the models that were created in python3
-        # the models show the CER drop as much as 1% absolute
-        # the line below fixes that issue completely
-        high_freq_mel = (2595 * np.log10(1 + (float(sr) / 2) / 700))
-        
-        mel_points = np.linspace(low_freq_mel, high_freq_mel, nfilt + 2)
-        hz_points = (700 * (10**(mel_points / 2595) - 1))
-        bin = np.floor((nfft + 1) * hz_points / sr)
-
-        fbank = np.zeros((nfilt, int(np.floor(nfft / 2 + 1))))
-        for m in range(1, nfilt + 1):
-            f_m_minus = int(bin[m - 1])   # left
-            f_m = int(bin[m])             # center
-            f_m_plus = int(bin[m + 1])    # right
-
-            for k in range(f_m_minus, f_m):
-                fbank[m - 1, k] = (k - bin[m - 1]) / (bin[m] - bin[m - 1])
-            for k in range(f_m, f_m_plus):
-                fbank[m - 1, k] = (bin[m + 1] - k) / (bin[m + 1] - bin[m])
-        filter_banks = np.dot(pow_frames, fbank.T)
-        filter_banks = np.where(filter_banks == 0, np.finfo(float).eps, filter_banks)
-        
-        # AI:
-        # *** filter_banks = 20 * np.log10(filter_banks) ***
-        # 'pow_frames' contains the power spectrum (i.e. squared magnitude)
-        # the proper formula to convert to the logarithm scale in decibels is
-        # 10*log10(POW), while 20*log10(MAG) is used for the un-squared magnitude
-        # this way both formuli result in the same outcome
-        filter_banks = 10 * np.log10(filter_banks)
-        
+        pad_signal = np.zeros(pad_signal_length)
+        pad_signal[0] = sig[0]
+        pad_signal[1:signal_length] = sig[1:] - PRE_EMPHASIS * sig[:-1]
+
+        # The frames are a strided view on the padded signal, they are not copied
+        frames = _get_frames(pad_signal, num_frames, frame_length, frame_step)
+        filter_banks = _get_log_mel_energies(frames, sr)
+
         # Apply mean normalization
         filter_banks -= (np.mean(filter_banks, axis=0) + 1e-8)
         filter_banks = filter_banks.transpose()
@@ -155,7 +420,201 @@ class AudioProcessor(object):
 
         # Truncate if audio sequence is too long
         fbank_length = len(fbank_feat)
-        if fbank_length > self.max_input_seq_length:
+        if (self.max_input_seq_length is not None) and (fbank_length > self.max_input_seq_length):
             fbank_feat = fbank_feat[:self.max_input_seq_length]
 
         return fbank_feat, fbank_length
+
+
+def extract_file_features(file, max_input_seq_length, signal_processing, sample_rate=None):
+    """
+    Process an audio file in a feature extraction worker (see create_worker_pool)
+    Defined at module level, away from tensorflow, so that it can be sent to the spawned worker processes
+
+    Parameters
+    ----------
+    :param file: the audio file path
+    :param max_input_seq_length: features are truncated to this length (no truncation if None)
+    :param signal_processing: the signal processing mode (mfcc or fbank)
+    :param sample_rate: the rate the audio file is resampled to (None for its native rate)
+    :return: a tuple (file, feature vector, original feature vector length) or (file, None, 0) if the file could not
+             be processed
+    """
+    audio_processor = AudioProcessor(max_input_seq_length, signal_processing, sample_rate)
+    try:
+        feat_vec, feat_vec_length = audio_processor.process_audio_file(file)
+    except Exception as e:
+        logging.warning("Unable to process %s : %s", file, e)
+        return file, None, 0
+    return file, feat_vec, feat_vec_length
+
+
+def get_worker_count(workers=None):
+    """
+    Number of feature extraction processes to start
+
+    :param workers: the configured number of processes (one per CPU, at most MAX_DEFAULT_WORKERS, if None)
+    :return: the number of processes
+    """
+    return workers or min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+
+
+def create_worker_pool(processes=None):
+    """
+    Create a pool of feature extraction processes
+    The processes are spawned rather than forked so that they are safe to start from a process running tensorflow
+    threads
+
+    :param processes: number of processes (see get_worker_count for the default)
+    :return: a multiprocessing Pool
+    """
+    return multiprocessing.get_context("spawn").Pool(get_worker_count(processes))
+
+
+class StreamingAudioProcessor(object):
+    def __init__(self, sample_rate, feature_type="mfcc"):
+        """
+        Stateful feature extractor for a signal received by chunks (a live recording for example)
+
+        Each chunk only costs the processing of the new feature frames it completes : the end of the signal not
+        yet framed and the frames needed for the next deltas are kept between chunks. Once the same frames have been
+        seen, the features match those of AudioProcessor on the whole signal, except for the global parts of the
+        computation which use the running values over the frames seen so far :
+          * fbank : the mean normalization uses the running mean
+          * mfcc : the dynamic range clipping uses the running maximum
+        A fbank frame is produced once the FBANK_LOOKAHEAD_FRAMES frames following it are known (for its deltas)
+
+        Parameters
+        ----------
+        :param sample_rate: the sample rate of the signal
+        :param feature_type: string options are: mfcc, fbank
+        """
+        self.sample_rate = sample_rate
+        self.feature_type = feature_type
+        if self.feature_type == "mfcc":
+            self.feature_size = MFCC_COUNT
+            self.frame_length = int(round(sample_rate * FRAME_SIZE))
+            self.frame_step = int(round(sample_rate * FRAME_STRIDE))
+            self._window = librosa.filters.get_window("hann", self.frame_length, fftbins=True)
+            self._mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=self.frame_length, n_mels=MFCC_MELS)
+        elif self.feature_type == "fbank":
+            self.feature_size = 3 * FBANK_NFILT
+            self.frame_length = int(round(FRAME_SIZE * sample_rate))
+            self.frame_step = int(round(FRAME_STRIDE * sample_rate))
+        else:
+            raise ValueError("{0} is not a valid extraction function, \
+            only fbank and mfcc are accepted.".format(self.feature_type))
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the signal received so far in order to start a new stream
+        """
+        self._last_sample = None
+        self._finished = False
+        if self.feature_type == "mfcc":
+            # The frames are centered, the signal is padded with zeros as librosa does
+            self._signal = np.zeros(self.frame_length // 2)
+            self._max_db = -np.inf
+        else:
+            self._signal = np.zeros(0)
+            self._log_mel = np.zeros((0, FBANK_NFILT))
+            self._log_mel_first = self._log_mel_count = 0
+            self._log_mel_sum = np.zeros(FBANK_NFILT)
+            self._deltas = np.zeros((0, FBANK_NFILT))
+            self._deltas_first = self._deltas_count = 0
+            self._output_count = 0
+
+    def process_chunk(self, chunk):
+        """
+        Add a chunk of signal to the stream
+
+        :param chunk: a float audio signal chunk
+        :return: the new feature frames, of shape [number of new frames, feature_size]
+        """
+        if self._finished:
+            raise ValueError("The stream is finished, reset it before processing a new signal")
+        chunk = np.asarray(chunk)
+        if len(chunk) == 0:
+            return np.zeros((0, self.feature_size))
+        if self.feature_type == "mfcc":
+            self._signal = np.append(self._signal, chunk)
+            return self._process_mfcc()
+        # Pre-emphasis, the first sample of the stream is kept as is
+        previous = np.append(chunk[0] if self._last_sample is None else self._last_sample, chunk[:-1])
+        emphasized_chunk = chunk - PRE_EMPHASIS * previous
+        if self._last_sample is None:
+            emphasized_chunk[0] = chunk[0]
+        self._last_sample = chunk[-1]
+        self._signal = np.append(self._signal, emphasized_chunk)
+        return self._process_fbank(False)
+
+    def flush(self):
+        """
+        End the stream and produce its last feature frames
+
+        :return: the last feature frames, of shape [number of frames, feature_size]
+        """
+        self._finished = True
+        if self.feature_type == "mfcc":
+            self._signal = np.append(self._signal, np.zeros(self.frame_length // 2))
+            return self._process_mfcc()
+        return self._process_fbank(True)
+
+    def _get_frames(self, num_frames):
+        # Cut the complete frames from the signal buffer and only keep what the next frames need
+        frames = _get_frames(self._signal, num_frames, self.frame_length, self.frame_step)
+        self._signal = self._signal[num_frames * self.frame_step:]
+        return frames
+
+    def _process_mfcc(self):
+        if len(self._signal) < self.frame_length:
+            return np.zeros((0, self.feature_size))
+        frames = self._get_frames((len(self._signal) - self.frame_length) // self.frame_step + 1)
+        power_spectrum = np.absolute(np.fft.rfft(frames * self._window, self.frame_length)) ** 2
+        mel_db = 10 * np.log10(np.maximum(1e-10, np.dot(power_spectrum, self._mel_basis.T)))
+        self._max_db = max(self._max_db, np.max(mel_db))
+        mel_db = np.maximum(mel_db, self._max_db - MFCC_TOP_DB)
+        return scipy.fft.dct(mel_db, axis=1, type=2, norm='ortho')[:, :MFCC_COUNT]
+
+    def _process_fbank(self, final):
+        # The batch extractor ignores a last frame ending exactly on the last sample, so a frame is only complete
+        # when at least one sample follows it
+        num_frames = max(0, (len(self._signal) - self.frame_length - 1) // self.frame_step + 1)
+        if num_frames > 0:
+            log_mel = _get_log_mel_energies(self._get_frames(num_frames), self.sample_rate)
+            self._log_mel = np.vstack([self._log_mel, log_mel])
+            self._log_mel_count += num_frames
+            self._log_mel_sum += np.sum(log_mel, axis=0)
+
+        # Deltas of the log mel energies, then deltas of the deltas : the deltas of the last frames of the stream
+        # can only be computed once the stream is finished
+        window_size = 2 * DELTA_HALF_WIDTH + 1
+        count = self._log_mel_count
+        if count >= window_size:
+            end = count if final else count - DELTA_HALF_WIDTH
+            centers = np.clip(np.arange(self._deltas_count, end), DELTA_HALF_WIDTH, count - DELTA_HALF_WIDTH - 1)
+            self._deltas = np.vstack([self._deltas, _get_deltas(self._log_mel, centers, self._log_mel_first)])
+            self._deltas_count = max(self._deltas_count, end)
+
+        features = np.zeros((0, self.feature_size))
+        count = self._deltas_count
+        if count >= window_size:
+            end = count if final else count - DELTA_HALF_WIDTH
+            indexes = np.arange(self._output_count, end)
+            centers = np.clip(indexes, DELTA_HALF_WIDTH, count - DELTA_HALF_WIDTH - 1)
+            double_deltas = _get_deltas(self._deltas, centers, self._deltas_first)
+            # Apply mean normalization with the running mean
+            filter_banks = self._log_mel[indexes - self._log_mel_first] -\
+                (self._log_mel_sum / self._log_mel_count + 1e-8)
+            features = np.hstack([filter_banks, self._deltas[indexes - self._deltas_first], double_deltas])
+            self._output_count = max(self._output_count, end)
+
+        # Drop the frames which are not needed anymore
+        keep_from = min(self._output_count, max(0, self._deltas_count - window_size))
+        self._log_mel = self._log_mel[keep_from - self._log_mel_first:]
+        self._log_mel_first = keep_from
+        keep_from = max(0, self._output_count - window_size)
+        self._deltas = self._deltas[keep_from - self._deltas_first:]
+        self._deltas_first = keep_from
+        return features
@@ -0,0 +1,227 @@
+# coding=utf-8
+"""
+Multi-process production of the training batches.
+
+The features of the audio files are extracted by worker processes instead of python threads which would be serialized
+by the GIL. Each worker builds whole batches : it extracts the features and transcodes the labels of a batch's items
+and writes the padded features into a free slot of shared memory. The trainer's side reads the slot, gives it back to
+the workers and passes the batch on to the model.
+
+The number of slots bounds the memory used and provides back-pressure : the workers wait for a free slot when the
+trainer is behind. A slot holds a whole padded batch (batch_size x max_input_seq_length x feature_size float32, about
+17 MB with the default config.ini) so their number is kept small. The time the trainer waits for a batch is measured, a
+high wait time means that more workers are needed. Each worker is a process importing the util modules only (about
+60 MB at start up), not tensorflow.
+
+The batches are yielded in the order of the dataset (so that an ordering by size is kept) : at most one batch per slot
+is given to the workers ahead of the next batch to yield, so that the batches completed out of order can not take all
+the slots. The workers are started with the spawn method, the trainer being a multithreaded tensorflow process which is
+not safe to fork.
+"""
+import logging
+import multiprocessing
+import queue
+import time
+import numpy as np
+import util.audioprocessor as audioprocessor
+import util.dataprocessor as dataprocessor
+
+
+def _get_bucket_id(length, bucket_boundaries):
+    return sum([1 for boundary in bucket_boundaries if length >= boundary])
+
+
+def _run_worker(task_queue, free_slots, ready_queue, slots, slot_shape, max_input_seq_length, signal_processing,
+                sample_rate, char_map):
+    audio_processor = audioprocessor.AudioProcessor(max_input_seq_length, signal_processing, sample_rate)
+    buffers = [np.frombuffer(slot, dtype=np.float32).reshape(slot_shape) for slot in slots]
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        index, items = task
+        feat_vecs = []
+        labels = []
+        for audio_file, label in items:
+            try:
+                feat_vec, _ = audio_processor.process_audio_file(audio_file)
+            except Exception as e:
+                logging.warning("Unable to extract the features of %s, skipping it : %s", audio_file, e)
+                continue
+            feat_vecs.append(feat_vec)
+            labels.append(dataprocessor.DataProcessor.get_str_labels(char_map, label))
+        if len(feat_vecs) == 0:
+            ready_queue.put((index, None, None, None))
+            continue
+
+        lengths = np.array([len(feat_vec) for feat_vec in feat_vecs], dtype=np.int32)
+        # Pad the labels with zeros as padded_batch would do
+        label_batch = np.zeros((len(labels), max([len(label) for label in labels])), dtype=np.int32)
+        for i, label in enumerate(labels):
+            label_batch[i, :len(label)] = label
+
+        # Wait for a free slot, this is where the workers are held back when the trainer is behind
+        slot = free_slots.get()
+        batch = buffers[slot][:len(feat_vecs), :np.max(lengths)]
+        batch.fill(0)
+        for i, feat_vec in enumerate(feat_vecs):
+            batch[i, :lengths[i]] = feat_vec
+        ready_queue.put((index, slot, lengths, label_batch))
+
+
+# Default maximum number of slots of shared memory
+MAX_SLOTS = 8
+# Interval (in seconds) at which the workers are checked while waiting for a batch
+WORKER_CHECK_INTERVAL = 5.0
+
+
+class BatchProducer(object):
+    def __init__(self, input_set, batch_size, max_input_seq_length, signal_processing, char_map, num_workers=None,
+                 sample_rate=None, bucket_boundaries=None, num_slots=None):
+        """
+        Produce the batches of (features, features lengths, labels) of a dataset with a pool of worker processes
+
+        Parameters
+        ----------
+        :param input_set: a list of [audio_file, label, audio_length]
+        :param batch_size: number of items in a batch
+        :param max_input_seq_length: maximum length of an input vector sequence (longer ones are truncated)
+        :param signal_processing: the signal processing mode (mfcc or fbank)
+        :param char_map: the char_map against which to transcode the labels
+        :param num_workers: number of worker processes (one per CPU, at most 4, if None)
+        :param sample_rate: the rate the audio files are resampled to (None for their native rate)
+        :param bucket_boundaries: a list of increasing input lengths (optional), if given the inputs are grouped in
+                                  batchs of similar length, bucket i containing inputs of length in
+                                  [bucket_boundaries[i-1], bucket_boundaries[i])
+        :param num_slots: number of batches held in shared memory (twice the number of workers if None, at most
+                          MAX_SLOTS), each slot takes batch_size * max_input_seq_length * feature_size * 4 bytes
+        """
+        self.input_set = input_set
+        self.batch_size = batch_size
+        self.max_input_seq_length = max_input_seq_length
+        self.signal_processing = signal_processing
+        self.char_map = char_map
+        self.num_workers = audioprocessor.get_worker_count(num_workers)
+        self.sample_rate = sample_rate
+        self.bucket_boundaries = bucket_boundaries
+        self.num_slots = num_slots or min(2 * self.num_workers, MAX_SLOTS)
+        self.feature_size = audioprocessor.AudioProcessor(max_input_seq_length, signal_processing).feature_size
+        self._context = multiprocessing.get_context("spawn")
+        # The shared memory slots are allocated on the first run and reused by the next ones
+        self._slot_shape = (self.batch_size, self.max_input_seq_length, self.feature_size)
+        self._slots = None
+
+        # Metrics of the last run through the dataset
+        self.batch_count = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    def get_batches(self):
+        """
+        Group the items of the dataset into batches, in the dataset order or by bucket of similar estimated length
+        (the same way tf.contrib.data.group_by_window would do)
+
+        :return: a list of batches, each batch being a list of [audio_file, label]
+        """
+        if not self.bucket_boundaries:
+            return [[[item[0], item[1]] for item in self.input_set[i:i + self.batch_size]]
+                    for i in range(0, len(self.input_set), self.batch_size)]
+        batches = []
+        buckets = {}
+        for item in self.input_set:
+            length = audioprocessor.AudioProcessor.get_mfcc_length_from_duration(item[2])
+            bucket = buckets.setdefault(_get_bucket_id(length, self.bucket_boundaries), [])
+            bucket.append([item[0], item[1]])
+            if len(bucket) == self.batch_size:
+                batches.append(list(bucket))
+                bucket.clear()
+        batches += [bucket for _, bucket in sorted(buckets.items()) if len(bucket) > 0]
+        return batches
+
+    def _get_batch(self, ready_queue, workers):
+        """
+        Wait for a batch from the workers, checking that they are still alive
+
+        :return: a tuple (batch index, slot, lengths, label batch), slot being None if no item of the batch was read
+        """
+        while True:
+            try:
+                return ready_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                for worker in workers:
+                    if (worker.exitcode is not None) and (worker.exitcode != 0):
+                        raise RuntimeError("A batch producer worker exited with code {0}".format(worker.exitcode))
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("The batch producer workers exited before producing all the batches")
+
+    def __call__(self):
+        """
+        Run once through the dataset, the worker processes only live during the run
+
+        :return: a generator of (features, features lengths, labels) batches
+        """
+        batches = self.get_batches()
+        if self._slots is None:
+            self._slots = [self._context.RawArray('f', int(np.prod(self._slot_shape))) for _ in range(self.num_slots)]
+        buffers = [np.frombuffer(slot, dtype=np.float32).reshape(self._slot_shape) for slot in self._slots]
+        task_queue = self._context.Queue()
+        free_slots = self._context.Queue()
+        ready_queue = self._context.Queue()
+        for slot in range(self.num_slots):
+            free_slots.put(slot)
+        worker_count = min(self.num_workers, len(batches))
+
+        def _dispatch(index):
+            # Give a batch to the workers, followed by the end signals after the last one
+            if index < len(batches):
+                task_queue.put((index, batches[index]))
+                if index == len(batches) - 1:
+                    for _ in range(worker_count):
+                        task_queue.put(None)
+
+        for index in range(self.num_slots):
+            _dispatch(index)
+        workers = []
+        for _ in range(worker_count):
+            worker = self._context.Process(target=_run_worker,
+                                           args=(task_queue, free_slots, ready_queue, self._slots, self._slot_shape,
+                                                 self.max_input_seq_length, self.signal_processing,
+                                                 self.sample_rate, self.char_map))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        self.batch_count = 0
+        self.wait_time = 0.0
+        start_time = time.time()
+        completed = False
+        # Batches completed ahead of the next one to yield, by index
+        pending = {}
+        try:
+            for index in range(len(batches)):
+                wait_start_time = time.time()
+                while index not in pending:
+                    result = self._get_batch(ready_queue, workers)
+                    pending[result[0]] = result[1:]
+                self.wait_time += time.time() - wait_start_time
+                slot, lengths, label_batch = pending.pop(index)
+                _dispatch(index + self.num_slots)
+                if slot is None:
+                    # No item of the batch could be read
+                    continue
+                feat_vecs = buffers[slot][:len(lengths), :np.max(lengths)].copy()
+                free_slots.put(slot)
+                self.batch_count += 1
+                yield feat_vecs, lengths, label_batch
+            completed = True
+        finally:
+            for worker in workers:
+                if completed:
+                    worker.join()
+                else:
+                    # The run was interrupted, the workers may be waiting for a free slot
+                    worker.terminate()
+            self.run_time = time.time() - start_time
+            logging.info("Batch producer : %d batches in %.1f s, waited %.1f s (%.0f %%) for the %d workers",
+                         self.batch_count, self.run_time, self.wait_time,
+                         100 * self.wait_time / max(self.run_time, 1e-9), len(workers))
@@ -0,0 +1,171 @@
+# coding=utf-8
+"""
+CTC decoding of the acoustic model logits with numpy, outside of the tensorflow graph.
+
+The logits are time major (shape [time, batch, labels]) as returned by the acoustic model and the blank is the last
+label, as for tf.nn.ctc_beam_search_decoder. Two decoders are available :
+  - greedy_decode : the best label of each frame, repeated labels merged and blanks removed (the fastest)
+  - beam_search_decode : a prefix beam search, keeping for each prefix the probability of its alignments ending with a
+    blank and of those ending with its last label so that the alignments of a same labeling are summed
+
+The beam search is vectorized over the beam : the prefixes are nodes of a trie, at each frame the probabilities of all
+the extensions of all the prefixes are computed at once, the extensions already in the beam are merged into it and the
+best candidates are selected with a partial sort. Labels whose probability in a frame is below the prune threshold are
+not tried as extensions in that frame, which saves work on the peaky outputs of a trained model.
+"""
+import numpy as np
+
+
+def log_softmax(logits):
+    """
+    Normalize logits into log probabilities over their last axis
+    """
+    logits = np.asarray(logits, dtype=np.float64)
+    shifted = logits - np.max(logits, axis=-1, keepdims=True)
+    return shifted - np.log(np.sum(np.exp(shifted), axis=-1, keepdims=True))
+
+
+def greedy_decode(logits, seq_lengths, blank_label=None):
+    """
+    Decode a batch with the best label of each frame
+
+    Parameters
+    ----------
+    :param logits: an array of shape [time, batch, labels]
+    :param seq_lengths: the number of valid frames of each item of the batch
+    :param blank_label: the blank label (the last label if None)
+    :return: a list of labels list, one per item of the batch
+    """
+    logits = np.asarray(logits)
+    if blank_label is None:
+        blank_label = logits.shape[2] - 1
+    best = np.argmax(logits, axis=2)
+    # Keep the first frame of each run of a same label, except for the blank runs and the padding frames
+    keep = best != blank_label
+    keep[1:] &= best[1:] != best[:-1]
+    keep &= np.arange(logits.shape[0])[:, None] < np.asarray(seq_lengths)[None, :]
+    return [best[keep[:, index], index].tolist() for index in range(logits.shape[1])]
+
+
+def _prefix_beam_search(log_probs, blank_label, beam_width, log_prune_threshold):
+    """
+    Prefix beam search on the log probabilities of a single input, of shape [time, labels]
+    The prefixes are the nodes of a trie (node 0 being the empty prefix) so that the beam is an array of node ids
+    """
+    num_labels = log_probs.shape[1]
+    max_nodes = 1 + len(log_probs) * beam_width
+    node_parents = np.full(max_nodes, -1, dtype=np.int64)
+    node_labels = np.full(max_nodes, -1, dtype=np.int64)
+    node_count = 1
+    children = {}
+    # Position of the nodes in the current beam and of the labels in the current candidate labels (-1 if absent)
+    node_positions = np.full(max_nodes, -1, dtype=np.int64)
+    label_positions = np.full(num_labels, -1, dtype=np.int64)
+    candidate_labels = np.array([label for label in range(num_labels) if label != blank_label], dtype=np.int64)
+
+    beam = np.zeros(1, dtype=np.int64)
+    # Log probabilities of the alignments of each prefix ending with a blank / ending with the prefix last label
+    p_blank = np.zeros(1)
+    p_label = np.full(1, -np.inf)
+    for frame in log_probs:
+        labels = candidate_labels
+        if log_prune_threshold is not None:
+            labels = labels[frame[labels] >= log_prune_threshold]
+        p_total = np.logaddexp(p_blank, p_label)
+        last_labels = node_labels[beam]
+        has_label = last_labels >= 0
+
+        # The prefixes are kept by a blank frame or by a repetition of their last label
+        new_p_blank = p_total + frame[blank_label]
+        new_p_label = np.where(has_label, p_label + frame[last_labels], -np.inf)
+        # The prefixes are extended by a new label, a repeated label only extends the alignments ending with a blank
+        extensions = np.where(labels[None, :] == last_labels[:, None], p_blank[:, None], p_total[:, None]) + \
+            frame[labels][None, :]
+
+        # An extension equal to a prefix of the beam is merged into it
+        node_positions[beam] = np.arange(len(beam))
+        label_positions[labels] = np.arange(len(labels))
+        parents = np.where(has_label, node_positions[node_parents[beam]], -1)
+        extension_labels = np.where(has_label, label_positions[last_labels], -1)
+        merged = np.flatnonzero((parents >= 0) & (extension_labels >= 0))
+        new_p_label[merged] = np.logaddexp(new_p_label[merged],
+                                           extensions[parents[merged], extension_labels[merged]])
+        extensions[parents[merged], extension_labels[merged]] = -np.inf
+        node_positions[beam] = -1
+        label_positions[labels] = -1
+
+        # Keep the best candidates, the kept prefixes first then the extensions (row major)
+        scores = np.concatenate([np.logaddexp(new_p_blank, new_p_label), extensions.ravel()])
+        count = min(beam_width, len(scores))
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        best = best[np.isfinite(scores[best])]
+
+        kept = best < len(beam)
+        new_beam = np.empty(len(best), dtype=np.int64)
+        new_beam[kept] = beam[best[kept]]
+        p_blank = np.where(kept, new_p_blank[np.where(kept, best, 0)], -np.inf)
+        p_label = np.where(kept, new_p_label[np.where(kept, best, 0)], scores[best])
+        # The extensions are looked up in the trie by (parent node, label), the missing ones are added to it
+        extended, label_indices = np.divmod(best[~kept] - len(beam), max(len(labels), 1))
+        parent_nodes = beam[extended]
+        new_labels = labels[label_indices]
+        nodes = []
+        for key in (parent_nodes * num_labels + new_labels).tolist():
+            node = children.get(key)
+            if node is None:
+                node = children[key] = node_count
+                node_count += 1
+            nodes.append(node)
+        nodes = np.array(nodes, dtype=np.int64)
+        node_parents[nodes] = parent_nodes
+        node_labels[nodes] = new_labels
+        new_beam[~kept] = nodes
+        beam = new_beam
+
+    # Read the labels of the best prefix back from the trie
+    node = beam[int(np.argmax(np.logaddexp(p_blank, p_label)))]
+    result = []
+    while node > 0:
+        result.append(int(node_labels[node]))
+        node = node_parents[node]
+    return result[::-1]
+
+
+def beam_search_decode(logits, seq_lengths, beam_width=100, prune_threshold=0.0, blank_label=None):
+    """
+    Decode a batch with a CTC prefix beam search
+
+    Parameters
+    ----------
+    :param logits: an array of shape [time, batch, labels] (normalized by a softmax here)
+    :param seq_lengths: the number of valid frames of each item of the batch
+    :param beam_width: number of prefixes kept after each frame
+    :param prune_threshold: labels whose probability in a frame is below this value are not tried as extensions of the
+                            prefixes in that frame (0 to try every label)
+    :param blank_label: the blank label (the last label if None)
+    :return: a list of labels list, one per item of the batch
+    """
+    if beam_width < 1:
+        raise ValueError("The beam width should be at least 1 (got {0})".format(beam_width))
+    log_probs = log_softmax(logits)
+    if blank_label is None:
+        blank_label = log_probs.shape[2] - 1
+    log_prune_threshold = np.log(prune_threshold) if prune_threshold > 0 else None
+    return [_prefix_beam_search(log_probs[:seq_length, index], blank_label, beam_width, log_prune_threshold)
+            for index, seq_length in enumerate(seq_lengths)]
+
+
+def to_dense(label_lists, default_value):
+    """
+    Pack decoded labels lists into a dense array, as tf.sparse_tensor_to_dense does for the tensorflow decoder
+
+    :param label_lists: a list of labels list
+    :param default_value: the value of the padding
+    :return: an int32 array of shape [number of lists, longest list length]
+    """
+    dense = np.full((len(label_lists), max([len(labels) for labels in label_lists] + [0])), default_value,
+                    dtype=np.int32)
+    for index, labels in enumerate(label_lists):
+        dense[index, :len(labels)] = labels
+    return dense
@@ -4,14 +4,15 @@ Reads in audio and text data, transforming it for input into the neural nets
 It will extract the dataset.
 """
 import os
-import pickle
-import subprocess
+import json
 import logging
 import configparser
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import mutagen
 import time
 import numpy as np
+import util.audioprocessor as audioprocessor
 
 
 DEFAULT_MIN_TEXT_LENGTH = 3         # Default minimum number of chars in a label to be kept into a dataset
@@ -20,51 +21,89 @@ DEFAULT_MIN_AUDIO_LENGTH = 0.4      # Default minimum duration (in seconds) of a
 
 class DataProcessor(object):
     def __init__(self, raw_data_paths, file_cache=None, min_text_size=DEFAULT_MIN_TEXT_LENGTH,
-                 min_audio_size=DEFAULT_MIN_AUDIO_LENGTH):
+                 min_audio_size=DEFAULT_MIN_AUDIO_LENGTH, max_input_seq_length=None, max_target_seq_length=None,
+                 char_map=None):
+        """
+        Build the dataset found in the given directories
+
+        Parameters
+        ----------
+        :param raw_data_paths: comma separated list of the dataset directories
+        :param file_cache: path to a manifest file (JSON lines) keeping the duration of the audio files between runs,
+                           only the new or modified audio files are probed when provided
+        :param min_text_size: labels with at most this number of chars are removed from the dataset
+        :param min_audio_size: audio files lasting at most this duration (in seconds) are removed from the dataset
+        :param max_input_seq_length: audio files whose estimated features length is above this value are removed from
+                                     the dataset (optional)
+        :param max_target_seq_length: labels longer than this value once transcoded are removed from the dataset
+                                      (optional, needs char_map)
+        :param char_map: the char_map against which the labels are transcoded, when given the labels longer than the
+                         estimated features length are also removed (the CTC loss can not use them)
+        """
         self.raw_data_paths = raw_data_paths.replace(" ", "").split(',')
         self.file_cache = file_cache
         self.min_text_size = min_text_size
         self.min_audio_size = min_audio_size
+        self.max_input_seq_length = max_input_seq_length
+        self.max_target_seq_length = max_target_seq_length
+        self.char_map = char_map
 
-        # Load the file list
-        cached_data = self.load_filelist()
-        if cached_data is not None:
-            logging.info("{0} : Using audio files list from cache file.".format(self.raw_data_paths))
-            self.data = cached_data
-        else:
-            self.data = []
-            for path in self.raw_data_paths:
-                data_type = self.get_type(path)
-                if data_type == "Shtooka":
-                    self.data += self.get_data_shtooka(path)
-                elif data_type == "Vystadial_2013":
-                    self.data += self.get_data_vystadial_2013(path)
-                elif data_type == "TEDLIUM":
-                    self.data += self.get_data_tedlium(path)
-                elif data_type == "LibriSpeech":
-                    self.data += self.get_data_librispeech(path)
-                else:
-                    raise Exception("ERROR : unknown training_dataset_type")
+        # Walk the dataset directories in parallel, this is mostly waiting for the file system
+        with ThreadPool(len(self.raw_data_paths)) as p:
+            datasets = p.map(self.get_data, self.raw_data_paths)
+        self.data = [item for dataset in datasets for item in dataset]
 
-            # Adding length
-            logging.info("Retrieving audio duration from {0} files. Please wait.".format(len(self.data)))
-            start_time = time.time()
-            self.data = self._add_audio_length_on_dataset(self.data)
-            logging.info("--- Duration : {0}".format(time.time() - start_time))
-
-            # Save the file list if a cache file is provided
-            if self.file_cache is not None:
-                logging.info("{0} : Saving audio files list to cache file.".format(self.raw_data_paths))
-                self.save_filelist(self.data)
+        # Adding length
+        start_time = time.time()
+        self.data = self._add_audio_length_on_dataset(self.data)
+        logging.info("--- Duration : {0}".format(time.time() - start_time))
 
         # Check that there is data
         if len(self.data) == 0:
             raise Exception("ERROR : no data found in directories {0}".format(self.raw_data_paths))
 
-        # Filtering small text items
-        self.data = [item for item in self.data if len(item[1]) > self.min_text_size]
-        # Filtering small files
-        self.data = [item for item in self.data if item[2] > self.min_audio_size]
+        # Filter each dataset, before any feature is extracted from the samples which would be of no use
+        filtered_data = []
+        start = 0
+        for raw_data_path, dataset in zip(self.raw_data_paths, datasets):
+            filtered_data += self._filter_dataset(raw_data_path, self.data[start:start + len(dataset)])
+            start += len(dataset)
+        self.data = filtered_data
+
+    def _filter_dataset(self, raw_data_path, data):
+        """
+        Remove the samples too short or too long to be used and report the number of removed samples
+
+        :param raw_data_path: the dataset directory (for the report)
+        :param data: the list of [audio_file, label, audio_length] found in the directory
+        :return: the filtered list
+        """
+        dropped = {}
+        result = []
+        for item in data:
+            if len(item[1]) <= self.min_text_size:
+                reason = "label too short"
+            elif item[2] <= self.min_audio_size:
+                reason = "audio too short"
+            else:
+                reason = None
+                input_length = audioprocessor.AudioProcessor.get_mfcc_length_from_duration(item[2])
+                if (self.max_input_seq_length is not None) and (input_length > self.max_input_seq_length):
+                    reason = "audio too long"
+                elif self.char_map is not None:
+                    target_length = len(self.get_str_labels(self.char_map, item[1]))
+                    if (self.max_target_seq_length is not None) and (target_length > self.max_target_seq_length):
+                        reason = "label too long"
+                    elif target_length > input_length:
+                        reason = "label longer than audio"
+            if reason is None:
+                result.append(item)
+            else:
+                dropped[reason] = dropped.get(reason, 0) + 1
+        if len(dropped) > 0:
+            logging.info("%s : %d samples kept, %d dropped (%s)", raw_data_path, len(result), len(data) - len(result),
+                         ", ".join(["{0} : {1}".format(reason, count) for reason, count in sorted(dropped.items())]))
+        return result
 
     def get_dataset(self):
         return self.data
@@ -204,35 +243,87 @@ class DataProcessor(object):
             result.append(char_list[i].lower())
         return "".join(result)
 
+    def get_data(self, raw_data_path):
+        """
+        Find the data of a dataset directory, the directory tree is scanned only once
+
+        :param raw_data_path: the dataset directory
+        :return: a list of [audio_file, label, audio_length] (audio_length is None if unknown)
+        """
+        start_time = time.time()
+        files = self.scan_files(raw_data_path)
+        scan_duration = time.time() - start_time
+        data_type = self.get_type(raw_data_path, files)
+        if data_type == "Shtooka":
+            result = self.get_data_shtooka(raw_data_path, files)
+        elif data_type == "Vystadial_2013":
+            result = self.get_data_vystadial_2013(raw_data_path, files)
+        elif data_type == "TEDLIUM":
+            result = self.get_data_tedlium(raw_data_path, files)
+        elif data_type == "LibriSpeech":
+            result = self.get_data_librispeech(raw_data_path, files)
+        else:
+            raise Exception("ERROR : unknown training_dataset_type")
+        logging.info("%s : %s dataset, %d files scanned in %.2f s, %d items parsed in %.2f s", raw_data_path,
+                     data_type, len(files), scan_duration, len(result), time.time() - start_time - scan_duration)
+        return result
+
     @classmethod
-    def get_type(cls, raw_data_path):
-        # Check for ".trn" files
-        files = cls.find_files(raw_data_path, ".trn")
-        if files:
-            return "Vystadial_2013"
-        # Check for ".stm" files
-        files = cls.find_files(raw_data_path, ".stm")
-        if files:
-            return "TEDLIUM"
-        # Check for "index.tag.txt" files
-        files = cls.find_files(raw_data_path, "index.tags.txt")
-        if files:
-            return "Shtooka"
-        # Check for ".trans.txt" files
-        files = cls.find_files(raw_data_path, ".trans.txt")
-        if files:
-            return "LibriSpeech"
+    def get_type(cls, raw_data_path, files=None):
+        """
+        Find the type of a dataset from the files it holds
+
+        :param raw_data_path: the dataset directory
+        :param files: the list of the files in the directory tree (as returned by scan_files), scanned if not provided
+        :return: the dataset type
+        """
+        if files is None:
+            files = cls.scan_files(raw_data_path)
+        # Classify the files for every known format in a single pass
+        found_types = set()
+        for file in files:
+            if file.endswith(".trn"):
+                found_types.add("Vystadial_2013")
+            elif file.endswith(".stm"):
+                found_types.add("TEDLIUM")
+            elif file.endswith("index.tags.txt"):
+                found_types.add("Shtooka")
+            elif file.endswith(".trans.txt"):
+                found_types.add("LibriSpeech")
+        for data_type in ["Vystadial_2013", "TEDLIUM", "Shtooka", "LibriSpeech"]:
+            if data_type in found_types:
+                return data_type
         return "Unrecognized"
 
     @staticmethod
-    def find_files(root_search_path, files_extension):
+    def scan_files(root_search_path):
+        """
+        List every file in a directory tree
+
+        :param root_search_path: the root directory
+        :return: the list of the files paths
+        """
         files_list = []
         for root, _, files in os.walk(root_search_path):
-            files_list.extend([os.path.join(root, file) for file in files if file.endswith(files_extension)])
+            files_list.extend([os.path.join(root, file) for file in files])
         return files_list
 
     @staticmethod
-    def _add_audio_length_on_file(audio_file, text, _length):
+    def find_files(root_search_path, files_extension, files=None):
+        if files is None:
+            files = DataProcessor.scan_files(root_search_path)
+        return [file for file in files if file.endswith(files_extension)]
+
+    @staticmethod
+    def _get_existing_files(files):
+        # Checking a path against the listing avoids a stat call per audio file on slow (network) file systems
+        return set([os.path.normpath(file) for file in files])
+
+    @staticmethod
+    def _add_audio_length_on_file(audio_file, text, length):
+        if length is not None:
+            # The duration is already known (for a segment of a file)
+            return [audio_file, text, length]
         file = mutagen.File(audio_file)
         try:
             length = file.info.length
@@ -242,26 +333,96 @@ class DataProcessor(object):
             length = 0
         return [audio_file, text, length]
 
-    @staticmethod
-    def _add_audio_length_on_dataset(file_list):
-        with Pool() as p:
-            result = p.starmap(DataProcessor._add_audio_length_on_file, file_list)
+    def _add_audio_length_on_dataset(self, file_list):
+        """
+        Set the duration of each audio file, reusing the durations of the manifest for unchanged files
+
+        :param file_list: a list of [audio_file, label, audio_length]
+        :return: the list with the audio lengths set
+        """
+        manifest = self.load_manifest()
+        result = list(file_list)
+        to_probe = []
+        for index, (audio_file, text, length) in enumerate(file_list):
+            if length is not None:
+                continue
+            try:
+                stat = os.stat(audio_file)
+            except OSError:
+                to_probe.append((index, None))
+                continue
+            entry = manifest.get(audio_file)
+            if (entry is not None) and (entry["mtime"] == stat.st_mtime) and (entry["size"] == stat.st_size):
+                result[index] = [audio_file, text, entry["duration"]]
+            else:
+                to_probe.append((index, stat))
+
+        logging.info("Retrieving audio duration from {0} files ({1} known from the manifest). Please wait."
+                     .format(len(to_probe), len(file_list) - len(to_probe)))
+        if len(to_probe) > 0:
+            with Pool() as p:
+                probed = p.starmap(DataProcessor._add_audio_length_on_file, [file_list[i] for i, _ in to_probe])
+            new_entries = []
+            for (index, stat), item in zip(to_probe, probed):
+                result[index] = item
+                if stat is not None:
+                    new_entries.append({"path": item[0], "mtime": stat.st_mtime, "size": stat.st_size,
+                                        "duration": item[2]})
+            self.save_manifest_entries(manifest, new_entries)
         return result
 
-    def save_filelist(self, data):
-        with open(self.file_cache, 'wb') as handle:
-            pickle.dump([self.raw_data_paths, data], handle)
+    def load_manifest(self):
+        """
+        Read the manifest file, later lines of the file override the earlier ones
 
-    def load_filelist(self):
-        if (self.file_cache is not None) and (os.path.exists(self.file_cache)):
-            with open(self.file_cache, 'rb') as handle:
-                [data_path, data] = pickle.load(handle)
-            if data_path == self.raw_data_paths:
-                return data
-        return None
+        :return: a dictionary of the manifest entries by audio file path
+        """
+        manifest = {}
+        self.manifest_line_count = 0
+        if (self.file_cache is None) or (not os.path.exists(self.file_cache)):
+            return manifest
+        invalid_line_count = 0
+        with open(self.file_cache, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    manifest[entry["path"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    # A cache file from a previous version (pickle) or a line truncated by an interrupted write
+                    invalid_line_count += 1
+                self.manifest_line_count += 1
+        if invalid_line_count > 0:
+            logging.warning("%s : ignoring %d invalid manifest lines", self.file_cache, invalid_line_count)
+        return manifest
+
+    def save_manifest_entries(self, manifest, new_entries):
+        """
+        Append new entries to the manifest file, the file is rewritten once outdated lines make up most of it
 
-    def get_data_librispeech(self, raw_data_path):
-        text_files = self.find_files(raw_data_path, ".txt")
+        :param manifest: the entries already in the manifest file (updated with the new entries)
+        :param new_entries: the entries to add
+        """
+        if self.file_cache is None:
+            return
+        manifest.update({entry["path"]: entry for entry in new_entries})
+        self.manifest_line_count += len(new_entries)
+        if self.manifest_line_count > 2 * len(manifest):
+            tmp_file = self.file_cache + ".tmp"
+            with open(tmp_file, 'w') as f:
+                for entry in manifest.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_file, self.file_cache)
+            self.manifest_line_count = len(manifest)
+        else:
+            with open(self.file_cache, 'a') as f:
+                for entry in new_entries:
+                    f.write(json.dumps(entry) + "\n")
+
+    def get_data_librispeech(self, raw_data_path, files=None):
+        if files is None:
+            files = self.scan_files(raw_data_path)
+        text_files = self.find_files(raw_data_path, ".txt", files)
+        existing_files = self._get_existing_files(files)
         result = []
         for text_file in text_files:
             directory = os.path.dirname(text_file)
@@ -273,12 +434,15 @@ class DataProcessor(object):
                         # Not a line with a file desc
                         break
                     audio_file = directory + "/" + head + ".flac"
-                    if os.path.exists(audio_file):
+                    if os.path.normpath(audio_file) in existing_files:
                         result.append([audio_file, self.clean_label(line.replace(head, "")), None])
         return result
 
-    def get_data_shtooka(self, raw_data_path):
-        text_files = self.find_files(raw_data_path, ".txt")
+    def get_data_shtooka(self, raw_data_path, files=None):
+        if files is None:
+            files = self.scan_files(raw_data_path)
+        text_files = self.find_files(raw_data_path, "index.tags.txt", files)
+        existing_files = self._get_existing_files(files)
         # Build from index_tags
         result = []
         for file in text_files:
@@ -288,23 +452,29 @@ class DataProcessor(object):
                 root = file.replace("index.tags.txt", "")
                 for section in config.sections():
                     audio_file = root + section
-                    if os.path.exists(audio_file):
+                    if os.path.normpath(audio_file) in existing_files:
                         result.append([audio_file, self.clean_label(config[section]['SWAC_TEXT']), None])
         return result
 
-    def get_data_vystadial_2013(self, raw_data_path):
-        wav_audio_files = self.find_files(raw_data_path, ".wav")
+    def get_data_vystadial_2013(self, raw_data_path, files=None):
+        if files is None:
+            files = self.scan_files(raw_data_path)
+        wav_audio_files = self.find_files(raw_data_path, ".wav", files)
+        existing_files = self._get_existing_files(files)
         # Build from index_tags
         result = []
         for file in wav_audio_files:
-            if os.path.exists(file + ".trn"):
+            if os.path.normpath(file + ".trn") in existing_files:
                 with open(file + ".trn", "r") as f:
                     words = f.readline()
                     result.append([file, self.clean_label(words), None])
         return result
 
-    def get_data_tedlium(self, raw_data_path):
-        stm_files = self.find_files(raw_data_path, ".stm")
+    def get_data_tedlium(self, raw_data_path, files=None):
+        if files is None:
+            files = self.scan_files(raw_data_path)
+        stm_files = self.find_files(raw_data_path, ".stm", files)
+        existing_files = self._get_existing_files(files)
         # Build from index_tags
         result = []
         for file in stm_files:
@@ -318,20 +488,9 @@ class DataProcessor(object):
                         start = line_list[3]
                         end = line_list[4]
                         directory = os.path.split(file)[0]
-                        sph_file = directory + "/../sph/{0}.sph".format(line_list[0])
-                        wav_file = directory + "/../sph/{0}_{1}.wav".format(line_list[0], start)
-                        extract_result = None
-                        if not os.path.exists(wav_file):
-                            extract_result = self.extract_wav_from_sph(sph_file, wav_file, start, end)
-                        if extract_result is not False:
-                            result.append([wav_file, self.clean_label(line_list[6]), None])
+                        sph_file = os.path.normpath(directory + "/../sph/{0}.sph".format(line_list[0]))
+                        if sph_file in existing_files:
+                            # Reference the segment in the talk's file, it is read directly at processing time
+                            segment = audioprocessor.get_segment_reference(sph_file, start, end)
+                            result.append([segment, self.clean_label(line_list[6]), float(end) - float(start)])
         return result
-
-    @staticmethod
-    def extract_wav_from_sph(sph_file, wav_file, start, end):
-        try:
-            subprocess.call(["sox", sph_file, wav_file, "trim", start, "={0}".format(end)])
-        except OSError as e:
-            logging.warning("Execution failed : %s", e)
-            return False
-        return True
@@ -0,0 +1,116 @@
+# coding=utf-8
+"""
+Edit distance between a reference and a hypothesis, used for the word and character error rates.
+
+The Levenshtein matrix is filled one row at a time with numpy operations : the substitutions and deletions of a row only
+depend on the previous row, and the insertions (which depend on the previous cell of the same row) are resolved by a
+cumulative minimum. The matrix uses 64 bits integers so that there is no length limit.
+
+Besides the distance, a backtrace gives the number of substitutions, insertions and deletions of an optimal alignment.
+"""
+import numpy as np
+
+
+def _to_integers(reference, hypothesis):
+    """
+    Map the tokens of two sequences to integers so that they can be compared by numpy
+    """
+    vocabulary = {}
+    reference_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in reference], dtype=np.int64)
+    hypothesis_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in hypothesis], dtype=np.int64)
+    return reference_ids, hypothesis_ids
+
+
+def _get_distance_matrix(reference, hypothesis):
+    """
+    Fill the Levenshtein matrix, d[i, j] being the distance between reference[:i] and hypothesis[:j]
+    """
+    columns = np.arange(len(hypothesis) + 1, dtype=np.int64)
+    d = np.empty((len(reference) + 1, len(hypothesis) + 1), dtype=np.int64)
+    d[0] = columns
+    for i in range(1, len(reference) + 1):
+        row = d[i]
+        row[0] = i
+        # Match / substitution from the upper left cell, deletion from the upper cell
+        np.minimum(d[i - 1, :-1] + (hypothesis != reference[i - 1]), d[i - 1, 1:] + 1, out=row[1:])
+        # Insertion from the left cell : row[j] = min over k <= j of row[k] + (j - k)
+        row -= columns
+        np.minimum.accumulate(row, out=row)
+        row += columns
+    return d
+
+
+def edit_distance(reference, hypothesis):
+    """
+    Compute the edit distance between two sequences of tokens
+
+    Parameters
+    ----------
+    :param reference: the reference sequence (a list of words, a string...)
+    :param hypothesis: the hypothesis sequence
+    :return: a tuple (errors, substitutions, insertions, deletions), the errors being the edit distance
+    """
+    reference, hypothesis = _to_integers(reference, hypothesis)
+    d = _get_distance_matrix(reference, hypothesis)
+
+    # Backtrace an optimal alignment to count each kind of error
+    substitutions = insertions = deletions = 0
+    i, j = len(reference), len(hypothesis)
+    while (i > 0) and (j > 0):
+        cost = d[i, j]
+        if cost == d[i - 1, j - 1] + (reference[i - 1] != hypothesis[j - 1]):
+            if reference[i - 1] != hypothesis[j - 1]:
+                substitutions += 1
+            i -= 1
+            j -= 1
+        elif cost == d[i - 1, j] + 1:
+            deletions += 1
+            i -= 1
+        else:
+            insertions += 1
+            j -= 1
+    deletions += i
+    insertions += j
+    return int(d[-1, -1]), substitutions, insertions, deletions
+
+
+def batch_edit_distance(references, hypotheses):
+    """
+    Compute the edit distances of many pairs of sequences
+
+    :param references: a list of reference sequences
+    :param hypotheses: a list of hypothesis sequences (same length as references)
+    :return: an int64 array of shape [number of pairs, 4], each row being (errors, substitutions, insertions, deletions)
+    """
+    if len(references) != len(hypotheses):
+        raise ValueError("Got {0} references for {1} hypotheses".format(len(references), len(hypotheses)))
+    result = np.zeros((len(references), 4), dtype=np.int64)
+    for index, (reference, hypothesis) in enumerate(zip(references, hypotheses)):
+        result[index] = edit_distance(reference, hypothesis)
+    return result
+
+
+def word_errors(references, hypotheses):
+    """
+    Count the word errors of many transcripts
+
+    :param references: a list of reference strings
+    :param hypotheses: a list of transcribed strings
+    :return: a tuple of the errors counts (as returned by batch_edit_distance) and of the number of reference words
+    """
+    references = [reference.split() for reference in references]
+    hypotheses = [hypothesis.split() for hypothesis in hypotheses]
+    return batch_edit_distance(references, hypotheses), np.array([len(reference) for reference in references])
+
+
+def char_errors(references, hypotheses):
+    """
+    Count the character errors of many transcripts, spaces are ignored
+
+    :param references: a list of reference strings
+    :param hypotheses: a list of transcribed strings
+    :return: a tuple of the errors counts (as returned by batch_edit_distance) and of the number of reference chars
+    """
+    references = [reference.replace(" ", "") for reference in references]
+    hypotheses = [hypothesis.replace(" ", "") for hypothesis in hypotheses]
+    return batch_edit_distance(references, hypotheses), np.array([len(reference) for reference in references])
@@ -0,0 +1,165 @@
+# coding=utf-8
+"""
+Per-utterance evaluation results.
+
+An evaluation writes one JSON record per line for each scored utterance, as soon as its batch is scored :
+    {"path": ..., "reference": ..., "hypothesis": ..., "decode_time": ..., "duration": ...,
+     "word": {"errors": ..., "substitutions": ..., "insertions": ..., "deletions": ..., "reference_length": ...},
+     "char": {...same keys...}}
+
+The result files of an interrupted evaluation are used to resume it (the scored utterances are skipped) and the result
+files of the shards of an evaluation are merged to compute the error rates of the whole test set.
+"""
+import json
+import logging
+import os
+
+
+def get_shard(dataset, shard_index, shard_count):
+    """
+    Get a shard of a dataset, the dataset is ordered by path first so that every process splits it the same way
+
+    :param dataset: a list of [audio_file, label, audio_length]
+    :param shard_index: index of the shard (from 0 to shard_count - 1)
+    :param shard_count: number of shards
+    :return: the items of the shard
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("Invalid shard {0}/{1}, the index should be between 0 and {2}"
+                         .format(shard_index, shard_count, shard_count - 1))
+    return sorted(dataset, key=lambda item: item[0])[shard_index::shard_count]
+
+
+def parse_shard(shard):
+    """
+    Parse a shard description
+
+    :param shard: a string "i/N"
+    :return: a tuple (i, N)
+    """
+    try:
+        shard_index, shard_count = [int(value) for value in shard.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard {0}, expecting index/count (for example 0/4)".format(shard))
+    return shard_index, shard_count
+
+
+def get_record(path, reference, hypothesis, word_counts, char_counts, decode_time, duration=None):
+    """
+    Build the record of an utterance
+
+    :param path: the audio file
+    :param reference: the true label
+    :param hypothesis: the transcribed text
+    :param word_counts: the (errors, substitutions, insertions, deletions, reference length) on words
+    :param char_counts: the (errors, substitutions, insertions, deletions, reference length) on chars
+    :param decode_time: the inference time (in seconds) of the utterance
+    :param duration: the duration (in seconds) of the utterance
+    :return: a dictionary
+    """
+    keys = ["errors", "substitutions", "insertions", "deletions", "reference_length"]
+    return {"path": path, "reference": reference, "hypothesis": hypothesis, "decode_time": decode_time,
+            "duration": duration,
+            "word": {key: int(value) for key, value in zip(keys, word_counts)},
+            "char": {key: int(value) for key, value in zip(keys, char_counts)}}
+
+
+def read_results(result_files):
+    """
+    Read result files, an utterance scored more than once is only kept once (first record wins)
+
+    :param result_files: a list of result file paths, missing files are ignored
+    :return: a dictionary of the records by audio file path, in the order they were read
+    """
+    records = {}
+    for result_file in result_files:
+        if not os.path.exists(result_file):
+            continue
+        invalid_line_count = 0
+        with open(result_file, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records.setdefault(record["path"], record)
+                except (ValueError, KeyError, TypeError):
+                    # A line truncated by an interrupted write
+                    invalid_line_count += 1
+        if invalid_line_count > 0:
+            logging.warning("%s : ignoring %d invalid result lines", result_file, invalid_line_count)
+    return records
+
+
+class ErrorRateAccumulator(object):
+    def __init__(self):
+        """
+        Accumulate the error counts of scored utterances in constant memory
+
+        The corpus error rates (total errors over total reference length) and the mean of the utterances error rates
+        are both available. Accumulators of different shards can be merged exactly.
+        """
+        self.utterances = 0
+        self.decode_time = 0.0
+        self.audio_duration = 0.0
+        # For each unit : errors, substitutions, insertions, deletions, reference length
+        self.counts = {"word": [0] * 5, "char": [0] * 5}
+        # For each unit : sum and count of the utterances error rates (utterances with an empty reference are excluded)
+        self.rate_sums = {"word": [0.0, 0], "char": [0.0, 0]}
+
+    def add(self, word_counts, char_counts, decode_time=0.0, audio_duration=0.0):
+        """
+        Add a scored utterance
+
+        :param word_counts: the (errors, substitutions, insertions, deletions, reference length) on words
+        :param char_counts: the (errors, substitutions, insertions, deletions, reference length) on chars
+        :param decode_time: the inference time (in seconds) of the utterance
+        :param audio_duration: the duration (in seconds) of the utterance
+        """
+        self.utterances += 1
+        self.decode_time += decode_time
+        self.audio_duration += audio_duration
+        for unit, counts in [("word", word_counts), ("char", char_counts)]:
+            for index in range(5):
+                self.counts[unit][index] += int(counts[index])
+            if counts[4] > 0:
+                self.rate_sums[unit][0] += counts[0] / float(counts[4])
+                self.rate_sums[unit][1] += 1
+
+    def add_record(self, record):
+        """
+        Add a scored utterance from its record (see get_record)
+        """
+        keys = ["errors", "substitutions", "insertions", "deletions", "reference_length"]
+        self.add([record["word"][key] for key in keys], [record["char"][key] for key in keys],
+                 record.get("decode_time", 0.0), record.get("duration") or 0.0)
+
+    def merge(self, other):
+        """
+        Add the utterances of another accumulator to this one
+
+        :param other: an ErrorRateAccumulator
+        """
+        self.utterances += other.utterances
+        self.decode_time += other.decode_time
+        self.audio_duration += other.audio_duration
+        for unit in ["word", "char"]:
+            for index in range(5):
+                self.counts[unit][index] += other.counts[unit][index]
+            for index in range(2):
+                self.rate_sums[unit][index] += other.rate_sums[unit][index]
+
+    def get_error_rates(self):
+        """
+        :return: a dictionary with the corpus WER and CER (total errors over total reference length), the mean WER and
+                 CER (mean of the utterances error rates), in percents, the substitutions, insertions and deletions
+                 counts and the real time factor (decode time over audio duration, None if the duration is unknown)
+        """
+        result = {"utterances": self.utterances,
+                  "real_time_factor": self.decode_time / self.audio_duration if self.audio_duration > 0 else None}
+        for unit, name in [("word", "wer"), ("char", "cer")]:
+            errors, substitutions, insertions, deletions, reference_length = self.counts[unit]
+            result["corpus_" + name] = 100.0 * errors / max(reference_length, 1)
+            result["mean_" + name] = 100.0 * self.rate_sums[unit][0] / max(self.rate_sums[unit][1], 1)
+            result[unit + "_substitutions"] = substitutions
+            result[unit + "_insertions"] = insertions
+            result[unit + "_deletions"] = deletions
+        return result
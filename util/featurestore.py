@@ -0,0 +1,194 @@
+# coding=utf-8
+"""
+On-disk store of precomputed acoustic features.
+
+Features are extracted once (see "stt.py --extract_features") and then read back from disk by the training input
+pipeline, so an epoch costs disk reads instead of signal processing.
+
+A store is a directory named after the signal processing parameters used to build it and contains :
+  * features.bin : one float32 block of shape [length, feature_size] per utterance, written one after the other
+  * index.p : a pickled dictionary giving, for each audio file, the offset (in frames) and length of its block
+
+The feature file is read through a read-only memory map, so batches are assembled by slicing into the map and several
+training processes on the same host share the page cache instead of each holding its own copy of the features.
+"""
+import os
+import pickle
+import logging
+import time
+from functools import partial
+import numpy as np
+import util.audioprocessor as audioprocessor
+
+
+# Number of extracted files between two saves of the index
+INDEX_SAVE_INTERVAL = 1000
+
+
+class FeatureStore(object):
+    def __init__(self, store_dir, signal_processing, sample_rate=None):
+        """
+        Open (or prepare the creation of) the feature store matching the given signal processing parameters
+
+        Parameters
+        ----------
+        :param store_dir: the root directory of the feature stores
+        :param signal_processing: the signal processing mode (mfcc or fbank)
+        :param sample_rate: the rate the audio files are resampled to (None for their native rate)
+        """
+        self.signal_processing = signal_processing
+        self.sample_rate = sample_rate
+        self.feature_size = audioprocessor.AudioProcessor(None, signal_processing).feature_size
+        self.metadata = {"signal_processing": signal_processing,
+                         "sample_rate": sample_rate,
+                         "frame_size": audioprocessor.FRAME_SIZE,
+                         "frame_stride": audioprocessor.FRAME_STRIDE,
+                         "feature_size": self.feature_size}
+        self.path = os.path.join(store_dir, self.get_store_name(signal_processing, sample_rate))
+        self.data_file = os.path.join(self.path, "features.bin")
+        self.index_file = os.path.join(self.path, "index.p")
+        self.index = self.load_index()
+        self._memmap = None
+
+    @staticmethod
+    def get_store_name(signal_processing, sample_rate=None):
+        """
+        Build the name of the store directory, features extracted with different parameters are not compatible
+
+        :param signal_processing: the signal processing mode (mfcc or fbank)
+        :param sample_rate: the rate the audio files are resampled to (None for their native rate)
+        :return string: the store directory name
+        """
+        return "{0}_size_{1}_stride_{2}_rate_{3}".format(signal_processing, audioprocessor.FRAME_SIZE,
+                                                         audioprocessor.FRAME_STRIDE,
+                                                         "native" if sample_rate is None else sample_rate)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, file):
+        return file in self.index
+
+    def get_missing_files(self, files):
+        """
+        List the audio files whose features are not in the store
+
+        :param files: a list of audio file paths
+        :return: the sorted list of the files missing from the store
+        """
+        return [file for file in sorted(set(files)) if file not in self.index]
+
+    def load_index(self):
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as handle:
+                [metadata, index] = pickle.load(handle)
+            if metadata != self.metadata:
+                raise ValueError("Feature store {0} was built with different parameters : {1}"
+                                 .format(self.path, metadata))
+            return index
+        return {}
+
+    def save_index(self):
+        # Write to a temporary file first so that an interrupted save does not corrupt the index
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, 'wb') as handle:
+            pickle.dump([self.metadata, self.index], handle)
+        os.replace(tmp_file, self.index_file)
+
+    def extract(self, files, processes=None):
+        """
+        Extract the features of every audio file not already in the store and append them to it
+
+        Parameters
+        ----------
+        :param files: a list of audio file paths
+        :param processes: number of worker processes (default to the number of CPUs, the extraction being run alone)
+        :return int: the number of files added to the store
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        files = self.get_missing_files(files)
+        logging.info("Extracting features from %d files into %s", len(files), self.path)
+        if len(files) == 0:
+            return 0
+
+        # Append after the last indexed block, data written by an interrupted extraction after the last index save
+        # is dropped
+        bytes_per_frame = self.feature_size * np.dtype(np.float32).itemsize
+        offset = max([block_offset + length for block_offset, length in self.index.values()], default=0)
+
+        start_time = time.time()
+        added = 0
+        pool = audioprocessor.create_worker_pool(processes or os.cpu_count())
+        with open(self.data_file, 'ab') as data_handle, pool as p:
+            data_handle.truncate(offset * bytes_per_frame)
+            # The full (untruncated) feature vectors are stored
+            extract_function = partial(audioprocessor.extract_file_features, max_input_seq_length=None,
+                                       signal_processing=self.signal_processing, sample_rate=self.sample_rate)
+            for file, feat_vec, _ in p.imap_unordered(extract_function, files, chunksize=16):
+                if feat_vec is None:
+                    continue
+                feat_vec = np.asarray(feat_vec, dtype=np.float32)
+                data_handle.write(feat_vec.tobytes())
+                self.index[file] = (offset, len(feat_vec))
+                offset += len(feat_vec)
+                added += 1
+                if added % INDEX_SAVE_INTERVAL == 0:
+                    data_handle.flush()
+                    self.save_index()
+                    logging.info("Extracted %d / %d files (%.2f s)", added, len(files), time.time() - start_time)
+        self.save_index()
+        # The feature file has grown, the memory map must be rebuilt
+        self._memmap = None
+        logging.info("--- Extraction of %d files done in %.2f s", added, time.time() - start_time)
+        return added
+
+    def get_memmap(self):
+        """
+        Map the feature file in memory (read-only)
+
+        :return: a numpy memmap of shape [total number of frames, feature_size]
+        """
+        if self._memmap is None:
+            frames_count = max([offset + length for offset, length in self.index.values()], default=0)
+            if frames_count == 0:
+                raise ValueError("Feature store {0} is empty".format(self.path))
+            self._memmap = np.memmap(self.data_file, dtype=np.float32, mode='r',
+                                     shape=(frames_count, self.feature_size))
+        return self._memmap
+
+    def read(self, file, max_input_seq_length=None):
+        """
+        Read the feature vector of an audio file from the store
+
+        Parameters
+        ----------
+        :param file: the audio file path
+        :param max_input_seq_length: truncate the feature vector to this length if given
+        :returns feat_vec: the (truncated) feature vector, a read-only view on the memory map
+        :returns length: original length of the feature vector before truncation
+        """
+        offset, length = self.index[file]
+        read_length = length if max_input_seq_length is None else min(length, max_input_seq_length)
+        return self.get_memmap()[offset:offset + read_length], length
+
+    def read_batch(self, offsets, lengths, max_input_seq_length):
+        """
+        Assemble a batch of feature vectors by slicing into the memory map
+        The batch is zero-padded to the length of its longest (truncated) feature vector
+
+        Parameters
+        ----------
+        :param offsets: offsets (in frames) of the feature vectors in the store
+        :param lengths: lengths of the feature vectors
+        :param max_input_seq_length: length to which the feature vectors are truncated
+        :returns feat_vecs: float32 array of shape [batch, padded length, feature_size]
+        :returns lengths: original lengths of the feature vectors before truncation
+        """
+        features = self.get_memmap()
+        read_lengths = np.minimum(lengths, max_input_seq_length)
+        feat_vecs = np.zeros((len(offsets), max(read_lengths, default=0), self.feature_size), dtype=np.float32)
+        for i, (offset, read_length) in enumerate(zip(offsets, read_lengths)):
+            feat_vecs[i, :read_length] = features[offset:offset + read_length]
+        return feat_vecs, np.asarray(lengths, dtype=np.int32)
@@ -7,6 +7,7 @@ import os
 import pickle
 import time
 import logging
+import util.audioprocessor as audioprocessor
 try:
     import ConfigParser as configparser
 except ImportError:
@@ -36,7 +37,10 @@ class HyperParameterHandler(object):
         if self.check_exists():
             if self.check_changed(self.hyper_params):
                 if not self.hyper_params["use_config_file_if_checkpoint_exists"]:
-                    self.hyper_params = self.get_params()
+                    # Parameters missing from an old checkpoint file are taken from the config file
+                    restored_params = self.hyper_params
+                    restored_params.update(self.get_params())
+                    self.hyper_params = restored_params
                     logging.info("Restoring hyper params from previous checkpoint...")
                 else:
                     new_checkpoint_dir = "{0}_hidden_size_{1}_numlayers_{2}_signal_processing_{3}".format(
@@ -66,7 +70,17 @@ class HyperParameterHandler(object):
 
     def get_params(self):
         with open(self.file_path, 'rb') as handle:
-            return pickle.load(handle)
+            params = pickle.load(handle)
+        # Default signal_processing to mfcc if not present for compatibility with old checkpoint files
+        if "signal_processing" not in params:
+            params["signal_processing"] = "mfcc"
+        # Default language to void string if not present for compatibility with old checkpoint files
+        if "language" not in params:
+            params["language"] = ""
+        # Old checkpoints were trained on audio resampled by librosa to its default rate
+        if "sample_rate" not in params:
+            params["sample_rate"] = audioprocessor.LEGACY_SAMPLE_RATE
+        return params
 
     def check_exists(self):
         """
@@ -77,16 +91,11 @@ class HyperParameterHandler(object):
     def check_changed(self, new_params):
         if self.check_exists():
             old_params = self.get_params()
-            # Default signal_processing to mfcc if not present for compatibility with old checkpoint files
-            if "signal_processing" not in old_params:
-                old_params["signal_processing"] = "mfcc"
-            # Default language to void string if not present for compatibility with old checkpoint files
-            if "language" not in old_params:
-                old_params["language"] = ""
             return old_params["num_layers"] != new_params["num_layers"] or\
                 old_params["hidden_size"] != new_params["hidden_size"] or\
                 old_params["signal_processing"] != new_params["signal_processing"] or\
-                old_params["language"] != new_params["language"]
+                old_params["language"] != new_params["language"] or\
+                old_params["sample_rate"] != new_params["sample_rate"]
         else:
             return False
 
@@ -112,8 +121,14 @@ class HyperParameterHandler(object):
         dic["lr_decay_factor"] = config.getfloat(acoustic_section, "lr_decay_factor")
         dic["grad_clip"] = config.getint(acoustic_section, "grad_clip")
         dic["signal_processing"] = config.get(acoustic_section, "signal_processing")
+        sample_rate = config.get(acoustic_section, "sample_rate", fallback=str(audioprocessor.LEGACY_SAMPLE_RATE))
+        dic["sample_rate"] = None if sample_rate == "native" else int(sample_rate)
         dic["language"] = config.get(acoustic_section, "language")
         dic["rnn_state_reset_ratio"] = config.getfloat(acoustic_section, "rnn_state_reset_ratio")
+        dic["lstm_implementation"] = config.get(acoustic_section, "lstm_implementation", fallback="basic")
+        dic["decoder"] = config.get(acoustic_section, "decoder", fallback="tensorflow")
+        dic["beam_width"] = config.getint(acoustic_section, "beam_width", fallback=100)
+        dic["beam_prune_threshold"] = config.getfloat(acoustic_section, "beam_prune_threshold", fallback=0.0)
         dic["use_config_file_if_checkpoint_exists"] = config.getboolean(general_section,
                                                                         "use_config_file_if_checkpoint_exists")
         dic["steps_per_checkpoint"] = config.getint(general_section, "steps_per_checkpoint")
@@ -122,9 +137,17 @@ class HyperParameterHandler(object):
         dic["training_dataset_dirs"] = config.get(training_section, "training_dataset_dirs")
         dic["training_filelist_cache"] = config.get(training_section, "training_filelist_cache", fallback=None)
         dic["test_dataset_dirs"] = config.get(training_section, "test_dataset_dirs", fallback=None)
+        dic["feature_store_dir"] = config.get(training_section, "feature_store_dir", fallback=None) or None
+        feature_workers = config.get(training_section, "feature_workers", fallback="")
+        dic["feature_workers"] = int(feature_workers) if feature_workers else None
         dic["train_frac"] = config.getfloat(training_section, "train_frac", fallback=None)
         dic["max_input_seq_length"] = config.getint(training_section, "max_input_seq_length")
         dic["max_target_seq_length"] = config.getint(training_section, "max_target_seq_length")
+        bucket_boundaries = config.get(training_section, "bucket_boundaries", fallback="")
+        dic["bucket_boundaries"] = [int(value) for value in bucket_boundaries.replace(" ", "").split(',') if value]
+        dic["training_error_rate_decoder"] = config.get(training_section, "training_error_rate_decoder",
+                                                        fallback="beam")
+        dic["training_error_rate_every"] = config.getint(training_section, "training_error_rate_every", fallback=1)
         dic["tensorboard_dir"] = config.get(training_section, "tensorboard_dir", fallback=None)
         if dic["tensorboard_dir"] is not None and not os.path.exists(dic["tensorboard_dir"]):
             dic["tensorboard_dir"] = None
@@ -0,0 +1,251 @@
+# coding=utf-8
+import unittest
+import os
+import shutil
+import tempfile
+import wave
+from unittest import mock
+import numpy as np
+import util.audioprocessor as audioprocessor
+
+
+def reference_mel_filterbank(sr, nfft, nfilt):
+    """
+    Reference (loop based) construction of the mel filterbank
+    """
+    high_freq_mel = (2595 * np.log10(1 + (float(sr) / 2) / 700))
+    mel_points = np.linspace(0, high_freq_mel, nfilt + 2)
+    hz_points = (700 * (10**(mel_points / 2595) - 1))
+    bin = np.floor((nfft + 1) * hz_points / sr)
+
+    fbank = np.zeros((nfilt, int(np.floor(nfft / 2 + 1))))
+    for m in range(1, nfilt + 1):
+        f_m_minus = int(bin[m - 1])   # left
+        f_m = int(bin[m])             # center
+        f_m_plus = int(bin[m + 1])    # right
+
+        for k in range(f_m_minus, f_m):
+            fbank[m - 1, k] = (k - bin[m - 1]) / (bin[m] - bin[m - 1])
+        for k in range(f_m, f_m_plus):
+            fbank[m - 1, k] = (bin[m + 1] - k) / (bin[m + 1] - bin[m])
+    return fbank
+
+
+def reference_log_mel_energies(sig, sr):
+    """
+    Reference (fancy indexing based) framing and log mel energies computation of the fbank features
+    """
+    emphasized_signal = np.append(sig[0], sig[1:] - 0.97 * sig[:-1])
+    frame_length = int(round(audioprocessor.FRAME_SIZE * sr))
+    frame_step = int(round(audioprocessor.FRAME_STRIDE * sr))
+    num_frames = int(np.ceil(float(np.abs(len(emphasized_signal) - frame_length)) / frame_step))
+    pad_signal = np.append(emphasized_signal, np.zeros(num_frames * frame_step + frame_length - len(sig)))
+    indices = np.tile(np.arange(0, frame_length),
+                      (num_frames, 1)) + np.tile(np.arange(0, num_frames * frame_step, frame_step),
+                                                 (frame_length, 1)).T
+    frames = pad_signal[indices.astype(np.int32, copy=False)]
+    frames *= np.hamming(frame_length)
+    pow_frames = ((1.0 / 512) * (np.absolute(np.fft.rfft(frames, 512)) ** 2))
+    filter_banks = np.dot(pow_frames, reference_mel_filterbank(sr, 512, 40).T)
+    filter_banks = np.where(filter_banks == 0, np.finfo(float).eps, filter_banks)
+    return 10 * np.log10(filter_banks)
+
+
+class TestAudioProcessor(unittest.TestCase):
+    def test_log_mel_energies_match_reference(self):
+        # At 16 kHz a frame is shorter than the FFT (zero padded), at 22.05 kHz it is longer (cropped)
+        for sr in [16000, 22050]:
+            sig = np.random.RandomState(42).uniform(-0.5, 0.5, sr * 2).astype(np.float32)
+            expected = reference_log_mel_energies(sig, sr)
+            feat_vec, _ = audioprocessor.AudioProcessor(None, "fbank").process_signal(sig, sr)
+            expected -= (np.mean(expected, axis=0) + 1e-8)
+            np.testing.assert_allclose(feat_vec[:, :40], expected, rtol=1e-10, atol=1e-10)
+
+    def test_frames_are_a_view(self):
+        signal = np.arange(100, dtype=np.float64)
+        frames = audioprocessor._get_frames(signal, 4, 25, 10)
+        self.assertTrue(np.shares_memory(frames, signal))
+        np.testing.assert_array_equal(frames[2], signal[20:45])
+
+    def test_mel_filterbank_matches_reference(self):
+        for sr in [8000, 16000, 22050, 44100]:
+            for nfilt in [26, 40, 128]:
+                np.testing.assert_array_equal(audioprocessor._get_mel_filterbank(sr, 512, nfilt),
+                                              reference_mel_filterbank(sr, 512, nfilt))
+
+    def test_cached_values_are_read_only(self):
+        fbank = audioprocessor._get_mel_filterbank(22050, 512, 40)
+        self.assertIs(fbank, audioprocessor._get_mel_filterbank(22050, 512, 40))
+        with self.assertRaises(ValueError):
+            fbank[0, 0] = 1.0
+        with self.assertRaises(ValueError):
+            audioprocessor._get_hamming_window(551)[0] = 1.0
+
+    def test_fbank_filterbank_is_cached(self):
+        audioprocessor._get_mel_filterbank.cache_clear()
+        fbank = audioprocessor._get_mel_filterbank(22050, 512, 40)
+        self.assertIs(audioprocessor._get_mel_filterbank(22050, 512, 40), fbank)
+        np.testing.assert_array_equal(fbank, reference_mel_filterbank(22050, 512, 40))
+
+        # The features are the same with the filterbank rebuilt by loops on each call (as before the cache)
+        signal = np.random.RandomState(42).uniform(-0.5, 0.5, 22050).astype(np.float32)
+        audio_processor = audioprocessor.AudioProcessor(None, "fbank")
+        with mock.patch.object(audioprocessor, "_get_mel_filterbank", reference_mel_filterbank):
+            uncached_features, _ = audio_processor.process_signal(signal, 22050)
+        cached_features, _ = audio_processor.process_signal(signal, 22050)
+        np.testing.assert_array_equal(cached_features, uncached_features)
+
+
+class TestLoadAudio(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.audio_file = os.path.join(cls.directory, "audio.wav")
+        cls.signal = (np.random.RandomState(42).uniform(-0.5, 0.5, 16000 * 2) * 32767).astype(np.int16)
+        with wave.open(cls.audio_file, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(cls.signal.tobytes())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_native_rate(self):
+        sig, sr = audioprocessor.load_audio(self.audio_file)
+        self.assertEqual(sr, 16000)
+        np.testing.assert_allclose(sig, self.signal / 32768.0, atol=1e-6)
+
+    def test_resampling(self):
+        sig, sr = audioprocessor.load_audio(self.audio_file, 8000)
+        self.assertEqual(sr, 8000)
+        self.assertEqual(len(sig), 8000 * 2)
+
+    def test_segment(self):
+        sig, sr = audioprocessor.load_audio(self.audio_file, offset=0.5, duration=1.0)
+        np.testing.assert_allclose(sig, self.signal[8000:24000] / 32768.0, atol=1e-6)
+
+    def write_sphere(self, file_name, signal, byte_format):
+        header = "NIST_1A\n   1024\nsample_rate -i 16000\nchannel_count -i 1\nsample_n_bytes -i 2\n" \
+                 "sample_count -i {0}\nsample_byte_format -s2 {1}\nsample_coding -s3 pcm\nend_head\n"\
+            .format(len(signal), byte_format)
+        with open(file_name, "wb") as f:
+            f.write(header.encode("ascii").ljust(1024, b" "))
+            f.write(signal.astype(">i2" if byte_format == "10" else "<i2").tobytes())
+
+    def test_sphere_segment(self):
+        for byte_format in ["01", "10"]:
+            sph_file = os.path.join(self.directory, "talk_{0}.sph".format(byte_format))
+            self.write_sphere(sph_file, self.signal, byte_format)
+            sig, sr = audioprocessor.load_audio(audioprocessor.get_segment_reference(sph_file, 0.5, 1.5))
+            self.assertEqual(sr, 16000)
+            np.testing.assert_allclose(sig, self.signal[8000:24000] / 32768.0, atol=1e-6)
+            # A segment can not be read after the end of the file
+            sig, _ = audioprocessor.load_audio(sph_file, offset=1.5, duration=10)
+            self.assertEqual(len(sig), 8000)
+
+    def test_sphere_header_is_parsed_once(self):
+        sph_file = os.path.join(self.directory, "cached_talk.sph")
+        self.write_sphere(sph_file, self.signal, "01")
+        audioprocessor.load_audio(audioprocessor.get_segment_reference(sph_file, 0, 0.5))
+        misses = audioprocessor.read_sphere_header.cache_info().misses
+        audioprocessor.load_audio(audioprocessor.get_segment_reference(sph_file, 0.5, 1))
+        self.assertEqual(audioprocessor.read_sphere_header.cache_info().misses, misses)
+
+    def test_segment_reference(self):
+        self.assertEqual(audioprocessor.parse_segment_reference("a/b.sph#17.82-28.81"),
+                         ("a/b.sph", 17.82, 28.81 - 17.82))
+        self.assertEqual(audioprocessor.parse_segment_reference("a/b#c.wav"), ("a/b#c.wav", 0.0, None))
+
+    def test_feature_length_does_not_depend_on_rate(self):
+        native_length = audioprocessor.AudioProcessor(None, "fbank").process_audio_file(self.audio_file)[1]
+        resampled_length = audioprocessor.AudioProcessor(None, "fbank", 22050).process_audio_file(self.audio_file)[1]
+        self.assertLessEqual(abs(native_length - resampled_length), 1)
+
+    def test_default_worker_count_is_bounded(self):
+        self.assertEqual(audioprocessor.get_worker_count(6), 6)
+        with mock.patch("os.cpu_count", return_value=64):
+            self.assertEqual(audioprocessor.get_worker_count(), audioprocessor.MAX_DEFAULT_WORKERS)
+        with mock.patch("os.cpu_count", return_value=None):
+            self.assertEqual(audioprocessor.get_worker_count(), 1)
+
+    def test_extract_file_features_in_worker_pool(self):
+        missing_file = os.path.join(self.directory, "missing.wav")
+        with audioprocessor.create_worker_pool(1) as pool:
+            results = pool.starmap(audioprocessor.extract_file_features,
+                                   [(self.audio_file, 50, "fbank"), (missing_file, 50, "fbank")])
+        expected_feat_vec, expected_length = audioprocessor.AudioProcessor(50, "fbank").process_audio_file(
+            self.audio_file)
+        file, feat_vec, length = results[0]
+        self.assertEqual((file, length), (self.audio_file, expected_length))
+        np.testing.assert_array_equal(feat_vec, expected_feat_vec)
+        # A file which can not be processed is reported instead of raising
+        self.assertEqual(results[1], (missing_file, None, 0))
+
+
+class TestStreamingAudioProcessor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sample_rate = 22050
+        rng = np.random.RandomState(42)
+        # Modulated noise, so that the features vary over time
+        length = int(cls.sample_rate * 1.3)
+        cls.signal = (rng.uniform(-0.5, 0.5, length) * np.sin(np.arange(length) / 300.0)).astype(np.float32)
+
+    def stream(self, feature_type, chunk_size):
+        streaming_processor = audioprocessor.StreamingAudioProcessor(self.sample_rate, feature_type)
+        feat_vecs = []
+        for i in range(0, len(self.signal), chunk_size):
+            feat_vecs.append(streaming_processor.process_chunk(self.signal[i:i + chunk_size]))
+        feat_vecs.append(streaming_processor.flush())
+        return np.vstack(feat_vecs)
+
+    def test_fbank_matches_batch_extraction(self):
+        expected, expected_length = audioprocessor.AudioProcessor(None, "fbank").process_signal(self.signal,
+                                                                                                 self.sample_rate)
+        for chunk_size in [37, 1000, len(self.signal)]:
+            feat_vec = self.stream("fbank", chunk_size)
+            self.assertEqual(feat_vec.shape, (expected_length, 120))
+            # Deltas and double deltas do not depend on the mean normalization
+            np.testing.assert_allclose(feat_vec[:, 40:], expected[:, 40:], atol=1e-6)
+            # The running mean used for the last frame is the mean of the whole signal
+            np.testing.assert_allclose(feat_vec[-1], expected[-1], atol=1e-6)
+            # Before that, the normalization only differs by the difference between the running and global means
+            offsets = feat_vec[:, :40] - expected[:, :40]
+            self.assertLess(np.max(np.abs(offsets[-20:])), 1.0)
+
+    def test_mfcc_matches_batch_extraction(self):
+        expected, expected_length = audioprocessor.AudioProcessor(None, "mfcc").process_signal(self.signal,
+                                                                                                self.sample_rate)
+        for chunk_size in [37, 1000, len(self.signal)]:
+            feat_vec = self.stream("mfcc", chunk_size)
+            self.assertEqual(feat_vec.shape, (expected_length, 20))
+            np.testing.assert_allclose(feat_vec, expected, atol=1e-3)
+
+    def test_fbank_frames_are_produced_with_bounded_delay(self):
+        streaming_processor = audioprocessor.StreamingAudioProcessor(self.sample_rate, "fbank")
+        frame_step = streaming_processor.frame_step
+        produced = 0
+        for i in range(0, len(self.signal), frame_step):
+            produced += len(streaming_processor.process_chunk(self.signal[i:i + frame_step]))
+            received_frames = (i + frame_step) // frame_step
+            if received_frames > 20:
+                # Only the frames waiting for their deltas (and the frame being filled) are held back
+                self.assertGreaterEqual(produced, received_frames - audioprocessor.FBANK_LOOKAHEAD_FRAMES - 3)
+        # The buffers do not grow with the length of the stream
+        self.assertLessEqual(len(streaming_processor._log_mel), 2 * audioprocessor.FBANK_LOOKAHEAD_FRAMES + 1)
+
+    def test_reset(self):
+        streaming_processor = audioprocessor.StreamingAudioProcessor(self.sample_rate, "fbank")
+        streaming_processor.process_chunk(self.signal)
+        first = streaming_processor.flush()
+        with self.assertRaises(ValueError):
+            streaming_processor.process_chunk(self.signal)
+        streaming_processor.reset()
+        streaming_processor.process_chunk(self.signal)
+        np.testing.assert_array_equal(streaming_processor.flush(), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
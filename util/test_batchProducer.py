@@ -0,0 +1,132 @@
+# coding=utf-8
+import unittest
+import os
+import shutil
+import wave
+import numpy as np
+import util.audioprocessor as audioprocessor
+import util.dataprocessor as dataprocessor
+import util.batchproducer as batchproducer
+from models.SpeechRecognizer import ENGLISH_CHAR_MAP
+
+
+class TestBatchProducer(unittest.TestCase):
+    directory = ""
+    input_set = []
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a temp dir for testing purpose
+        cwd = os.getcwd()
+        cls.directory = cwd + "/test_batch_producer/"
+        if not os.path.exists(cls.directory):
+            os.makedirs(cls.directory)
+        else:
+            # Test self.directory already exist, throw an error
+            raise Exception('test_batch_producer already exists')
+        # Create some short wav files with random noise
+        rng = np.random.RandomState(42)
+        cls.input_set = []
+        for i, duration in enumerate([0.5, 1.2, 0.8, 2.5, 0.6]):
+            audio_file = cls.directory + "audio_{0}.wav".format(i)
+            signal = (rng.uniform(-0.5, 0.5, int(16000 * duration)) * 32767).astype(np.int16)
+            with wave.open(audio_file, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(16000)
+                f.writeframes(signal.tobytes())
+            cls.input_set.append([audio_file, "test number {0}".format(i), duration])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def check_batches(self, batches, input_set, max_input_seq_length):
+        audio_processor = audioprocessor.AudioProcessor(max_input_seq_length, "fbank")
+        expected = {}
+        for audio_file, label, _ in input_set:
+            feat_vec, length = audio_processor.process_audio_file(audio_file)
+            expected[length] = (feat_vec, dataprocessor.DataProcessor.get_str_labels(ENGLISH_CHAR_MAP, label))
+        seen = 0
+        for feat_vecs, lengths, label_batch in batches:
+            self.assertEqual(feat_vecs.shape, (len(lengths), np.max(lengths), audio_processor.feature_size))
+            for i, length in enumerate(lengths):
+                feat_vec, label = expected[length]
+                np.testing.assert_allclose(feat_vecs[i, :length], feat_vec, rtol=1e-5, atol=1e-5)
+                # Padded with zeros
+                self.assertFalse(np.any(feat_vecs[i, length:]))
+                self.assertEqual(list(label_batch[i, :len(label)]), label)
+                self.assertFalse(np.any(label_batch[i, len(label):]))
+                seen += 1
+        self.assertEqual(seen, len(input_set))
+
+    def test_batches_match_the_audio_processor(self):
+        producer = batchproducer.BatchProducer(self.input_set, 2, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=2)
+        batches = list(producer())
+        self.assertEqual(len(batches), 3)
+        self.check_batches(batches, self.input_set, 1000)
+        self.assertEqual(producer.batch_count, 3)
+        self.assertGreaterEqual(producer.wait_time, 0.0)
+        self.assertLessEqual(producer.wait_time, producer.run_time)
+
+    def test_inputs_are_truncated(self):
+        producer = batchproducer.BatchProducer(self.input_set, 5, 100, "fbank", ENGLISH_CHAR_MAP, num_workers=2)
+        batches = list(producer())
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(np.max(batches[0][1]), 100)
+
+    def test_single_slot_back_pressure(self):
+        # The workers wait for the only slot to be released between batches
+        producer = batchproducer.BatchProducer(self.input_set, 1, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=3,
+                                               num_slots=1)
+        self.check_batches(list(producer()), self.input_set, 1000)
+
+    def test_bucketing(self):
+        producer = batchproducer.BatchProducer(self.input_set, 2, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=1,
+                                               bucket_boundaries=[100])
+        batches = producer.get_batches()
+        # Inputs below 1 s are in the first bucket, the others in the second
+        self.assertEqual([[os.path.basename(item[0]) for item in batch] for batch in batches],
+                         [["audio_0.wav", "audio_2.wav"], ["audio_1.wav", "audio_3.wav"], ["audio_4.wav"]])
+
+    def test_interrupted_run(self):
+        producer = batchproducer.BatchProducer(self.input_set, 1, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=2,
+                                               num_slots=1)
+        generator = producer()
+        next(generator)
+        generator.close()
+        # A new run produces the whole dataset again
+        self.check_batches(list(producer()), self.input_set, 1000)
+
+    def test_batches_keep_the_dataset_order(self):
+        # The batches completed out of order by the workers are yielded in the dataset order
+        producer = batchproducer.BatchProducer(self.input_set, 1, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=3,
+                                               num_slots=2)
+        audio_processor = audioprocessor.AudioProcessor(1000, "fbank")
+        expected_lengths = [audio_processor.process_audio_file(item[0])[1] for item in self.input_set]
+        self.assertEqual([int(lengths[0]) for _, lengths, _ in producer()], expected_lengths)
+
+    def test_default_slots_are_capped(self):
+        producer = batchproducer.BatchProducer(self.input_set, 2, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=32)
+        self.assertEqual(producer.num_slots, batchproducer.MAX_SLOTS)
+
+    def test_dead_worker_raises(self):
+        # A label which can not be transcoded makes the worker exit outside of the per file error handling
+        input_set = self.input_set[:2] + [[self.input_set[2][0], None, 1.0]]
+        producer = batchproducer.BatchProducer(input_set, 1, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=1)
+        check_interval = batchproducer.WORKER_CHECK_INTERVAL
+        batchproducer.WORKER_CHECK_INTERVAL = 0.1
+        try:
+            with self.assertRaises(RuntimeError):
+                list(producer())
+        finally:
+            batchproducer.WORKER_CHECK_INTERVAL = check_interval
+
+    def test_unreadable_files_are_skipped(self):
+        input_set = self.input_set[:2] + [[self.directory + "missing.wav", "missing file", 1.0]]
+        producer = batchproducer.BatchProducer(input_set, 2, 1000, "fbank", ENGLISH_CHAR_MAP, num_workers=2)
+        self.check_batches(list(producer()), self.input_set[:2], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# coding=utf-8
+import unittest
+import itertools
+import numpy as np
+import util.ctcdecoder as ctcdecoder
+
+
+def best_labeling(log_probs, blank_label):
+    # Sum the probabilities of every alignment of each labeling and return the most probable labeling
+    labelings = {}
+    for alignment in itertools.product(range(log_probs.shape[1]), repeat=log_probs.shape[0]):
+        labeling = tuple(label for index, label in enumerate(alignment)
+                         if label != blank_label and (index == 0 or label != alignment[index - 1]))
+        probability = np.exp(sum(log_probs[t, label] for t, label in enumerate(alignment)))
+        labelings[labeling] = labelings.get(labeling, 0.0) + probability
+    return list(max(labelings, key=labelings.get))
+
+
+class TestCtcDecoder(unittest.TestCase):
+    def test_greedy_decode(self):
+        # Labels 0 to 2, the blank is 3
+        best_paths = [[0, 0, 3, 0, 1, 1, 3, 3, 2],
+                      [3, 2, 2, 2, 3, 1, 0, 0, 0]]
+        logits = np.zeros((9, 2, 4))
+        for index, best_path in enumerate(best_paths):
+            logits[np.arange(9), index, best_path] = 1.0
+        self.assertEqual(ctcdecoder.greedy_decode(logits, [9, 9]), [[0, 0, 1, 2], [2, 1, 0]])
+        # The padding frames are ignored
+        self.assertEqual(ctcdecoder.greedy_decode(logits, [5, 2]), [[0, 0, 1], [2]])
+
+    def test_beam_search_sums_the_alignments(self):
+        # The best path is a blank on each frame but "0" has a higher probability over all its alignments
+        log_probs = np.log(np.array([[0.4, 0.0, 0.6], [0.4, 0.0, 0.6]]) + 1e-12)
+        logits = log_probs[:, None, :]
+        self.assertEqual(ctcdecoder.greedy_decode(logits, [2]), [[]])
+        self.assertEqual(ctcdecoder.beam_search_decode(logits, [2], beam_width=10), [[0]])
+
+    def test_beam_search_matches_the_exhaustive_search(self):
+        rng = np.random.RandomState(42)
+        for _ in range(30):
+            logits = rng.normal(0, 2, (5, 1, 4))
+            expected = best_labeling(ctcdecoder.log_softmax(logits[:, 0, :]), 3)
+            self.assertEqual(ctcdecoder.beam_search_decode(logits, [5], beam_width=64), [expected])
+
+    def test_beam_search_batch(self):
+        rng = np.random.RandomState(0)
+        logits = rng.normal(0, 3, (20, 3, 6))
+        seq_lengths = [20, 12, 0]
+        decoded = ctcdecoder.beam_search_decode(logits, seq_lengths, beam_width=16)
+        self.assertEqual(decoded[2], [])
+        for index, seq_length in enumerate(seq_lengths):
+            self.assertEqual(decoded[index], ctcdecoder.beam_search_decode(logits[:seq_length, index:index + 1],
+                                                                           [seq_length], beam_width=16)[0])
+        # A narrow beam still returns a valid labeling
+        narrow = ctcdecoder.beam_search_decode(logits, seq_lengths, beam_width=1)
+        self.assertTrue(all(0 <= label < 5 for labels in narrow for label in labels))
+        with self.assertRaises(ValueError):
+            ctcdecoder.beam_search_decode(logits, seq_lengths, beam_width=0)
+
+    def test_pruning_on_peaky_outputs(self):
+        # With one label clearly winning on each frame the pruned search gives the same result as the full search
+        rng = np.random.RandomState(1)
+        best_path = rng.randint(0, 6, 50)
+        logits = rng.normal(0, 0.5, (50, 1, 6))
+        logits[np.arange(50), 0, best_path] += 8.0
+        full = ctcdecoder.beam_search_decode(logits, [50], beam_width=20)
+        pruned = ctcdecoder.beam_search_decode(logits, [50], beam_width=20, prune_threshold=0.001)
+        self.assertEqual(pruned, full)
+        self.assertEqual(full, ctcdecoder.greedy_decode(logits, [50]))
+
+    def test_to_dense(self):
+        dense = ctcdecoder.to_dense([[1, 2, 3], [], [4]], 29)
+        np.testing.assert_array_equal(dense, [[1, 2, 3], [29, 29, 29], [4, 29, 29]])
+        self.assertEqual(ctcdecoder.to_dense([[], []], 29).shape, (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,9 @@
 import unittest
 import os
 import shutil
+import tempfile
+import wave
+from unittest import mock
 import util.dataprocessor as dataprocessor
 from models.SpeechRecognizer import ENGLISH_CHAR_MAP
 import numpy as np
@@ -102,6 +105,12 @@ class TestDataProcessor(unittest.TestCase):
         data_type = dataprocessor.DataProcessor.get_type(self.directory + "TEDLIUM")
         self.assertEqual(data_type, "TEDLIUM")
 
+    def test_dataset_directory_is_scanned_once(self):
+        with mock.patch("os.walk", wraps=os.walk) as walk:
+            data_processor = dataprocessor.DataProcessor(self.directory + "TEDLIUM")
+        self.assertEqual(len(data_processor.get_dataset()), 1)
+        self.assertEqual(walk.call_count, 1)
+
     def test_get_data_librispeech(self):
         data_processor = dataprocessor.DataProcessor(self.directory + "Libri")
         test_set = data_processor.get_dataset()
@@ -129,6 +138,85 @@ class TestDataProcessor(unittest.TestCase):
                                 "alright thank you and goodbye", None]
                                ])
 
+    def test_get_data_tedlium(self):
+        data_processor = dataprocessor.DataProcessor(self.directory + "TEDLIUM")
+        test_set = data_processor.get_dataset()
+        self.assertEqual(len(test_set), 1)
+        # The segment is referenced in the talk's file, with a duration computed from the segment bounds
+        self.assertEqual(test_set[0][0],
+                         os.path.normpath(self.directory + "TEDLIUM/test/sph/AimeeMullins_2009P.sph") + "#17.82-28.81")
+        self.assertEqual(test_set[0][1], dataprocessor.DataProcessor.clean_label("i 'd like to share ..."))
+        self.assertAlmostEqual(test_set[0][2], 10.99)
+
+    @staticmethod
+    def write_wav(file_name, duration):
+        with wave.open(file_name, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(np.zeros(int(16000 * duration), dtype=np.int16).tobytes())
+
+    def test_manifest_only_probes_new_or_modified_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            data_dir = os.path.join(directory, "Vystadial_2013", "data_voip_en", "train")
+            os.makedirs(data_dir)
+            for i in range(3):
+                self.write_wav(os.path.join(data_dir, "file_{0}.wav".format(i)), 1.0 + i)
+                with open(os.path.join(data_dir, "file_{0}.wav.trn".format(i)), "w") as f:
+                    f.write("HELLO WORLD\n")
+            manifest = os.path.join(directory, "manifest.jsonl")
+
+            def read_manifest():
+                with open(manifest) as f:
+                    return f.readlines()
+
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"), file_cache=manifest)
+            self.assertEqual(sorted([item[2] for item in data_processor.get_dataset()]), [1.0, 2.0, 3.0])
+            self.assertEqual(len(read_manifest()), 3)
+
+            # Nothing changed : every duration comes from the manifest
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"), file_cache=manifest)
+            self.assertEqual(sorted([item[2] for item in data_processor.get_dataset()]), [1.0, 2.0, 3.0])
+            self.assertEqual(len(read_manifest()), 3)
+
+            # Only the modified file is probed again
+            self.write_wav(os.path.join(data_dir, "file_0.wav"), 4.0)
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"), file_cache=manifest)
+            self.assertEqual(sorted([item[2] for item in data_processor.get_dataset()]), [2.0, 3.0, 4.0])
+            self.assertEqual(len(read_manifest()), 4)
+
+            # A cache file from a previous version is ignored
+            with open(manifest, "wb") as f:
+                f.write(b"\x80\x03]q\x00.")
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"), file_cache=manifest)
+            self.assertEqual(sorted([item[2] for item in data_processor.get_dataset()]), [2.0, 3.0, 4.0])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_too_long_samples_are_filtered(self):
+        directory = tempfile.mkdtemp()
+        try:
+            data_dir = os.path.join(directory, "Vystadial_2013", "data_voip_en", "train")
+            os.makedirs(data_dir)
+            for i, (duration, text) in enumerate([(1.0, "HELLO WORLD"), (3.0, "HELLO WORLD"),
+                                                  (1.0, "HELLO WORLD " * 10), (0.5, "HELLO WORLD " * 6)]):
+                self.write_wav(os.path.join(data_dir, "file_{0}.wav".format(i)), duration)
+                with open(os.path.join(data_dir, "file_{0}.wav.trn".format(i)), "w") as f:
+                    f.write(text + "\n")
+
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"),
+                                                         max_input_seq_length=200, max_target_seq_length=80,
+                                                         char_map=ENGLISH_CHAR_MAP)
+            # Too long audio (file_1), too long label (file_2) and label longer than the audio (file_3) are removed
+            self.assertEqual([os.path.basename(item[0]) for item in data_processor.get_dataset()], ["file_0.wav"])
+
+            # No filtering on the length without the limits
+            data_processor = dataprocessor.DataProcessor(os.path.join(directory, "Vystadial_2013"))
+            self.assertEqual(len(data_processor.get_dataset()), 4)
+        finally:
+            shutil.rmtree(directory)
+
     def test_get_str_labels_and_reverse(self):
         text = "What ! I'm not looking for... I'll do it..."
         cleaned_str = dataprocessor.DataProcessor.clean_label(text)
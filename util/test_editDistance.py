@@ -0,0 +1,62 @@
+# coding=utf-8
+import unittest
+import numpy as np
+import util.editdistance as editdistance
+
+
+def reference_edit_distance(reference, hypothesis):
+    # Cell by cell Levenshtein distance
+    d = [[0] * (len(hypothesis) + 1) for _ in range(len(reference) + 1)]
+    for i in range(len(reference) + 1):
+        d[i][0] = i
+    for j in range(len(hypothesis) + 1):
+        d[0][j] = j
+    for i in range(1, len(reference) + 1):
+        for j in range(1, len(hypothesis) + 1):
+            if reference[i - 1] == hypothesis[j - 1]:
+                d[i][j] = d[i - 1][j - 1]
+            else:
+                d[i][j] = min(d[i - 1][j - 1], d[i][j - 1], d[i - 1][j]) + 1
+    return d[-1][-1]
+
+
+class TestEditDistance(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(editdistance.edit_distance("who is there".split(), "is there".split()), (1, 0, 0, 1))
+        self.assertEqual(editdistance.edit_distance("who is there".split(), []), (3, 0, 0, 3))
+        self.assertEqual(editdistance.edit_distance([], "who is there".split()), (3, 0, 3, 0))
+        self.assertEqual(editdistance.edit_distance("whoisthere", "whoithre"), (2, 0, 0, 2))
+        self.assertEqual(editdistance.edit_distance("kitten", "sitting"), (3, 2, 1, 0))
+        self.assertEqual(editdistance.edit_distance("", ""), (0, 0, 0, 0))
+
+    def test_matches_the_reference_implementation(self):
+        rng = np.random.RandomState(42)
+        for _ in range(500):
+            reference = list(rng.choice(list("abc"), rng.randint(0, 15)))
+            hypothesis = list(rng.choice(list("abcd"), rng.randint(0, 15)))
+            errors, substitutions, insertions, deletions = editdistance.edit_distance(reference, hypothesis)
+            self.assertEqual(errors, reference_edit_distance(reference, hypothesis))
+            self.assertEqual(errors, substitutions + insertions + deletions)
+            self.assertEqual(len(reference) - deletions + insertions, len(hypothesis))
+
+    def test_no_overflow_on_long_sequences(self):
+        # The previous uint8 implementation wrapped around above 255 words
+        reference = ["word"] * 300
+        self.assertEqual(editdistance.edit_distance(reference, [])[0], 300)
+        self.assertEqual(editdistance.edit_distance(reference, ["other"] * 300), (300, 300, 0, 0))
+
+    def test_batch(self):
+        references = ["who is there", "the quick brown fox", ""]
+        hypotheses = ["is there", "the quack brown fox jumps", "hello"]
+        counts, nb_words = editdistance.word_errors(references, hypotheses)
+        np.testing.assert_array_equal(counts, [[1, 0, 0, 1], [2, 1, 1, 0], [1, 0, 1, 0]])
+        np.testing.assert_array_equal(nb_words, [3, 4, 0])
+        counts, nb_chars = editdistance.char_errors(references, hypotheses)
+        np.testing.assert_array_equal(counts[:, 0], [3, 1 + 5, 5])
+        np.testing.assert_array_equal(nb_chars, [10, 16, 0])
+        with self.assertRaises(ValueError):
+            editdistance.batch_edit_distance(references, hypotheses[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
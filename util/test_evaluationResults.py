@@ -0,0 +1,89 @@
+# coding=utf-8
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import util.evaluationresults as evaluationresults
+
+
+class TestEvaluationResults(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shards_split_the_dataset(self):
+        dataset = [["file_{0}.wav".format(i), "label", 1.0] for i in [3, 1, 4, 0, 2]]
+        shards = [evaluationresults.get_shard(dataset, i, 2) for i in range(2)]
+        self.assertEqual([item[0] for item in shards[0]], ["file_0.wav", "file_2.wav", "file_4.wav"])
+        self.assertEqual([item[0] for item in shards[1]], ["file_1.wav", "file_3.wav"])
+        with self.assertRaises(ValueError):
+            evaluationresults.get_shard(dataset, 2, 2)
+
+    def test_parse_shard(self):
+        self.assertEqual(evaluationresults.parse_shard("1/4"), (1, 4))
+        with self.assertRaises(ValueError):
+            evaluationresults.parse_shard("1-4")
+
+    def write_results(self, name, records, truncated_line=False):
+        result_file = os.path.join(self.directory, name)
+        with open(result_file, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            if truncated_line:
+                f.write('{"path": "trunc')
+        return result_file
+
+    def test_merge(self):
+        # "a b c" -> "a x c" (1 substitution) and "a b" -> "a b d" (1 insertion)
+        first = evaluationresults.get_record("1.wav", "a b c", "a x c", [1, 1, 0, 0, 3], [1, 1, 0, 0, 3], 0.1)
+        second = evaluationresults.get_record("2.wav", "a b", "a b d", [1, 0, 1, 0, 2], [1, 0, 1, 0, 2], 0.1)
+        result_files = [self.write_results("shard_0.jsonl", [first], truncated_line=True),
+                        self.write_results("shard_1.jsonl", [second, first]),
+                        os.path.join(self.directory, "missing.jsonl")]
+
+        # Each utterance is counted once and the truncated line is ignored
+        records = evaluationresults.read_results(result_files)
+        self.assertEqual(list(records.keys()), ["1.wav", "2.wav"])
+        accumulator = evaluationresults.ErrorRateAccumulator()
+        for record in records.values():
+            accumulator.add_record(record)
+        error_rates = accumulator.get_error_rates()
+        self.assertEqual(error_rates["utterances"], 2)
+        self.assertAlmostEqual(error_rates["corpus_wer"], 100.0 * 2 / 5)
+        self.assertAlmostEqual(error_rates["mean_wer"], 100.0 * (1 / 3 + 1 / 2) / 2)
+        self.assertAlmostEqual(error_rates["corpus_cer"], 100.0 * 2 / 5)
+        self.assertEqual((error_rates["word_substitutions"], error_rates["word_insertions"],
+                          error_rates["word_deletions"]), (1, 1, 0))
+        # No duration in the records
+        self.assertIsNone(error_rates["real_time_factor"])
+
+    def test_merged_accumulators_match_a_single_one(self):
+        counts = [([2, 1, 0, 1, 4], [3, 1, 1, 1, 15], 0.2, 2.0),
+                  ([0, 0, 0, 0, 3], [0, 0, 0, 0, 12], 0.1, 1.5),
+                  ([1, 0, 1, 0, 0], [4, 0, 4, 0, 0], 0.1, 0.5),
+                  ([5, 3, 0, 2, 6], [9, 5, 1, 3, 25], 0.3, 3.0)]
+        single = evaluationresults.ErrorRateAccumulator()
+        shards = [evaluationresults.ErrorRateAccumulator() for _ in range(2)]
+        for index, (word_counts, char_counts, decode_time, duration) in enumerate(counts):
+            single.add(word_counts, char_counts, decode_time, duration)
+            shards[index % 2].add(word_counts, char_counts, decode_time, duration)
+        merged = evaluationresults.ErrorRateAccumulator()
+        for shard in shards:
+            merged.merge(shard)
+        self.assertEqual(merged.counts, single.counts)
+        merged_error_rates = merged.get_error_rates()
+        for key, value in single.get_error_rates().items():
+            self.assertAlmostEqual(merged_error_rates[key], value)
+
+        error_rates = single.get_error_rates()
+        self.assertAlmostEqual(error_rates["corpus_wer"], 100.0 * 8 / 13)
+        # The utterance with an empty reference is not part of the mean
+        self.assertAlmostEqual(error_rates["mean_wer"], 100.0 * (2 / 4 + 0 / 3 + 5 / 6) / 3)
+        self.assertAlmostEqual(error_rates["real_time_factor"], 0.7 / 7.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# coding=utf-8
+import unittest
+import os
+import shutil
+import wave
+import numpy as np
+import util.audioprocessor as audioprocessor
+import util.featurestore as featurestore
+
+
+class TestFeatureStore(unittest.TestCase):
+    directory = ""
+    audio_files = []
+
+    @classmethod
+    def setUpClass(cls):
+        # Create a temp dir for testing purpose
+        cwd = os.getcwd()
+        cls.directory = cwd + "/test_feature_store/"
+        if not os.path.exists(cls.directory):
+            os.makedirs(cls.directory)
+        else:
+            # Test self.directory already exist, throw an error
+            raise Exception('test_feature_store already exists')
+        # Create some short wav files with random noise
+        rng = np.random.RandomState(42)
+        cls.audio_files = []
+        for i, duration in enumerate([0.5, 1.2, 0.8]):
+            audio_file = cls.directory + "audio_{0}.wav".format(i)
+            signal = (rng.uniform(-0.5, 0.5, int(16000 * duration)) * 32767).astype(np.int16)
+            with wave.open(audio_file, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(16000)
+                f.writeframes(signal.tobytes())
+            cls.audio_files.append(audio_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_extract_and_read(self):
+        store = featurestore.FeatureStore(self.directory + "store", "fbank")
+        added = store.extract(self.audio_files[:2], processes=2)
+        self.assertEqual(added, 2)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get_missing_files(self.audio_files), [self.audio_files[2]])
+
+        # A second extraction only add the missing files
+        store = featurestore.FeatureStore(self.directory + "store", "fbank")
+        added = store.extract(self.audio_files, processes=2)
+        self.assertEqual(added, 1)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.get_missing_files(self.audio_files), [])
+
+        audio_processor = audioprocessor.AudioProcessor(50, "fbank")
+        for audio_file in self.audio_files:
+            expected_feat_vec, expected_length = audio_processor.process_audio_file(audio_file)
+            feat_vec, length = store.read(audio_file, 50)
+            self.assertEqual(length, expected_length)
+            self.assertEqual(feat_vec.dtype, np.float32)
+            np.testing.assert_allclose(feat_vec, expected_feat_vec, rtol=1e-5, atol=1e-4)
+
+    def test_read_batch(self):
+        store = featurestore.FeatureStore(self.directory + "batch_store", "fbank")
+        store.extract(self.audio_files, processes=2)
+        offsets = [store.index[audio_file][0] for audio_file in self.audio_files]
+        lengths = [store.index[audio_file][1] for audio_file in self.audio_files]
+        feat_vecs, feat_vec_lengths = store.read_batch(offsets, lengths, 60)
+        self.assertEqual(feat_vecs.shape, (3, 60, 120))
+        np.testing.assert_array_equal(feat_vec_lengths, lengths)
+        for i, audio_file in enumerate(self.audio_files):
+            feat_vec, length = store.read(audio_file)
+            read_length = min(length, 60)
+            np.testing.assert_array_equal(feat_vecs[i, :read_length], feat_vec[:read_length])
+            # The end of the batch is zero padded
+            np.testing.assert_array_equal(feat_vecs[i, read_length:], 0)
+
+    def test_store_name_depends_on_signal_processing(self):
+        self.assertNotEqual(featurestore.FeatureStore.get_store_name("fbank"),
+                            featurestore.FeatureStore.get_store_name("mfcc"))
+
+    def test_store_name_depends_on_sample_rate(self):
+        self.assertNotEqual(featurestore.FeatureStore.get_store_name("fbank"),
+                            featurestore.FeatureStore.get_store_name("fbank", 16000))
+
+
+if __name__ == '__main__':
+    unittest.main()
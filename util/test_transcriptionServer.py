@@ -0,0 +1,194 @@
+# coding=utf-8
+import unittest
+import io
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+import wave
+import urllib.parse
+import urllib.request
+import urllib.error
+import numpy as np
+import util.audioprocessor as audioprocessor
+import util.transcriptionserver as transcriptionserver
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_concurrent_items_are_batched(self):
+        batch_sizes = []
+
+        def process_batch(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = transcriptionserver.MicroBatcher(process_batch, max_batch_size=4, max_wait=0.5)
+        results = [None] * 8
+
+        def submit(i):
+            results[i] = batcher.submit(i)
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.stop()
+
+        # Each request gets its own result, and no batch is bigger than max_batch_size
+        self.assertEqual(results, [i * 2 for i in range(8)])
+        self.assertEqual(sum(batch_sizes), 8)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(len(batch_sizes), 8)
+
+    def test_single_item_waits_at_most_max_wait(self):
+        batcher = transcriptionserver.MicroBatcher(lambda items: items, max_batch_size=10, max_wait=0.1)
+        start_time = time.time()
+        self.assertEqual(batcher.submit("a"), "a")
+        self.assertLess(time.time() - start_time, 1.0)
+        batcher.stop()
+
+    def test_errors_are_raised_to_the_caller(self):
+        def process_batch(items):
+            raise RuntimeError("failure")
+
+        batcher = transcriptionserver.MicroBatcher(process_batch, max_batch_size=2, max_wait=0.01)
+        with self.assertRaises(RuntimeError):
+            batcher.submit(1)
+        batcher.stop()
+
+    def test_submit_timeout(self):
+        processed = []
+        release = threading.Event()
+
+        def process_batch(items):
+            release.wait()
+            processed.extend(items)
+            return items
+
+        batcher = transcriptionserver.MicroBatcher(process_batch, max_batch_size=1, max_wait=0.01, timeout=0.1)
+        # The first item blocks the batcher, the second one is given up and never processed
+        first = threading.Thread(target=lambda: self.assertRaises(TimeoutError, batcher.submit, "a"))
+        first.start()
+        time.sleep(0.05)
+        with self.assertRaises(TimeoutError):
+            batcher.submit("b")
+        first.join()
+        release.set()
+        batcher.stop()
+        self.assertEqual(processed, ["a"])
+
+
+class TestTranscriptionServer(unittest.TestCase):
+    @staticmethod
+    def build_wav(duration):
+        signal = (np.random.RandomState(42).uniform(-0.5, 0.5, int(16000 * duration)) * 32767).astype(np.int16)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(signal.tobytes())
+        return buffer.getvalue()
+
+    def setUp(self):
+        # The "model" transcribes a feature vector into its length
+        batcher = transcriptionserver.MicroBatcher(lambda feat_vecs: [str(len(f)) for f in feat_vecs],
+                                                   max_batch_size=4, max_wait=0.05)
+        audio_processor = audioprocessor.AudioProcessor(100, "fbank")
+        self.audio_processor = audio_processor
+        self.server = transcriptionserver.TranscriptionServer(("localhost", 0), audio_processor, batcher, 100)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://localhost:{0}/transcribe".format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.batcher.stop()
+        self.thread.join()
+
+    def post(self, data, audio_format="wav"):
+        request = urllib.request.Request(self.url + "?format=" + urllib.parse.quote(audio_format), data=data,
+                                         method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read().decode("utf-8"))
+
+    def test_transcribe(self):
+        data = self.build_wav(0.5)
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+            f.write(data)
+        _, expected_length = self.audio_processor.process_audio_file(f.name)
+        os.remove(f.name)
+
+        status, content = self.post(data)
+        self.assertEqual(status, 200)
+        self.assertEqual(content["transcript"], str(expected_length))
+
+    def test_too_long_audio_is_rejected(self):
+        status, content = self.post(self.build_wav(1.5))
+        self.assertEqual(status, 413)
+        self.assertIn("error", content)
+
+    def test_invalid_audio_is_rejected(self):
+        status, content = self.post(b"not an audio file")
+        self.assertEqual(status, 400)
+        self.assertIn("error", content)
+
+    def post_raw(self, headers, data):
+        connection = http.client.HTTPConnection("localhost", self.server.server_address[1])
+        connection.putrequest("POST", "/transcribe?format=wav")
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders()
+        connection.send(data)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read().decode("utf-8"))
+        connection.close()
+        return result
+
+    def test_invalid_content_length_is_rejected(self):
+        for content_length in ["abc", "-1"]:
+            status, content = self.post_raw({"Content-Length": content_length}, b"data")
+            self.assertEqual(status, 400)
+            self.assertIn("error", content)
+
+    def test_too_big_upload_is_rejected_before_reading(self):
+        # 1 s of audio (100 frames) in 32 bits stereo at 48 kHz and the headers
+        self.assertEqual(self.server.max_upload_size, 384000 + 65536)
+        # The body is not sent, the answer only depends on the announced size
+        status, content = self.post_raw({"Content-Length": str(10 ** 9)}, b"")
+        self.assertEqual(status, 413)
+        self.assertIn("error", content)
+
+    def test_unsupported_format_is_rejected(self):
+        for audio_format in ["../wav", "a/b", "exe"]:
+            status, content = self.post(self.build_wav(0.5), audio_format)
+            self.assertEqual(status, 400)
+            self.assertIn("error", content)
+        status, _ = self.post(self.build_wav(0.5), "WAV")
+        self.assertEqual(status, 200)
+
+    def test_timeout_returns_503(self):
+        release = threading.Event()
+
+        def process_batch(feat_vecs):
+            release.wait()
+            return [str(len(f)) for f in feat_vecs]
+
+        self.server.batcher.stop()
+        self.server.batcher = transcriptionserver.MicroBatcher(process_batch, max_batch_size=4, max_wait=0.01,
+                                                               timeout=0.1)
+        status, content = self.post(self.build_wav(0.5))
+        release.set()
+        self.assertEqual(status, 503)
+        self.assertIn("error", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+# coding=utf-8
+"""
+Local HTTP transcription server.
+
+The acoustic model is built and restored once and stays warm between requests. Each request uploads an audio file
+(raw bytes in the body of a POST request), its features are extracted in the request thread and then handed over to a
+MicroBatcher which gathers the concurrent requests into batches before running them through the model.
+
+Example :
+    $ python stt.py --server --port 8000
+    $ curl --data-binary @file.wav "http://localhost:8000/transcribe?format=wav"
+"""
+import os
+import json
+import logging
+import queue
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import util.audioprocessor as audioprocessor
+
+# Audio formats accepted in the "format" query parameter (the suffix of the temporary file the upload is written to)
+AUDIO_FORMATS = ["wav", "flac", "mp3", "sph", "ogg"]
+# Upper bound of the size of one second of uploaded audio (uncompressed 32 bits stereo at 48 kHz) and of the file
+# headers, used to reject an upload too long for the model before reading it
+MAX_BYTES_PER_SECOND = 48000 * 4 * 2
+MAX_HEADER_SIZE = 64 * 1024
+# Size of the chunks in which the upload is copied to the temporary file
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class _PendingRequest(object):
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    def __init__(self, process_batch, max_batch_size, max_wait, timeout=None):
+        """
+        Gather items submitted concurrently into batches and process each batch with a single call
+
+        A batch is processed as soon as it holds max_batch_size items or max_wait seconds after its first item arrived
+        An item whose result is not ready after timeout seconds is given up (TimeoutError) and left out of the batches
+
+        Parameters
+        ----------
+        :param process_batch: function taking a list of items and returning the list of their results (in order)
+        :param max_batch_size: maximum number of items in a batch
+        :param max_wait: maximum time (in seconds) an item waits for other items before its batch is processed
+        :param timeout: maximum time (in seconds) submit waits for the result of an item (None to wait forever)
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        Submit an item and wait for its result
+
+        :param item: the item to process
+        :return: the result of the item
+        """
+        request = _PendingRequest(item)
+        self._queue.put(request)
+        if not request.done.wait(self.timeout):
+            request.cancelled = True
+            raise TimeoutError("No result after {0} seconds".format(self.timeout))
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Process what we have, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # The items given up by their caller are not processed
+            batch = [request for request in batch if not request.cancelled]
+            if len(batch) == 0:
+                continue
+            try:
+                results = self.process_batch([request.item for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                logging.exception("Unable to process a batch of %d items", len(batch))
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+
+class _TranscriptionRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/transcribe":
+            self._send_json(404, {"error": "Unknown path {0}".format(url.path)})
+            return
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self._send_json(400, {"error": "Invalid Content-Length header"})
+            return
+        if content_length <= 0:
+            self._send_json(400, {"error": "No audio data in the request body"})
+            return
+        if content_length > self.server.max_upload_size:
+            self._send_json(413, {"error": "Audio data too big ({0} bytes, maximum is {1})"
+                                  .format(content_length, self.server.max_upload_size)})
+            return
+        audio_format = parse_qs(url.query).get("format", ["wav"])[0].lower()
+        if audio_format not in AUDIO_FORMATS:
+            self._send_json(400, {"error": "Unsupported audio format {0}, supported formats are {1}"
+                                  .format(audio_format, ", ".join(AUDIO_FORMATS))})
+            return
+
+        # The audio libraries read from files, so the upload is written to a temporary file
+        with tempfile.NamedTemporaryFile(suffix="." + audio_format, delete=False) as f:
+            remaining = content_length
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, UPLOAD_CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+            audio_file = f.name
+        try:
+            feat_vec, feat_vec_length = self.server.audio_processor.process_audio_file(audio_file)
+        except Exception as e:
+            self._send_json(400, {"error": "Unable to process the audio data : {0}".format(e)})
+            return
+        finally:
+            os.remove(audio_file)
+
+        if feat_vec_length > self.server.max_input_seq_length:
+            self._send_json(413, {"error": "Audio too long ({0} frames, maximum is {1})"
+                                  .format(feat_vec_length, self.server.max_input_seq_length)})
+            return
+        try:
+            transcript = self.server.batcher.submit(feat_vec)
+        except TimeoutError as e:
+            self._send_json(503, {"error": "The server is overloaded : {0}".format(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"transcript": transcript})
+
+    def _send_json(self, code, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, log_format, *args):
+        logging.debug("%s - " + log_format, self.address_string(), *args)
+
+
+class TranscriptionServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, audio_processor, batcher, max_input_seq_length, max_upload_size=None):
+        """
+        HTTP server answering "POST /transcribe" requests, each request is handled in its own thread
+
+        Parameters
+        ----------
+        :param server_address: a tuple (host, port)
+        :param audio_processor: the AudioProcessor used to extract the features of the uploaded audio
+        :param batcher: a MicroBatcher turning a batch of feature vectors into a batch of transcripts
+        :param max_input_seq_length: longest feature vector accepted
+        :param max_upload_size: biggest upload accepted, in bytes (if None, derived from max_input_seq_length and
+                                MAX_BYTES_PER_SECOND)
+        """
+        HTTPServer.__init__(self, server_address, _TranscriptionRequestHandler)
+        self.audio_processor = audio_processor
+        self.batcher = batcher
+        self.max_input_seq_length = max_input_seq_length
+        if max_upload_size is None:
+            max_upload_size = int(max_input_seq_length * audioprocessor.FRAME_STRIDE * MAX_BYTES_PER_SECOND) + \
+                MAX_HEADER_SIZE
+        self.max_upload_size = max_upload_size